@@ -0,0 +1,158 @@
+# Batch runner: many programs and input cases over a process pool.
+#
+#     python batch.py prog1.asm prog2.asm --input case1.txt --input case2.txt
+#     python batch.py --manifest jobs.jsonl --max-steps 1000000 --json
+#
+# Every program runs once per input file (or once with no input). A
+# manifest holds one JSON object per line instead:
+#
+#     {"program": "examples/CAT.ASM", "input": "case1.txt", "max_steps": 5000, "id": "cat-1"}
+#
+# where "input" may be replaced by inline text as "stdin", "watchdog": true
+# stops a job that provably loops forever, and every key but "program" is
+# optional. Jobs are spread over a concurrent.futures process
+# pool whose workers stay up for the whole batch and keep every program
+# they have decoded, keyed by the source's hash, so a program shared by many
+# jobs is decoded once per worker. Results are printed as jobs finish.
+
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+
+import main
+from bytecode import source_hash
+from streams import MemoryInput, to_char
+from vm import VM, HALTED
+from watchdog import WatchedVM, LOOPING
+
+# Worker-process cache: (path, source hash) -> (table, program)
+_programs = {}
+
+# Keyword arguments main.load_program gets in every worker
+_options = {}
+
+def _init_worker(cache_dir):
+    _options["cache_dir"] = cache_dir
+
+def _load(path):
+    with open(path, 'rb') as file:
+        digest = source_hash(file.read())
+    key = (path, digest)
+    decoded = _programs.get(key)
+    if decoded is None:
+        if _options.get("cache_dir") is not None or path.endswith(".sarc"):
+            # load_program maps a .sarc as it is, cache or not
+            decoded = main.load_program(path, _options.get("cache_dir"))
+        else:
+            decoded = main.read_program(path)
+        _programs[key] = decoded
+    return decoded
+
+def run_job(job):
+    # Runs one job dict and returns its result dict; never raises for a
+    # problem with the job itself
+    result = {"id": job.get("id"), "program": job["program"], "input": job.get("input")}
+    start = time.perf_counter()
+    output = []
+    try:
+        table, program = _load(job["program"])
+        if job.get("input") is not None:
+            with open(job["input"], 'rb') as file:
+                data = file.read().decode('utf-8', errors='replace')
+        else:
+            data = job.get("stdin", "")
+        machine = WatchedVM if job.get("watchdog") else VM
+        vm = machine(table, program, MemoryInput(data).getc, output.append)
+        try:
+            status = vm.run(job.get("max_steps"))
+            if status == LOOPING:
+                result["status"] = "infinite loop"
+                result["loop"] = str(vm.loop)
+            else:
+                result["status"] = "halted" if status == HALTED else "step limit"
+        except ZeroDivisionError:
+            result["status"] = "division by zero"
+        result["steps"] = vm.steps
+        result["registers"] = dict(zip(("p1", "p2", "acc", "a", "flag", "ohpc"), vm.registers()))
+    except (OSError, ValueError) as error:
+        result["status"] = "error"
+        result["error"] = str(error)
+    result["output"] = "".join(to_char(val) for val in output)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+def read_manifest(path):
+    jobs = []
+    with open(path, 'r', encoding='utf-8') as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            if not isinstance(job, dict) or "program" not in job:
+                raise ValueError(f"{path}:{number}: a job needs a \"program\"")
+            jobs.append(job)
+    return jobs
+
+def make_jobs(programs, inputs, max_steps=None, watchdog=False):
+    inputs = inputs or [None]
+    return [{"program": program, "input": data, "max_steps": max_steps, "watchdog": watchdog}
+            for program in programs for data in inputs]
+
+def run_batch(jobs, workers=None, cache_dir=None):
+    # Yields (index, result) for every job, in the order they finish
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                initargs=(cache_dir,)) as pool:
+        futures = {pool.submit(run_job, job): index for index, job in enumerate(jobs)}
+        for future in concurrent.futures.as_completed(futures):
+            yield futures[future], future.result()
+
+def describe(result):
+    name = result["program"] + (f" < {result['input']}" if result["input"] else "")
+    if result["id"] is not None:
+        name = f"{result['id']} ({name})"
+    if result["status"] == "error":
+        return f"{name}: error: {result['error']}"
+    registers = " ".join(f"{key.upper()}:{value}" for key, value in result["registers"].items())
+    if result["status"] == "infinite loop":
+        return f"{name}: {result['loop']} after {result['steps']} steps, output {result['output']!r}"
+    return f"{name}: {result['status']} after {result['steps']} steps, {registers}, output {result['output']!r}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many SARCASM programs over a process pool")
+    parser.add_argument("programs", nargs="*", help=".asm (or .sarc) files")
+    parser.add_argument("--input", action="append", default=[],
+                        help="input file; every program runs once per --input")
+    parser.add_argument("--manifest", help="JSON lines file of jobs")
+    parser.add_argument("--max-steps", type=int,
+                        help="step budget for jobs that do not set max_steps")
+    parser.add_argument("--watchdog", action="store_true",
+                        help="stop jobs that provably loop forever (see watchdog.py)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--cache-dir",
+                        help="load programs through .sarc files kept here")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per result")
+    args = parser.parse_args()
+
+    jobs = make_jobs(args.programs, args.input, args.max_steps, args.watchdog)
+    if args.manifest:
+        for job in read_manifest(args.manifest):
+            job.setdefault("max_steps", args.max_steps)
+            job.setdefault("watchdog", args.watchdog)
+            jobs.append(job)
+    if not jobs:
+        parser.error("no programs given")
+
+    failures = 0
+    for index, result in run_batch(jobs, args.jobs, args.cache_dir):
+        if result["status"] in ("error", "division by zero", "infinite loop"):
+            failures += 1
+        if args.json:
+            result["job"] = index
+            print(json.dumps(result), flush=True)
+        else:
+            print(describe(result), flush=True)
+    sys.exit(1 if failures else 0)
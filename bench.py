@@ -0,0 +1,343 @@
+# Benchmarks and conformance checks for the SARCASM execution engines.
+#
+#     python bench.py                 time every engine on every workload
+#     python bench.py --check         differential conformance run only
+#
+# Workloads are built from opcode lists with microinstructions_to_instruction,
+# so they double as a conformance corpus: every engine must leave the same
+# registers, memory and output as main.run_reference, the reference loop.
+# The first programs are also run through batch.run_job from their source
+# and from a .sarc of it, which must agree.
+
+import argparse
+import contextlib
+import io
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+import dataflow
+import lockstep
+import main
+from debugger import RecordingVM
+from profiler import Profile, run_profiled
+from streams import Console, MemoryInput, MemoryOutput
+
+# Memory cells compared by the conformance check
+CHECKED_CELLS = 64
+
+# Loop latch: counts memory[1] down and jumps back by memory[0] words until it
+# reaches zero. Leaves pointerOne at 0. Built only from 16/31/33/34, which
+# force known register values whatever state the loop body left behind.
+LATCH = [16, 31, 33, 3,        # pointerOne = 1
+         23,                   # memory[1] -= 1
+         18, 16, 31, 34, 33,   # registerA = memory[1], accumulator = 0
+         31,                   # checkFlag = (memory[1] == 0)
+         3,                    # pointerOne = 0
+         20]                   # back memory[0] words while the counter is non-zero
+
+def word(opcodes):
+    # Encodes opcodes as a word, padding with NOPs until the encoding round-trips
+    opcodes = list(opcodes)
+    while True:
+        text = main.microinstructions_to_instruction(opcodes)
+        if text and main.instruction_to_microinstructions(text) == opcodes:
+            return text
+        opcodes.append(35)
+
+def set_pointer(which, value):
+    # pointerOne/pointerTwo = value (>= 1) from any register state
+    return [16, 31, 33, 3 if which == 1 else 4] + [which] * (value - 1)
+
+def loop(body, exponent):
+    # Runs the body words 2 ** exponent times. memory[0] holds the jump
+    # distance and memory[1] the counter, so bodies must stay off cells 0-1.
+    distance = len(body) + 1
+    init = [10] + [21] * distance       # memory[0] = distance
+    init += [1, 10, 21, 21, 18, 16]     # memory[1] = 2, accumulator = 2
+    init += [14] * (exponent - 1)       # accumulator = 2 ** exponent
+    init += [27, 16, 31, 34, 33, 3]     # memory[1] = accumulator, pointerOne = 0
+    return [word(init)] + [word(ops) for ops in body] + [word(LATCH)]
+
+def random_ops(rng, pool, length):
+    return [rng.choice(pool) for _ in range(length)]
+
+def arithmetic(rng, scale):
+    pool = [12, 13, 14, 16, 17, 31, 32, 33, 34, 18]
+    body = [[18] + random_ops(rng, pool, 40) for _ in range(4)]
+    return loop(body, 6 + scale), b""
+
+def memory_shuffle(rng, scale):
+    pool = [1, 2, 7, 8, 9, 10, 11, 18, 19, 21, 22, 23, 24, 27, 28, 12, 16]
+    body = [set_pointer(1, 2) + set_pointer(2, 3) + random_ops(rng, pool, 40) for _ in range(4)]
+    return loop(body, 6 + scale), b""
+
+def outer_loop(rng, scale):
+    body = [[rng.choice([12, 13, 34, 35, 16])] for _ in range(60)]
+    return loop(body, 5 + scale), b""
+
+def echo(rng, scale):
+    # CAT.ASM: echoes input until a carriage return
+    cat = [10, 21, 18, 16, 12, 12, 12, 17, 13, 13, 13, 29, 18, 31, 34, 33, 14, 14, 30, 26]
+    text = bytes(rng.choice(b"abcdefghijklmnopqrstuvwxyz ") for _ in range(2000 << scale))
+    return [word(cat)], text + b"\r"
+
+def long_word(rng, scale):
+    pool = [1, 2, 7, 8, 12, 13, 14, 16, 17, 18, 19, 21, 22, 27, 28, 31, 33, 34]
+    body = set_pointer(1, 2) + set_pointer(2, 2) + random_ops(rng, pool, 5000)
+    return loop([body], 2 + scale), b""
+
+WORKLOADS = {
+    "arithmetic": arithmetic,
+    "memory-shuffle": memory_shuffle,
+    "outer-loop": outer_loop,
+    "echo": echo,
+    "long-word": long_word,
+}
+
+def run_optimized(table, program, console):
+    # The compiled backend's -O statistics line is noise here
+    with contextlib.redirect_stderr(io.StringIO()):
+        return main.run_compiled(table, program, console, optimize=True)
+
+def run_traced(table, program, console):
+    # As run_optimized: the tracer's statistics line is noise here
+    with contextlib.redirect_stderr(io.StringIO()):
+        return main.run_traced(table, program, console)
+
+def run_dataflow(table, program, console):
+    table, program, removed = dataflow.optimize(table, program)
+    return main.run_reference(table, program, console)
+
+def run_lockstep(table, program, console):
+    # A batch of one, fed the console's input
+    batch = lockstep.run_batch(table, program, [console.source.data])
+    for value in batch.output(0):
+        console.putc(value)
+    if batch.status(0) == lockstep.FAULTED:
+        raise ZeroDivisionError("integer division or modulo by zero")
+    return batch.memory(0), batch.registers(0)
+
+def run_recording(table, program, console):
+    # Reference semantics with the debugger's step recording on
+    vm = RecordingVM(table, program, console.getc, console.putc)
+    vm.run()
+    return vm.memory, vm.registers()
+
+def run_profile(table, program, console):
+    return main.run_profile(table, program, console, Profile(table, program))
+
+ENGINES = {
+    "reference": main.run_reference,
+    "compiled": main.run_compiled,
+    "c": main.run_c,
+    "optimized": run_optimized,
+    "traced": run_traced,
+    "dataflow": run_dataflow,
+    "lockstep": run_lockstep,
+    "profile": run_profile,
+    "recording": run_recording,
+}
+
+def execute(engine, table, program, data):
+    # Returns (outcome, output values); outcome is the final registers and
+    # first memory cells, or the name of the exception the program raised
+    console = Console(MemoryInput(data), MemoryOutput())
+    try:
+        memory, registers = engine(table, program, console)
+    except ArithmeticError as error:
+        return type(error).__name__, console.sink.values
+    return (registers, memory[:CHECKED_CELLS].tolist()), console.sink.values
+
+def corpus(rng, scale=0):
+    # Workload programs plus edge cases and random jump-free programs (which
+    # always terminate); yields (name, words, input)
+    for name, build in WORKLOADS.items():
+        words, data = build(rng, scale)
+        yield name, words, data
+    yield "wraparound", [word([23, 18, 16, 12, 17, 14, 2, 24, 19, 13, 28, 4, 27])], b""
+    yield "divide-by-zero", [word([30, 21, 18, 16, 15, 30, 10, 18, 15, 30])], b""
+    yield "forward-pc-jump", [word([21, 18, 16, 12, 12, 25, 30, 30, 30, 21, 30])], b""
+    yield "past-end-pc-jump", [word([23, 18, 16, 25, 30])], b""
+    yield "backward-pc-jump", [word([22, 12, 31, 21, 13, 19, 32, 13, 23, 17, 30, 30, 17, 26])], b""
+    yield "input-eof", [word([29, 30, 1] * 4)], "hé".encode("utf-8")
+    yield "surrogate-output", [word([10, 21, 21, 21, 18, 16, 14, 14, 23, 18] + [14] * 11 + [27, 30])], b""
+    yield "forward-word-jump", [word([21, 34, 20]), word([30]), word([21, 30])], b""
+    pool = [op for op in range(1, 37) if op not in (15, 20, 26)]
+    for n in range(40):
+        words = [word(random_ops(rng, pool, rng.randint(1, 24))) for _ in range(rng.randint(1, 8))]
+        yield f"random-{n}", words, bytes(rng.randrange(256) for _ in range(8))
+
+def check(engines, seed, verbose=False):
+    failures = 0
+    for name, words, data in corpus(random.Random(seed)):
+        table, program = main.decode_program(words)
+        expected = execute(main.run_reference, table, program, data)
+        for engine in engines:
+            got = execute(ENGINES[engine], table, program, data)
+            if got != expected:
+                failures += 1
+                print(f"MISMATCH {name} [{engine}]: expected {expected!r:.200} got {got!r:.200}")
+            elif verbose:
+                print(f"ok {name} [{engine}]")
+    return failures
+
+def check_batch(seed, verbose=False, count=12):
+    # batch.run_job on the first count corpus programs, once from source
+    # and once from the .sarc written for it; both must give the same result
+    import os
+    import tempfile
+
+    import batch
+    import bytecode
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        for number, (name, words, data) in enumerate(corpus(random.Random(seed))):
+            if number == count:
+                break
+            source = os.path.join(directory, f"{number}.asm")
+            with open(source, "w", encoding="utf-8") as file:
+                file.write(" ".join(words))
+            with open(source, "rb") as file:
+                digest = bytecode.source_hash(file.read())
+            compiled = os.path.join(directory, f"{number}.sarc")
+            bytecode.write(compiled, *main.decode_program(words), digest)
+            stdin = data.decode("utf-8", errors="replace")
+            results = []
+            for program in (source, compiled):
+                result = batch.run_job({"program": program, "stdin": stdin, "max_steps": 10_000_000})
+                results.append({key: result.get(key) for key in ("status", "error", "steps", "registers", "output")})
+            if results[0] != results[1]:
+                failures += 1
+                print(f"MISMATCH {name} [batch .sarc]: expected {results[0]!r:.200} got {results[1]!r:.200}")
+            elif verbose:
+                print(f"ok {name} [batch .sarc]")
+    return failures
+
+def measure(engine, words, data, memory_profile=True):
+    start = time.perf_counter()
+    table, program = main.decode_program(words)
+    decoded = time.perf_counter()
+    ENGINES[engine](table, (), Console())
+    startup = time.perf_counter() - decoded + (decoded - start)
+
+    console = Console(MemoryInput(data), MemoryOutput())
+    start = time.perf_counter()
+    ENGINES[engine](table, program, console)
+    elapsed = time.perf_counter() - start
+
+    peak = None
+    if memory_profile:
+        tracemalloc.start()
+        ENGINES[engine](table, program, Console(MemoryInput(data), MemoryOutput()))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return startup, elapsed, peak
+
+def benchmark(engines, workloads, scale, seed, memory_profile=True):
+    results = []
+    for name in workloads:
+        words, data = WORKLOADS[name](random.Random(seed), scale)
+        table, program = main.decode_program(words)
+        profile = Profile(table, program)
+        run_profiled(table, program, main.new_memory(), MemoryInput(data).getc, MemoryOutput().putc, profile)
+        steps = profile.steps()
+        for engine in engines:
+            startup, elapsed, peak = measure(engine, words, data, memory_profile)
+            results.append({
+                "workload": name,
+                "engine": engine,
+                "steps": steps,
+                "seconds": elapsed,
+                "steps_per_second": steps / elapsed if elapsed else None,
+                "startup_ms": startup * 1000,
+                "peak_kib": peak / 1024 if peak is not None else None,
+            })
+    return results
+
+def batch_benchmark(sizes, seed):
+    # The echo workload against many different inputs: lockstep batches
+    # against one VM per input
+    rng = random.Random(seed)
+    words, _ = echo(rng, 0)
+    table, program = main.decode_program(words)
+    results = []
+    for size in sizes:
+        inputs = [bytes(rng.choice(b"abcdefghijklmnopqrstuvwxyz ") for _ in range(rng.randint(32, 96))) + b"\r"
+                  for _ in range(size)]
+        row = {"instances": size}
+        for key, use in (("sequential", False), ("lockstep", True)):
+            if use and lockstep.np is None:
+                row[key] = None
+                continue
+            start = time.perf_counter()
+            batch = lockstep.run_batch(table, program, inputs, lockstep=use)
+            row[key] = time.perf_counter() - start
+            row["steps"] = sum(batch.steps(i) for i in range(size))
+        results.append(row)
+    return results
+
+def format_batch(results):
+    lines = [f"{'instances':>10}{'steps':>12}{'sequential s':>14}{'lockstep s':>12}{'Msteps/s':>10}{'speedup':>9}"]
+    for r in results:
+        if r["lockstep"] is None:
+            lines.append(f"{r['instances']:>10}{r['steps']:>12}{r['sequential']:>14.3f}{'(no numpy)':>12}")
+            continue
+        lines.append(f"{r['instances']:>10}{r['steps']:>12}{r['sequential']:>14.3f}{r['lockstep']:>12.3f}"
+                     f"{r['steps'] / r['lockstep'] / 1e6:>10.2f}{r['sequential'] / r['lockstep']:>9.1f}")
+    return "\n".join(lines)
+
+def format_results(results):
+    lines = [f"{'workload':<16}{'engine':<11}{'steps':>11}{'seconds':>10}{'Msteps/s':>10}{'startup ms':>12}{'peak KiB':>10}"]
+    for r in results:
+        peak = f"{r['peak_kib']:>10.0f}" if r["peak_kib"] is not None else f"{'-':>10}"
+        lines.append(f"{r['workload']:<16}{r['engine']:<11}{r['steps']:>11}{r['seconds']:>10.3f}"
+                     f"{r['steps_per_second'] / 1e6:>10.2f}{r['startup_ms']:>12.2f}" + peak)
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark and cross-check SARCASM engines")
+    parser.add_argument("--check", action="store_true", help="only run the conformance corpus")
+    parser.add_argument("--engines", default=",".join(ENGINES),
+                        help="comma separated engines (default: all)")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS),
+                        help="comma separated workloads (default: all)")
+    parser.add_argument("--scale", type=int, default=0, help="each step doubles the work")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch", metavar="SIZES",
+                        help="time lockstep batches of these comma separated sizes instead")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    engines = args.engines.split(",")
+    for engine in engines:
+        if engine not in ENGINES:
+            parser.error(f"unknown engine {engine!r}")
+
+    failures = check([engine for engine in engines if engine != "reference"], args.seed, args.verbose)
+    failures += check_batch(args.seed, args.verbose)
+    print(f"conformance: {failures} mismatches", file=sys.stderr)
+    if args.check:
+        sys.exit(1 if failures else 0)
+
+    if args.batch:
+        results = batch_benchmark([int(size) for size in args.batch.split(",")], args.seed)
+        if args.json:
+            for result in results:
+                print(json.dumps(result))
+        else:
+            print(format_batch(results))
+        sys.exit(1 if failures else 0)
+
+    results = benchmark(engines, args.workloads.split(","), args.scale, args.seed, not args.no_memory)
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        print(format_results(results))
+    sys.exit(1 if failures else 0)
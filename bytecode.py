@@ -0,0 +1,147 @@
+# Compiled .sarc programs.
+#
+# A .sarc file stores an already decoded program so it can be run without
+# tokenizing the source or re-deriving opcodes from letters. Layout (all
+# integers little-endian):
+#
+#     header   magic "SARC", version (u32), SHA-256 of the source (32 bytes),
+#              word count (u64), distinct word count (u64)
+#     program  one u32 per word: its slot in the word table, padded to 8 bytes
+#     offsets  one u64 per distinct word plus a final end offset, indexing
+#              into the opcode stream
+#     opcodes  every distinct word's opcodes, one byte per opcode
+#
+# load() maps the file with mmap and decodes nothing up front, so start-up
+# time does not grow with the size of the program.
+
+import array
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+from core import MNEMONICS
+
+MAGIC = b"SARC"
+VERSION = 1
+HEADER = struct.Struct("<4sI32sQQ")
+
+class BytecodeError(Exception):
+    pass
+
+def source_hash(data):
+    return hashlib.sha256(data).digest()
+
+def cache_path(source, digest, cache_dir=None):
+    # Next to the source by default (prog.asm -> prog.sarc); in cache_dir
+    # the artifact is named after the source's hash instead.
+    if cache_dir is None:
+        return os.path.splitext(source)[0] + ".sarc"
+    return os.path.join(cache_dir, digest.hex() + ".sarc")
+
+def _little_endian(values):
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+def write(path, table, program, digest):
+    index = array.array("I", program)
+    offsets = array.array("Q", [0])
+    for opcodes in table:
+        offsets.append(offsets[-1] + len(opcodes))
+    padding = b"\0" * (-4 * len(index) % 8)
+
+    # Write to a temporary name first so a reader never maps a half-written file
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, digest, len(index), len(table)))
+        file.write(_little_endian(index) + padding)
+        file.write(_little_endian(offsets))
+        for opcodes in table:
+            file.write(bytes(opcodes))
+    os.replace(temp, path)
+
+class WordTable:
+    # Sequence of opcode strings backed by the mapped opcode stream; each
+    # distinct word is sliced out once, the first time it is asked for.
+    def __init__(self, opcodes, offsets):
+        self.opcodes = opcodes
+        self.offsets = offsets
+        self.words = {}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, slot):
+        word = self.words.get(slot)
+        if word is None:
+            word = self.words[slot] = self.opcodes[self.offsets[slot]:self.offsets[slot + 1]].tobytes()
+        return word
+
+    def __iter__(self):
+        for slot in range(len(self)):
+            yield self[slot]
+
+class Bytecode:
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.map)
+        if len(view) < HEADER.size:
+            raise BytecodeError(f"{path}: truncated header")
+        magic, version, self.digest, words, distinct = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise BytecodeError(f"{path}: not a version {VERSION} .sarc file")
+
+        start = HEADER.size
+        end = start + 4 * words
+        offsets_start = end + (-end % 8)
+        offsets_end = offsets_start + 8 * (distinct + 1)
+        if len(view) < offsets_end:
+            raise BytecodeError(f"{path}: truncated index")
+        self.program = view[start:end].cast("I")
+        offsets = view[offsets_start:offsets_end].cast("Q")
+        if sys.byteorder != "little":
+            self.program = array.array("I", self.program)
+            self.program.byteswap()
+            offsets = array.array("Q", offsets)
+            offsets.byteswap()
+        if len(view) < offsets_end + offsets[-1]:
+            raise BytecodeError(f"{path}: truncated opcode stream")
+        self.table = WordTable(view[offsets_end:], offsets)
+
+    def close(self):
+        # Drop the views first; mmap refuses to close while they are alive
+        self.table = self.program = None
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def load(path):
+    return Bytecode(path)
+
+def load_matching(path, digest):
+    # Returns the Bytecode at path if it was built from source with this
+    # hash, else None (missing, stale or unreadable artifacts all miss).
+    try:
+        code = load(path)
+    except (OSError, ValueError, BytecodeError):
+        return None
+    if code.digest != digest:
+        code.close()
+        return None
+    return code
+
+def disassemble(table, program):
+    # Yields a listing of every word position of a loaded .sarc, reading
+    # opcodes straight from the mapped stream
+    for position, slot in enumerate(program):
+        opcodes = table[slot]
+        yield f"; word {position} (slot {slot}, {len(opcodes)} opcodes)"
+        for addr, op in enumerate(opcodes):
+            yield f"{addr:04X}: {MNEMONICS.get(op, f'UNKNOWN_{op}')}"
@@ -0,0 +1,224 @@
+# C backend.
+#
+# c_source(table) translates a decoded program's word table into one C
+# function,
+#
+#     int sarc_run(uint16_t *mem, const uint32_t *program, int64_t length,
+#                  int64_t *state, sarc_getc getc, sarc_putc putc)
+#
+# which runs the words named by program (table slots) from state (P1, P2,
+# ACC, A, CHKF, overheadPC) until overheadPC runs past length. Registers and
+# memory are uint16_t, so wraparound is the hardware's; every distinct word
+# is one case of a switch on its slot, words holding 25/26 dispatch on pc
+# with a second switch, and opcode 20 feeds the outer loop as in the
+# reference interpreter. Opcodes 29/30 call back into Python.
+#
+# The source is built with the system C compiler (CC, else cc, gcc or clang)
+# into a shared library cached under the hash of the source, and called
+# through ctypes. load() returns None when no compiler is available or the
+# build fails; main.run_c then falls back to the reference interpreter.
+# The one place the two differ is a negative overheadPC: no word can run
+# again, and instead of idling forever like the reference loop, run_c
+# raises NegativePCError.
+
+import array
+import ctypes
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# sarc_run results
+HALTED = 0
+FAULTED = 1    # opcode 15 with A == 0; state holds the registers at that point
+NEGATIVE = 2   # overheadPC went negative: no word can run again
+
+class NegativePCError(Exception):
+    # Raised by main.run_c on NEGATIVE, where the reference interpreter
+    # would idle forever
+    pass
+
+STATEMENTS = {
+    1:  "p1++;",
+    2:  "p2++;",
+    3:  "p1 = acc;",
+    4:  "p2 = acc;",
+    5:  "p1 = mem[p1];",
+    6:  "p2 = mem[p1];",
+    7:  "mem[p1] = mem[p2];",
+    8:  "mem[p2] = mem[p1];",
+    9:  "{ uint16_t t = mem[p1]; mem[p1] = mem[p2]; mem[p2] = t; }",
+    10: "mem[p1] = 0;",
+    11: "mem[p2] = 0;",
+    12: "acc += a;",
+    13: "acc -= a;",
+    14: "acc = (uint16_t)((uint32_t)acc * a);",
+    15: "if (a == 0) goto fault; acc /= a;",
+    16: "acc = a;",
+    17: "acc = (uint16_t)((uint32_t)acc * acc);",
+    18: "a = mem[p1];",
+    19: "a = mem[p2];",
+    20: "jm = flag == 1 ? (int64_t)mem[p1] : -(int64_t)mem[p1];",
+    21: "mem[p1]++;",
+    22: "mem[p2]++;",
+    23: "mem[p1]--;",
+    24: "mem[p2]--;",
+    27: "mem[p1] = acc;",
+    28: "mem[p2] = acc;",
+    29: "{ int c = getc(); if (c >= 0) mem[p1] = (uint16_t)c; }",
+    30: "putc(mem[p1]);",
+    31: "flag = acc == a;",
+    32: "flag = acc < a;",
+    33: "acc = flag;",
+    34: "flag = 1 - flag;",
+    35: ";",
+    36: ";",
+}
+
+PROLOGUE = """\
+#include <stdint.h>
+
+typedef int (*sarc_getc)(void);
+typedef void (*sarc_putc)(int);
+
+#ifdef _WIN32
+__declspec(dllexport)
+#endif
+int sarc_run(uint16_t *mem, const uint32_t *program, int64_t length, int64_t *state,
+             sarc_getc getc, sarc_putc putc)
+{
+    uint16_t p1 = (uint16_t)state[0], p2 = (uint16_t)state[1], acc = (uint16_t)state[2], a = (uint16_t)state[3];
+    uint16_t flag = (uint16_t)state[4];
+    int64_t ohpc = state[5], jm, pc;
+    int status = 0;
+    (void)pc;
+
+    while (ohpc < length) {
+        if (ohpc < 0) {
+            status = 2;
+            goto done;
+        }
+        jm = 0;
+        switch (program[ohpc]) {
+"""
+
+EPILOGUE = """\
+        }
+        ohpc += jm + 1;
+    }
+    goto done;
+fault:
+    status = 1;
+done:
+    state[0] = p1; state[1] = p2; state[2] = acc; state[3] = a; state[4] = flag; state[5] = ohpc;
+    return status;
+}
+"""
+
+def word_source(slot, opcodes):
+    # One case of the slot switch
+    lines = [f"        case {slot}: {{"]
+    if not any(op in (25, 26) for op in opcodes):
+        lines += [f"            {STATEMENTS[op]}" for op in opcodes]
+    else:
+        lines += [f"            pc = 0;",
+                  f"        w{slot}:",
+                  f"            if (pc >= {len(opcodes)}) break;",
+                  f"            switch (pc) {{"]
+        for pc, op in enumerate(opcodes):
+            if op == 25:
+                statement = f"pc = {pc + 1} + (int64_t)acc; goto w{slot};"
+            elif op == 26:
+                statement = f"pc = {pc + 1} - (int64_t)acc; if (pc < 0) pc = 0; goto w{slot};"
+            else:
+                statement = STATEMENTS[op]
+            lines.append(f"            case {pc}: {statement}")
+        lines.append("            }")
+    lines.append("            break;")
+    lines.append("        }")
+    return "\n".join(lines)
+
+def c_source(table):
+    return PROLOGUE + "\n".join(word_source(slot, opcodes) for slot, opcodes in enumerate(table)) + "\n" + EPILOGUE
+
+def find_compiler():
+    if os.environ.get("CC"):
+        return os.environ["CC"]
+    for name in ("cc", "gcc", "clang"):
+        if shutil.which(name):
+            return name
+    return None
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "sarcasm")
+
+def build(source, cache_dir=None):
+    # Path of the shared library for source, compiling it if it is not
+    # cached yet; None if there is no compiler or it fails
+    compiler = find_compiler()
+    if compiler is None:
+        return None
+    cache_dir = cache_dir or default_cache_dir()
+    digest = hashlib.sha256(f"{compiler}\0{source}".encode()).hexdigest()
+    path = os.path.join(cache_dir, digest + (".dll" if sys.platform.startswith("win") else ".so"))
+    if os.path.exists(path):
+        return path
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=cache_dir) as work:
+            c_path = os.path.join(work, "program.c")
+            out = os.path.join(work, "program.so")
+            with open(c_path, "w", encoding="ascii") as file:
+                file.write(source)
+            subprocess.run([compiler, "-O2", "-shared", "-fPIC", "-o", out, c_path],
+                           check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            os.replace(out, path)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return path
+
+GETC = ctypes.CFUNCTYPE(ctypes.c_int)
+PUTC = ctypes.CFUNCTYPE(None, ctypes.c_int)
+
+class Program:
+    # A compiled word table; run() executes any program over it
+    def __init__(self, path):
+        self.library = ctypes.CDLL(path)
+        self.function = self.library.sarc_run
+        self.function.restype = ctypes.c_int
+        self.function.argtypes = (ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int64,
+                                  ctypes.POINTER(ctypes.c_int64), GETC, PUTC)
+
+    def run(self, program, memory, getc, putc, registers=(0, 0, 0, 0, 0, 0)):
+        # Returns (status, registers). memory is an array('H') of 65536
+        # cells, updated in place.
+        slots = program if isinstance(program, array.array) and program.typecode == "I" else array.array("I", program)
+        state = (ctypes.c_int64 * 6)(*registers)
+
+        def read():
+            value = getc()
+            return -1 if value is None else value & 0xFFFF
+
+        # Keep the callbacks referenced for the whole call
+        read_callback = GETC(read)
+        write_callback = PUTC(putc)
+        memory_address = memory.buffer_info()[0]
+        slots_address = slots.buffer_info()[0] if len(slots) else None
+        status = self.function(memory_address, slots_address, len(slots), state, read_callback, write_callback)
+        return status, tuple(state)
+
+_loaded = {}
+
+def load(table, cache_dir=None):
+    # Program for table, or None when it cannot be compiled
+    source = c_source(table)
+    path = build(source, cache_dir)
+    if path is None:
+        return None
+    compiled = _loaded.get(path)
+    if compiled is None:
+        compiled = _loaded[path] = Program(path)
+    return compiled
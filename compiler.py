@@ -0,0 +1,166 @@
+# Compiles decoded words into plain Python functions.
+#
+# Every compiled word has the signature
+#     word(memory, pointerOne, pointerTwo, accumulator, registerA, checkFlag, getc, putc)
+# and returns the updated (pointerOne, pointerTwo, accumulator, registerA,
+# checkFlag, jumpModification). getc() returns the next input character code
+# (or None to leave the cell alone) and putc(value) outputs one cell.
+#
+# A word holding 25/26 can be entered at any pc, so it becomes a loop over
+# a switch on pc with one leaf per pc. To keep that from costing CHUNK
+# statements per pc, the leaf entered at pc only runs up to the next
+# multiple of the largest power of two dividing pc (CHUNK at most), then
+# goes back through the switch: from any pc, a few short leaves reach a
+# CHUNK-aligned one, and from there the aligned leaves run CHUNK opcodes
+# each. Every opcode then appears in about log2(CHUNK) / 2 + 1 leaves on
+# average instead of up to CHUNK.
+#
+# Compiled words are cached by opcodes, up to CACHED_WORDS of them, least
+# recently used first out.
+
+import collections
+
+import peephole
+
+# Straight-line Python for each opcode, written against the locals of a word
+STATEMENTS = {
+    1:  "p1 = (p1 + 1) & 65535",
+    2:  "p2 = (p2 + 1) & 65535",
+    3:  "p1 = acc",
+    4:  "p2 = acc",
+    5:  "p1 = mem[p1]",
+    6:  "p2 = mem[p1]",
+    7:  "mem[p1] = mem[p2]",
+    8:  "mem[p2] = mem[p1]",
+    9:  "mem[p1], mem[p2] = mem[p2], mem[p1]",
+    10: "mem[p1] = 0",
+    11: "mem[p2] = 0",
+    12: "acc = (acc + a) & 65535",
+    13: "acc = (acc - a) & 65535",
+    14: "acc = (acc * a) & 65535",
+    15: "acc //= a",
+    16: "acc = a",
+    17: "acc = (acc * acc) & 65535",
+    18: "a = mem[p1]",
+    19: "a = mem[p2]",
+    20: "jm = mem[p1] if flag else -mem[p1]",
+    21: "mem[p1] = (mem[p1] + 1) & 65535",
+    22: "mem[p2] = (mem[p2] + 1) & 65535",
+    23: "mem[p1] = (mem[p1] - 1) & 65535",
+    24: "mem[p2] = (mem[p2] - 1) & 65535",
+    27: "mem[p1] = acc",
+    28: "mem[p2] = acc",
+    29: "c = getc()\nif c is not None: mem[p1] = c & 65535",
+    30: "putc(mem[p1])",
+    31: "flag = 1 if acc == a else 0",
+    32: "flag = 1 if acc < a else 0",
+    33: "acc = flag",
+    34: "flag = 1 - flag",
+    35: "pass",
+    36: "pass",
+}
+
+# Statements for the superinstructions produced by peephole.optimize()
+SUPERINSTRUCTIONS = {
+    "acc_add":     "acc = (acc + {0} * a) & 65535",
+    "acc_mul":     "acc = (acc * pow(a, {0}, 65536)) & 65535",
+    "acc_pow":     "acc = pow(acc, {0}, 65536)",
+    "p1_add":      "p1 = (p1 + {0}) & 65535",
+    "p2_add":      "p2 = (p2 + {0}) & 65535",
+    "p1_cell_add": "mem[p1] = (mem[p1] + {0}) & 65535",
+    "p2_cell_add": "mem[p2] = (mem[p2] + {0}) & 65535",
+    "p1_cell_set": "mem[p1] = {0}",
+    "p2_cell_set": "mem[p2] = {0}",
+}
+
+JUMPS = (25, 26)
+
+# Longest run a jump word executes per dispatch before re-entering the pc switch
+CHUNK = 32
+
+# Compiled words kept by compile_word
+CACHED_WORDS = 4096
+
+_cache = collections.OrderedDict()
+
+def _indent(lines, depth):
+    pad = "    " * depth
+    return [pad + line for stmt in lines for line in stmt.split("\n")]
+
+def _statement(instr):
+    if isinstance(instr, int):
+        return STATEMENTS[instr]
+    return SUPERINSTRUCTIONS[instr[0]].format(instr[1])
+
+def _straight(opcodes, optimize, stats):
+    if optimize:
+        opcodes, removed = peephole.optimize(opcodes)
+        if stats is not None:
+            stats[0] += removed
+    return [_statement(instr) for instr in opcodes]
+
+def _leaf_end(opcodes, start):
+    # Last pc of the leaf entered at start: the next 25/26, or the pc before
+    # the next multiple of start's lowest set bit (CHUNK for 0 and beyond)
+    span = min(start & -start or CHUNK, CHUNK)
+    end = start
+    while end < len(opcodes) - 1 and end - start < span - 1 and opcodes[end] not in JUMPS:
+        end += 1
+    return end
+
+def _leaf(opcodes, start, optimize, stats):
+    # Code run when control enters the word at pc == start: straight-line up
+    # to the next 25/26 or _leaf_end's boundary, then compute the next pc.
+    end = _leaf_end(opcodes, start)
+    op = opcodes[end]
+    if op == 25:
+        return _straight(opcodes[start:end], optimize, stats) + [f"pc = {end + 1} + acc"]
+    if op == 26:
+        return _straight(opcodes[start:end], optimize, stats) + [f"pc = {end + 1} - acc", "if pc < 0: pc = 0"]
+    return _straight(opcodes[start:end + 1], optimize, stats) + [f"pc = {end + 1}"]
+
+def _switch(opcodes, lo, hi, depth, optimize, stats, leaders):
+    # Binary search over pc in [lo, hi) selecting the matching leaf
+    if hi - lo == 1:
+        return _indent(_leaf(opcodes, lo, optimize, stats if lo in leaders else None), depth)
+    mid = (lo + hi) // 2
+    return (_indent([f"if pc < {mid}:"], depth)
+            + _switch(opcodes, lo, mid, depth + 1, optimize, stats, leaders)
+            + _indent(["else:"], depth)
+            + _switch(opcodes, mid, hi, depth + 1, optimize, stats, leaders))
+
+def word_source(opcodes, optimize=False):
+    # Returns (source, removed). removed counts the microinstructions the
+    # peephole pass dropped along the word's fall-through path.
+    stats = [0]
+    lines = ["def word(mem, p1, p2, acc, a, flag, getc, putc):", "    jm = 0"]
+    if any(op in JUMPS for op in opcodes):
+        lines += ["    pc = 0", f"    while pc < {len(opcodes)}:"]
+        # Leaves that tile the word from pc 0, used for the removed count
+        leaders = {0}
+        start = 0
+        while start < len(opcodes):
+            start = _leaf_end(opcodes, start) + 1
+            leaders.add(start)
+        lines += _switch(opcodes, 0, len(opcodes), 2, optimize, stats, leaders)
+    else:
+        lines += _indent(_straight(opcodes, optimize, stats), 1)
+    lines.append("    return p1, p2, acc, a, flag, jm")
+    return "\n".join(lines), stats[0]
+
+def compile_word(opcodes, optimize=False):
+    # The returned function carries the peephole saving as word.removed
+    opcodes = tuple(opcodes)
+    key = (opcodes, optimize)
+    word = _cache.get(key)
+    if word is not None:
+        _cache.move_to_end(key)
+        return word
+    source, removed = word_source(opcodes, optimize)
+    namespace = {}
+    exec(compile(source, "<sarcasm word>", "exec"), namespace)
+    word = _cache[key] = namespace["word"]
+    word.removed = removed
+    if len(_cache) > CACHED_WORDS:
+        _cache.popitem(last=False)
+    return word
@@ -0,0 +1,432 @@
+# Core SARCASM primitives shared by main.py, workspace.py and the tools.
+#
+# Word <-> opcode conversions (the plain loops and the subquadratic fast_*
+# versions for very long words), decode_program, the opcode mnemonics and
+# disassemble, flat VM memory, and the legacy UInt16 types. Importing this
+# does no work beyond defining them: terminal handling is set up on the
+# first getch() call and memory is only allocated by new_memory().
+
+import array
+import math
+import sys
+
+MNEMONICS = {
+    1:  "INC PTR1",                 # pointerOne += 1
+    2:  "INC PTR2",                 # pointerTwo += 1
+    3:  "MOV PTR1, ACC",            # pointerOne = accumulator
+    4:  "MOV PTR2, ACC",            # pointerTwo = accumulator
+    5:  "MOV PTR1, $PTR1",          # pointerOne = memory[pointerOne]
+    6:  "MOV PTR2, $PTR1",          # pointerTwo = memory[pointerOne]
+    7:  "MOV $PTR1, $PTR2",         # memory[pointerOne] = memory[pointerTwo]
+    8:  "MOV $PTR2, $PTR1",         # memory[pointerTwo] = memory[pointerOne]
+    9:  "SWAP $PTR1, $PTR2",        # swap memory[pointerOne], memory[pointerTwo]
+    10: "CLR $PTR1",                # memory[pointerOne] = 0
+    11: "CLR $PTR2",                # memory[pointerTwo] = 0
+    12: "ADD ACC, REGA",            # accumulator += registerA
+    13: "SUB ACC, REGA",            # accumulator -= registerA
+    14: "MUL ACC, REGA",            # accumulator *= registerA
+    15: "DIV ACC, REGA",            # accumulator //= registerA
+    16: "MOV ACC, REGA",            # accumulator = registerA
+    17: "SQR ACC",                  # accumulator = accumulator^2
+    18: "MOV REGA, $PTR1",          # registerA = memory[pointerOne]
+    19: "MOV REGA, $PTR2",          # registerA = memory[pointerTwo]
+    20: "JMP $PTR1, CF",            # jump backwards by $PTR1 if checkflag is 0 jump fowards by $PTR1 if checkflag is 1
+    21: "INC $PTR1",                # memory[pointerOne] += 1
+    22: "INC $PTR2",                # memory[pointerTwo] += 1
+    23: "DEC $PTR1",                # memory[pointerOne] -= 1
+    24: "DEC $PTR2",                # memory[pointerTwo] -= 1
+    25: "JMP ADD PC, ACC",          # program counter += accumulator
+    26: "JMP SUB PC, ACC",          # program counter -= accumulator
+    27: "MOV $PTR1, ACC",           # memory[pointerOne] = accumulator
+    28: "MOV $PTR2, ACC",           # memory[pointerTwo] = accumulator
+    29: "IN $PTR1",                 # input char to memory[pointerOne]
+    30: "OUT $PTR1",                # output char from memory[pointerOne]
+    31: "CMP EQ ACC, REGA",         # checkFlag = (acc == registerA) ? 1 : 0
+    32: "CMP LT ACC, REGA",         # checkFlag = (acc < registerA) ? 1 : 0
+    33: "MOV ACC, FLAG",            # accumulator = checkFlag
+    34: "NOT FLAG",                 # checkFlag = 1 - checkFlag
+    35: "NOP",
+    36: "NOP"
+}
+
+def disassemble(opcodes):
+    lines = []
+    for addr, code in enumerate(opcodes):
+        instr = MNEMONICS.get(code, f"UNKNOWN_{code}")
+        lines.append(f"{addr:04X}: {instr}")
+    return "\n".join(lines)
+
+def getch():
+    # One raw keystroke; the platform's terminal module is imported on first use
+    if sys.platform.startswith('win'):
+        import msvcrt
+        return msvcrt.getch().decode('utf-8', errors='ignore')
+    import termios
+    import tty
+
+    fd = sys.stdin.fileno()
+    old_settings = termios.tcgetattr(fd)
+    try:
+        tty.setraw(fd)
+        ch = sys.stdin.read(1)
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
+    return ch
+
+class UInt16:
+    def __init__(self, value):
+        self.value = value & 0xFFFF  # Force 16-bit range
+
+    def __int__(self):
+        return self.value
+
+    # Arithmetic operations
+    def __add__(self, other):
+        return UInt16(self.value + int(other))
+
+    def __sub__(self, other):
+        return UInt16(self.value - int(other))
+
+    def __mul__(self, other):
+        return UInt16(self.value * int(other))
+
+    def __floordiv__(self, other):
+        return UInt16(self.value // int(other))
+
+    def __pow__(self, power, modulo=None):
+        return UInt16(pow(self.value, int(power), 0x10000))
+
+    # In-place variants (return new objects to prevent aliasing bugs)
+    def __iadd__(self, other):
+        return self.__add__(other)
+
+    def __isub__(self, other):
+        return self.__sub__(other)
+
+    def __imul__(self, other):
+        return self.__mul__(other)
+
+    def __ifloordiv__(self, other):
+        return self.__floordiv__(other)
+
+    # Comparisons
+    def __eq__(self, other):
+        return self.value == int(other)
+
+    def __lt__(self, other):
+        return self.value < int(other)
+
+    def __le__(self, other):
+        return self.value <= int(other)
+
+    def __gt__(self, other):
+        return self.value > int(other)
+
+    def __ge__(self, other):
+        return self.value >= int(other)
+
+    # String representation
+    def __repr__(self):
+        return str(self.value)
+
+    def __str__(self):
+        return str(self.value)
+
+class UInt16Array:
+    def __init__(self, size):
+        self.max_value = 2**16
+        self.data = [UInt16(0) for _ in range(size)]
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(value, UInt16):
+            self.data[index] = value
+        else:
+            self.data[index] = UInt16(value)
+
+    def __len__(self):
+        return len(self.data)
+
+def new_memory(size=65536):
+    # Flat 16-bit memory: one 128 KiB buffer instead of a UInt16 per cell
+    return array.array('H', bytes(2 * size))
+
+def shuffle(n):
+    # Swap even and odd:
+    if n % 2 == 0:
+        n = n + 1
+    else:
+        n = n - 1
+    
+    # Then swap mod3 pairs on the new n:
+    r = n % 3
+    base = n - r
+    if r == 0:
+        return base + 2
+    elif r == 2:
+        return base + 0
+    else:
+        return n
+
+def fetch(s: str) -> int:
+    filtered = ''.join(ch.lower() for ch in s if ch.isalpha())
+    result = 0
+    for ch in filtered:
+        digit = ord(ch) - ord('a') + 1  # 1-26 instead of 0-25
+        result = result * 26 + digit
+    return result
+
+def to_base_n_1_indexed(num, base):
+    if num <= 0:
+        raise ValueError("Number must be positive")
+
+    digits = []
+    n = num
+    while n > 0:
+        remainder = (n - 1) % base + 1  # digits 1..N
+        digits.append(remainder)
+        n = (n - 1) // base
+    digits.reverse()
+    return digits
+
+def microinstructions_to_instruction(digits, base=36):
+    # Step 1: digits -> number
+    num = 0
+    for d in digits:
+        if d < 1 or d > base:
+            raise ValueError(f"Digit {d} out of range for base {base}")
+        num = num * base + d
+    
+    # Step 2: Undo the +1 added after shuffle
+    num -= 1
+    
+    # Step 3: Undo shuffle
+    r = num % 3
+    base_val = num - r
+
+    if r == 2:
+        m = base_val + 0
+    elif r == 0:
+        m = base_val + 2
+    else:
+        m = num
+
+    if m % 2 == 0:
+        original_num = m + 1
+    else:
+        original_num = m - 1
+
+    # Step 4: Convert number back to string
+    # Inverse of fetch: number to letters (a=1,...z=26)
+    letters = []
+    n = original_num
+    while n > 0:
+        n, remainder = divmod(n - 1, 26)
+        letters.append(chr(ord('a') + remainder))
+    letters.reverse()
+    return ''.join(letters)
+
+def instruction_to_microinstructions(word):
+    wordz = fetch(word)
+    wordz = shuffle(wordz)
+    base = 36
+    wordz += 1
+    array = to_base_n_1_indexed(wordz, base)
+    return array
+
+# Fast conversions for very long words.
+#
+# fetch, to_base_n_1_indexed and microinstructions_to_instruction build up or
+# take apart one big integer a digit at a time, which is quadratic in the
+# length of the word. The fast_* versions split the digits in half
+# recursively, so the work becomes a few big multiplications (Karatsuba in
+# CPython) and divisions (Burnikel-Ziegler below) of balanced size. They
+# return exactly what the originals return; check_conversions() compares them.
+#
+# Bijective digits d (1..base) are handled as ordinary digits d - 1 plus a
+# repunit: for L digits, sum(d * base**i) == sum((d - 1) * base**i) + R(L)
+# with R(L) = (base**L - 1) // (base - 1). A number n has L bijective digits
+# for the largest L with R(L) <= n.
+
+# Digits below which the plain loops are used
+CONVERSION_CUTOFF = 512
+
+# Bits of quotient below which the builtin divmod is used
+DIVISION_CUTOFF = 4000
+
+LETTERS_TO_DIGITS = str.maketrans("abcdefghijklmnopqrstuvwxyz", "0123456789abcdefghijklmnop")
+DIGITS_TO_LETTERS = bytes.maketrans(bytes(range(26)), b"abcdefghijklmnopqrstuvwxyz")
+DIGITS_TO_TEXT = bytes.maketrans(bytes(range(1, 37)), b"0123456789abcdefghijklmnopqrstuvwxyz")
+
+def _power(base, k, powers):
+    p = powers.get(k)
+    if p is None:
+        p = powers[k] = base ** k
+    return p
+
+def _repunit(base, length, powers):
+    return (_power(base, length, powers) - 1) // (base - 1)
+
+def _bijective_length(n, base, powers):
+    # Largest L with R(L) <= n, i.e. base**L <= n * (base - 1) + 1
+    limit = n * (base - 1) + 1
+    length = max(0, int((limit.bit_length() - 1) / math.log2(base)) - 1)
+    while _power(base, length + 1, powers) <= limit:
+        length += 1
+    while length and _power(base, length, powers) > limit:
+        length -= 1
+    return length
+
+def _div2n1n(a, b, n):
+    # divmod(a, b) for b of exactly n bits and a < b << n, by dividing the
+    # top three half-size pieces and then the bottom three
+    if a.bit_length() - n <= DIVISION_CUTOFF:
+        return divmod(a, b)
+    pad = n & 1
+    if pad:
+        a <<= 1
+        b <<= 1
+        n += 1
+    half = n >> 1
+    mask = (1 << half) - 1
+    b1, b2 = b >> half, b & mask
+    q1, r = _div3n2n(a >> n, (a >> half) & mask, b, b1, b2, half)
+    q2, r = _div3n2n(r, a & mask, b, b1, b2, half)
+    if pad:
+        r >>= 1
+    return q1 << half | q2, r
+
+def _div3n2n(a12, a3, b, b1, b2, n):
+    if a12 >> n == b1:
+        q, r = (1 << n) - 1, a12 - (b1 << n) + b1
+    else:
+        q, r = _div2n1n(a12, b1, n)
+    r = (r << n | a3) - q * b2
+    while r < 0:
+        q -= 1
+        r += b
+    return q, r
+
+def _parse(text, lo, hi, base, powers):
+    # int(text[lo:hi], base) for base <= 36
+    if hi - lo <= CONVERSION_CUTOFF:
+        return int(text[lo:hi], base)
+    mid = (lo + hi) // 2
+    return _parse(text, lo, mid, base, powers) * _power(base, hi - mid, powers) + _parse(text, mid, hi, base, powers)
+
+def _combine(digits, lo, hi, base, powers):
+    # digits[lo:hi] as a number, for digits of any size
+    if hi - lo <= CONVERSION_CUTOFF:
+        n = 0
+        for d in digits[lo:hi]:
+            n = n * base + d
+        return n
+    mid = (lo + hi) // 2
+    return _combine(digits, lo, mid, base, powers) * _power(base, hi - mid, powers) + _combine(digits, mid, hi, base, powers)
+
+def _split(n, length, base, powers, out):
+    # Appends the length digits (0..base-1) of n < base**length to out,
+    # most significant first
+    if length <= CONVERSION_CUTOFF:
+        digits = [0] * length
+        for i in range(length - 1, -1, -1):
+            n, digits[i] = divmod(n, base)
+        out.extend(digits)
+        return
+    low = (length + 1) // 2
+    p = _power(base, low, powers)
+    high, n = _div2n1n(n, p, p.bit_length())
+    _split(high, length - low, base, powers, out)
+    _split(n, low, base, powers, out)
+
+def _bijective_digits(n, base, powers):
+    # Bijective digits of n > 0 minus one, i.e. 0..base-1
+    length = _bijective_length(n, base, powers)
+    digits = bytearray() if base <= 256 else []
+    _split(n - _repunit(base, length, powers), length, base, powers, digits)
+    return digits
+
+def fast_fetch(s: str) -> int:
+    filtered = ''.join(ch.lower() for ch in s if ch.isalpha())
+    if not filtered:
+        return 0
+    powers = {}
+    if filtered.isascii():
+        # Only a-z lower to ASCII letters
+        text = filtered.translate(LETTERS_TO_DIGITS)
+        return _parse(text, 0, len(text), 26, powers) + _repunit(26, len(text), powers)
+    # Other letters give digits past 26, which fetch adds in all the same
+    digits = [ord(ch) - ord('a') + 1 for ch in filtered]
+    return _combine(digits, 0, len(digits), 26, powers)
+
+def fast_to_base_n_1_indexed(num, base):
+    if num <= 0:
+        raise ValueError("Number must be positive")
+    if base < 2 or num.bit_length() < 4 * CONVERSION_CUTOFF:
+        return to_base_n_1_indexed(num, base)
+    return [d + 1 for d in _bijective_digits(num, base, {})]
+
+def fast_microinstructions_to_instruction(digits, base=36):
+    # Step 1: digits -> number
+    digits = list(digits)
+    if len(digits) < CONVERSION_CUTOFF:
+        return microinstructions_to_instruction(digits, base)
+    if digits and (min(digits) < 1 or max(digits) > base):
+        for d in digits:
+            if d < 1 or d > base:
+                raise ValueError(f"Digit {d} out of range for base {base}")
+    powers = {}
+    if 2 <= base <= 36:
+        text = bytes(digits).translate(DIGITS_TO_TEXT).decode('ascii')
+        num = _parse(text, 0, len(text), base, powers) + _repunit(base, len(text), powers) if text else 0
+    else:
+        num = _combine(digits, 0, len(digits), base, powers)
+
+    # Step 2: Undo the +1 added after shuffle
+    num -= 1
+
+    # Step 3: Undo shuffle
+    r = num % 3
+    base_val = num - r
+
+    if r == 2:
+        m = base_val + 0
+    elif r == 0:
+        m = base_val + 2
+    else:
+        m = num
+
+    if m % 2 == 0:
+        original_num = m + 1
+    else:
+        original_num = m - 1
+
+    # Step 4: Convert number back to string
+    if original_num <= 0:
+        return ''
+    return _bijective_digits(original_num, 26, {}).translate(DIGITS_TO_LETTERS).decode('ascii')
+
+def fast_instruction_to_microinstructions(word):
+    wordz = fast_fetch(word)
+    wordz = shuffle(wordz)
+    base = 36
+    wordz += 1
+    array = fast_to_base_n_1_indexed(wordz, base)
+    return array
+
+def decode_program(words):
+    # Decode every distinct word once, up front. Returns (table, program):
+    # table holds one opcode tuple per unique word and program maps each
+    # word position to its entry in table.
+    index = {}
+    table = []
+    program = []
+    for word in words:
+        slot = index.get(word)
+        if slot is None:
+            slot = index[word] = len(table)
+            table.append(tuple(fast_instruction_to_microinstructions(word)))
+        program.append(slot)
+    return tuple(table), tuple(program)
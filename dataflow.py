@@ -0,0 +1,436 @@
+# Whole-program dataflow optimizer.
+#
+# analyze() runs constant propagation over the decoded program with one
+# node per word position. Every run starts from known state (registers 0,
+# memory all 0), so the pointers, accumulator, registerA, checkFlag and any
+# memory cell at a fixed address stay known until an input (29), a division
+# or an unknown address makes them unknowable; after a 16, accumulator ==
+# registerA is tracked even when their value is not. Opcode 20 edges are
+# resolved from memory[pointerOne], both ways when the flag is unknown; when
+# the distance is unknown the jump can land on any word, and everything
+# reachable from it is joined with that state (the analysis gives up on
+# precision there, never on correctness).
+#
+# optimize() then rewrites each reachable word that has no 25/26 (those are
+# pc-relative, so dropping opcodes would move their targets):
+#
+#     1. opcodes that cannot change the state they run in are dropped, e.g.
+#        CLR $PTR1 on a cell known to be 0, CMP EQ ACC, REGA that leaves the
+#        flag as it was, or a JMP $PTR1, CF whose distance is known to be 0;
+#     2. register writes that no later opcode, in this word or any word
+#        control can reach, reads before overwriting are dropped.
+#
+# The result is a plain (table, program) pair for the existing loops. The
+# machine state at the end of the program counts as read, so final
+# registers and memory match the unoptimized run.
+
+from collections import deque
+
+from peephole import EFFECTS, SIDE_EFFECTS
+
+JUMPS = (25, 26)
+NOPS = (35, 36)
+
+REGISTERS = ("p1", "p2", "acc", "a", "flag")
+
+# Opcodes that write memory
+MEMORY_WRITES = (7, 8, 9, 10, 11, 21, 22, 23, 24, 27, 28, 29)
+
+# Tracked cells per state before memory is treated as unknown
+MAX_CELLS = 1024
+
+# Word visits per word position before the analysis gives up
+BUDGET = 64
+
+# Successor marker for a 20 whose distance is unknown
+ANYWHERE = "anywhere"
+
+class State:
+    # Abstract machine state: each register is an int or None (unknown);
+    # memory[addr] is cells.get(addr, default), and default is 0 or None.
+    # same is True when accumulator == registerA is known even if their
+    # value is not (after a 16), so CMP EQ/LT ACC, REGA still give a flag.
+    __slots__ = ("regs", "default", "cells", "same")
+
+    def __init__(self, regs, default, cells, same=False):
+        self.regs = regs
+        self.default = default
+        self.cells = cells
+        self.same = same
+
+    @classmethod
+    def initial(cls):
+        return cls(dict.fromkeys(REGISTERS, 0), 0, {})
+
+    def copy(self):
+        return State(dict(self.regs), self.default, dict(self.cells), self.same)
+
+    def load(self, addr):
+        if addr is None:
+            return None
+        return self.cells.get(addr, self.default)
+
+    def store(self, addr, value):
+        if addr is None or len(self.cells) >= MAX_CELLS:
+            self.default = None
+            self.cells = {}
+        elif value != self.default:
+            self.cells[addr] = value
+        else:
+            self.cells.pop(addr, None)
+
+    def join(self, other):
+        regs = {r: v if v == other.regs[r] else None for r, v in self.regs.items()}
+        default = self.default if self.default == other.default else None
+        cells = {}
+        for addr in self.cells.keys() | other.cells.keys():
+            value = self.load(addr)
+            if value != other.load(addr):
+                value = None
+            if value != default:
+                cells[addr] = value
+        return State(regs, default, cells, self.same and other.same)
+
+    def __eq__(self, other):
+        return (self.regs == other.regs and self.default == other.default and self.cells == other.cells
+                and self.same == other.same)
+
+def _masked(value):
+    return None if value is None else value & 0xFFFF
+
+def step(state, op):
+    # Applies one opcode (not 25/26) to state. Returns the jumpModification
+    # opcode 20 sets (None when unknown); other opcodes return 0.
+    regs = state.regs
+    p1, p2, acc, a, flag = regs["p1"], regs["p2"], regs["acc"], regs["a"], regs["flag"]
+    known = acc is not None and a is not None
+    same = state.same
+    if op in (12, 13, 14, 15, 17, 18, 19, 33):
+        state.same = False
+    elif op == 16:
+        state.same = True
+    if op == 1:
+        regs["p1"] = _masked(None if p1 is None else p1 + 1)
+    elif op == 2:
+        regs["p2"] = _masked(None if p2 is None else p2 + 1)
+    elif op == 3:
+        regs["p1"] = acc
+    elif op == 4:
+        regs["p2"] = acc
+    elif op == 5:
+        regs["p1"] = state.load(p1)
+    elif op == 6:
+        regs["p2"] = state.load(p1)
+    elif op == 7:
+        state.store(p1, state.load(p2))
+    elif op == 8:
+        state.store(p2, state.load(p1))
+    elif op == 9:
+        first, second = state.load(p2), state.load(p1)
+        state.store(p1, first)
+        state.store(p2, second)
+    elif op == 10:
+        state.store(p1, 0)
+    elif op == 11:
+        state.store(p2, 0)
+    elif op == 12:
+        regs["acc"] = _masked(acc + a if known else None)
+    elif op == 13:
+        regs["acc"] = 0 if same else _masked(acc - a if known else None)
+    elif op == 14:
+        regs["acc"] = 0 if acc == 0 or a == 0 else _masked(acc * a if known else None)
+    elif op == 15:
+        regs["acc"] = acc // a if known and a else None
+    elif op == 16:
+        regs["acc"] = a
+    elif op == 17:
+        regs["acc"] = _masked(None if acc is None else acc * acc)
+    elif op == 18:
+        regs["a"] = state.load(p1)
+    elif op == 19:
+        regs["a"] = state.load(p2)
+    elif op == 20:
+        distance = state.load(p1)
+        if distance == 0:
+            return 0
+        if distance is None or flag is None:
+            return None
+        return distance if flag == 1 else -distance
+    elif op in (21, 23):
+        value = state.load(p1)
+        state.store(p1, _masked(None if value is None else value + (1 if op == 21 else -1)))
+    elif op in (22, 24):
+        value = state.load(p2)
+        state.store(p2, _masked(None if value is None else value + (1 if op == 22 else -1)))
+    elif op == 27:
+        state.store(p1, acc)
+    elif op == 28:
+        state.store(p2, acc)
+    elif op == 29:
+        state.store(p1, None)
+    elif op == 31:
+        regs["flag"] = 1 if same else int(acc == a) if known else None
+    elif op == 32:
+        regs["flag"] = 0 if same else int(acc < a) if known else None
+    elif op == 33:
+        regs["acc"] = flag
+    elif op == 34:
+        regs["flag"] = None if flag is None else 1 - flag
+    return 0
+
+def _same(x, y):
+    return x is not None and x == y
+
+def redundant(state, op):
+    # True when op provably leaves state unchanged (20 is handled by the caller)
+    regs = state.regs
+    p1, p2, acc, a, flag = regs["p1"], regs["p2"], regs["acc"], regs["a"], regs["flag"]
+    if op in NOPS:
+        return True
+    if op == 3:
+        return _same(p1, acc)
+    if op == 4:
+        return _same(p2, acc)
+    if op == 5:
+        return _same(p1, state.load(p1))
+    if op == 6:
+        return _same(p2, state.load(p1))
+    if op in (7, 8, 9):
+        return _same(p1, p2) or _same(state.load(p1), state.load(p2))
+    if op == 10:
+        return state.load(p1) == 0
+    if op == 11:
+        return state.load(p2) == 0
+    if op in (12, 13):
+        return a == 0
+    if op == 14:
+        return a == 1 or acc == 0
+    if op == 16:
+        return _same(acc, a)
+    if op == 17:
+        return acc in (0, 1)
+    if op == 18:
+        return _same(a, state.load(p1))
+    if op == 19:
+        return _same(a, state.load(p2))
+    if op == 27:
+        return _same(state.load(p1), acc)
+    if op == 28:
+        return _same(state.load(p2), acc)
+    if op in (31, 32, 33):
+        after = state.copy()
+        step(after, op)
+        target = "acc" if op == 33 else "flag"
+        return _same(after.regs[target], regs[target])
+    return False
+
+def _targets(position, found):
+    return sorted(target for target in {position + distance + 1 for distance in found} if target >= 0)
+
+def distances(opcodes, state):
+    # Distances the last 20 of a jump-free word can set when it starts in
+    # state: a set of ints, or None when it could be any. Unlike step(),
+    # a known distance with an unknown flag still gives both directions.
+    state = state.copy()
+    found = {0}
+    for op in opcodes:
+        if op == 20:
+            distance = state.load(state.regs["p1"])
+            flag = state.regs["flag"]
+            if distance is None:
+                found = None
+            elif flag is None:
+                found = {distance, -distance}
+            else:
+                found = {distance if flag == 1 else -distance}
+        step(state, op)
+    return found
+
+def transfer(opcodes, state, position):
+    # Runs a word over state. Returns (state after, successors), successors
+    # being a list of word positions or ANYWHERE.
+    state = state.copy()
+    if any(op in JUMPS for op in opcodes):
+        # pc-relative jumps: any opcode may run any number of times
+        for op in opcodes:
+            for reg in EFFECTS.get(op, ((), ()))[1]:
+                if reg != "jm":
+                    state.regs[reg] = None
+                if reg in ("acc", "a"):
+                    state.same = False
+            if op in MEMORY_WRITES:
+                state.store(None, None)
+        return state, ANYWHERE if 20 in opcodes else [position + 1]
+    found = distances(opcodes, state)
+    for op in opcodes:
+        step(state, op)
+    if found is None:
+        return state, ANYWHERE
+    return state, _targets(position, found)
+
+class Analysis:
+    # entries[i] is the state on entry to word position i (None if control
+    # never reaches it), successors[i] where control goes from it.
+    def __init__(self, table, program):
+        self.table = table
+        self.program = program
+        self.entries = [None] * len(program)
+        self.successors = [None] * len(program)
+        self.anywhere = None   # joined state of every 20 with an unknown distance
+
+    def entry(self, position):
+        state = self.entries[position]
+        if self.anywhere is None:
+            return state
+        return self.anywhere if state is None else state.join(self.anywhere)
+
+def _merge(states, position, state):
+    old = states[position]
+    new = state if old is None else old.join(state)
+    if old is not None and new == old:
+        return False
+    states[position] = new
+    return True
+
+def analyze(table, program, budget=BUDGET):
+    # Returns an Analysis, or None if the fixed point was not reached within
+    # budget visits per word position
+    size = len(program)
+    analysis = Analysis(table, program)
+    if not size:
+        return analysis
+    analysis.entries[0] = State.initial()
+    work = deque([0])
+    queued = {0}
+    visits = 0
+    while work:
+        position = work.popleft()
+        queued.discard(position)
+        visits += 1
+        if visits > budget * size:
+            return None
+        state, successors = transfer(table[program[position]], analysis.entry(position), position)
+        analysis.successors[position] = successors
+        if successors is ANYWHERE:
+            changed = analysis.anywhere is None or analysis.anywhere.join(state) != analysis.anywhere
+            if changed:
+                analysis.anywhere = state if analysis.anywhere is None else analysis.anywhere.join(state)
+                targets = range(size)
+            else:
+                targets = ()
+        else:
+            targets = [t for t in successors if t < size and _merge(analysis.entries, t, state)]
+        for target in targets:
+            if target not in queued:
+                queued.add(target)
+                work.append(target)
+    return analysis
+
+def fold(opcodes, state):
+    # Pass 1: drops the opcodes of a jump-free word that leave the state they
+    # run in unchanged, plus every 20 but the last (only the last one's
+    # distance is used) and a last 20 whose distance is known to be 0
+    last_jump = max((pc for pc, op in enumerate(opcodes) if op == 20), default=-1)
+    state = state.copy()
+    kept = []
+    for pc, op in enumerate(opcodes):
+        if op == 20:
+            if pc == last_jump and step(state, op) != 0:
+                kept.append(op)
+        elif not redundant(state, op):
+            step(state, op)
+            kept.append(op)
+    return kept
+
+def _reads(op):
+    if op in JUMPS:
+        return {"acc"}
+    return EFFECTS[op][0] if op in EFFECTS else set()
+
+def _writes(op):
+    return EFFECTS[op][1] - {"jm"} if op in EFFECTS else set()
+
+def _live_in(opcodes, live):
+    if any(op in JUMPS for op in opcodes):
+        live = set(live)
+        for op in opcodes:
+            live |= _reads(op)
+        return live
+    for op in reversed(opcodes):
+        live = (live - _writes(op)) | _reads(op)
+    return live
+
+def eliminate_dead(opcodes, live):
+    # Pass 2: drops register-only opcodes of a jump-free word whose results
+    # are overwritten before anything reads them; live holds the registers
+    # read after the word
+    kept = []
+    live = set(live)
+    for op in reversed(opcodes):
+        writes = _writes(op)
+        if writes and op not in SIDE_EFFECTS and op not in MEMORY_WRITES and not writes & live:
+            continue
+        live = (live - writes) | _reads(op)
+        kept.append(op)
+    kept.reverse()
+    return kept
+
+def liveness(words, successors):
+    # Registers live after each word position; the end of the program reads
+    # everything, and so may whatever a 20 with an unknown distance reaches
+    size = len(words)
+    live_out = [set() for _ in range(size)]
+    live_in = [set() if successors[position] is not None else set(REGISTERS) for position in range(size)]
+    changed = True
+    while changed:
+        changed = False
+        for position in reversed(range(size)):
+            targets = successors[position]
+            if targets is None:
+                continue
+            if targets is ANYWHERE:
+                out = set(REGISTERS)
+            else:
+                out = set()
+                for target in targets:
+                    out |= set(REGISTERS) if target >= size else live_in[target]
+            new_in = _live_in(words[position], out)
+            if out != live_out[position] or new_in != live_in[position]:
+                live_out[position] = out
+                live_in[position] = new_in
+                changed = True
+    return live_out
+
+def optimize(table, program, budget=BUDGET):
+    # Returns (table, program, removed): the rewritten program and how many
+    # opcodes were dropped over all word positions. The program comes back
+    # unchanged if the analysis runs out of budget.
+    analysis = analyze(table, program, budget)
+    if analysis is None:
+        return table, program, 0
+
+    words = []
+    for position, slot in enumerate(program):
+        opcodes = table[slot]
+        state = analysis.entry(position)
+        if state is None or any(op in JUMPS for op in opcodes):
+            words.append(tuple(opcodes))
+        else:
+            words.append(tuple(fold(opcodes, state)))
+
+    live_out = liveness(words, analysis.successors)
+    removed = 0
+    index = {}
+    new_table = []
+    new_program = []
+    for position, slot in enumerate(program):
+        opcodes = words[position]
+        if analysis.successors[position] is not None and not any(op in JUMPS for op in opcodes):
+            opcodes = tuple(eliminate_dead(opcodes, live_out[position]))
+        removed += len(table[slot]) - len(opcodes)
+        new_slot = index.get(opcodes)
+        if new_slot is None:
+            new_slot = index[opcodes] = len(new_table)
+            new_table.append(opcodes)
+        new_program.append(new_slot)
+    return tuple(new_table), tuple(new_program), removed
@@ -0,0 +1,622 @@
+# Time-travel debugger.
+#
+#     python debugger.py prog.asm --input case.txt
+#
+# RecordingVM is a vm.VM whose run() also logs the effect of every
+# microinstruction in a ring buffer (a deque with maxlen, so memory stays
+# bounded on long runs). Most steps overwrite one register or memory cell
+# and move pc on by one, so their entry is a single int,
+#
+#     target << 16 | old value
+#
+# with target a memory address or one of the register codes below (SAME when
+# nothing but pc changed). Only opcode 20 (old jumpModification), 25/26 (old
+# pc) and the end of each word (overheadPC, pc and jumpModification it ended
+# with) log a tuple, so recording allocates no container per step. Undoing
+# entries newest first puts the machine back exactly as it was, for as far
+# as the buffer reaches.
+#
+# Debugger drives a RecordingVM: steps forwards and backwards, continues in
+# either direction to a breakpoint (word index, pc or opcode) or watchpoint
+# (memory address), and replays undone steps, including the input they read,
+# when going forwards again. Output is not printed again on replay.
+
+import cmd
+import collections
+import sys
+
+from core import MNEMONICS
+from streams import MemoryInput, to_char
+from vm import VM, HALTED, RUNNING, MEMORY_SIZE
+
+# Entries kept by default
+HISTORY = 100_000
+
+# Steps per run() call while continuing, so a negative overheadPC is noticed
+CHUNK = 65536
+
+# Targets past the memory addresses
+P1, P2, ACC, REGA, FLAG = range(MEMORY_SIZE, MEMORY_SIZE + 5)
+REGISTERS = {P1: "pointerOne", P2: "pointerTwo", ACC: "accumulator", REGA: "registerA", FLAG: "checkFlag"}
+NAMES = {P1: "P1", P2: "P2", ACC: "ACC", REGA: "A", FLAG: "CHKF"}
+
+# Int entries that carry no target: pc moved on only, or opcode 9 (undone
+# by swapping again)
+SAME = -1
+SWAP = -2
+
+# First item of tuple entries
+JUMP, PC, EXIT = range(3)
+
+class RecordingVM(VM):
+    def __init__(self, table, program, getc=None, putc=None, memory=None, history=HISTORY):
+        super().__init__(table, program, getc, putc, memory)
+        self.history = collections.deque(maxlen=history)
+        self.breakpoints = None      # (word indexes, pcs, opcodes) checked before each step, or None
+        self.watchpoints = frozenset()
+        self.stopped = None          # why run() last stopped early: ("break", None) or ("watch", address)
+
+    def back(self):
+        # Undoes the newest recorded step. Returns (entry, new), new being
+        # the value the step had written (what replaying an IN needs), or
+        # None once the history is used up.
+        history = self.history
+        while history and type(history[-1]) is tuple and history[-1][0] == EXIT:
+            # The step ended its word (and any empty words after it)
+            _, self.overheadPC, self.pc, self.jumpModification = history.pop()
+            self.in_word = True
+        if not history:
+            return None
+        entry = history.pop()
+        new = None
+        self.pc -= 1
+        if type(entry) is tuple:
+            kind, old = entry
+            if kind == JUMP:
+                self.jumpModification = old
+            else:
+                self.pc = old
+        elif entry == SWAP:
+            memory = self.memory
+            memory[self.pointerOne], memory[self.pointerTwo] = memory[self.pointerTwo], memory[self.pointerOne]
+            self.dirty[self.pointerOne >> 8] = self.dirty[self.pointerTwo >> 8] = 1
+        elif entry != SAME:
+            target, old = entry >> 16, entry & 0xFFFF
+            if target < MEMORY_SIZE:
+                new = self.memory[target]
+                self.memory[target] = old
+                self.dirty[target >> 8] = 1
+            else:
+                new = getattr(self, REGISTERS[target])
+                setattr(self, REGISTERS[target], old)
+        self.steps -= 1
+        return entry, new
+
+    def recent(self):
+        # (overheadPC, pc, entry) for every recorded step, newest first
+        overheadPC, pc = self.overheadPC, self.pc
+        for entry in reversed(self.history):
+            if type(entry) is tuple:
+                if entry[0] == EXIT:
+                    overheadPC, pc = entry[1], entry[2]
+                    continue
+                pc = entry[1] if entry[0] == PC else pc - 1
+            else:
+                pc -= 1
+            yield overheadPC, pc, entry
+
+    def run(self, max_steps=None):
+        table = self.table
+        program = self.program
+        memory = self.memory
+        dirty = self.dirty
+        getc = self.getc
+        putc = self.putc
+        log = self.history.append
+        breakpoints = self.breakpoints
+        watchpoints = self.watchpoints
+        self.stopped = None
+        if breakpoints is not None:
+            break_words, break_pcs, break_opcodes = breakpoints
+        # Breakpoints do not fire on the step run() starts at
+        armed = False
+        p1_entry, p2_entry, acc_entry, a_entry, flag_entry = P1 << 16, P2 << 16, ACC << 16, REGA << 16, FLAG << 16
+
+        pointerOne = self.pointerOne
+        pointerTwo = self.pointerTwo
+        accumulator = self.accumulator
+        registerA = self.registerA
+        checkFlag = self.checkFlag
+        overheadPC = self.overheadPC
+        jumpModification = self.jumpModification
+        pc = self.pc
+        in_word = self.in_word
+
+        # Counts down to 0; -1 never gets there. A stop sets budget to 0
+        # and moves start along with it, so steps still counts what ran.
+        budget = start = -1 if max_steps is None else max_steps
+        status = RUNNING
+        try:
+            while True:
+                if not in_word:
+                    if overheadPC >= len(program):
+                        status = HALTED
+                        break
+                    if overheadPC < 0:
+                        if budget < 0:
+                            overheadPC += jumpModification + 1
+                            continue
+                        overheadPC += (jumpModification + 1) * budget
+                        budget = 0
+                        break
+                    if breakpoints is not None and armed and overheadPC in break_words:
+                        self.stopped = ("break", None)
+                        break
+                    pc = 0
+                    jumpModification = 0
+                    in_word = True
+                opcodes = table[program[overheadPC]]
+                while pc < len(opcodes):
+                    opcode = opcodes[pc]
+                    if breakpoints is not None:
+                        if armed and (pc in break_pcs or opcode in break_opcodes):
+                            self.stopped = ("break", None)
+                            start -= budget
+                            budget = 0
+                        armed = True
+                    if budget == 0:
+                        break
+                    budget -= 1
+                    if opcode == 1:
+                        log(p1_entry | pointerOne)
+                        pointerOne = (pointerOne + 1) & 0xFFFF
+                    elif opcode == 2:
+                        log(p2_entry | pointerTwo)
+                        pointerTwo = (pointerTwo + 1) & 0xFFFF
+                    elif opcode == 3:
+                        log(p1_entry | pointerOne)
+                        pointerOne = accumulator
+                    elif opcode == 4:
+                        log(p2_entry | pointerTwo)
+                        pointerTwo = accumulator
+                    elif opcode == 5:
+                        log(p1_entry | pointerOne)
+                        pointerOne = memory[pointerOne]
+                    elif opcode == 6:
+                        log(p2_entry | pointerTwo)
+                        pointerTwo = memory[pointerOne]
+                    elif opcode == 7:
+                        log(pointerOne << 16 | memory[pointerOne])
+                        memory[pointerOne] = memory[pointerTwo]
+                        dirty[pointerOne >> 8] = 1
+                        if pointerOne in watchpoints:
+                            self.stopped = ("watch", pointerOne)
+                            start -= budget
+                            budget = 0
+                    elif opcode == 8:
+                        log(pointerTwo << 16 | memory[pointerTwo])
+                        memory[pointerTwo] = memory[pointerOne]
+                        dirty[pointerTwo >> 8] = 1
+                        if pointerTwo in watchpoints:
+                            self.stopped = ("watch", pointerTwo)
+                            start -= budget
+                            budget = 0
+                    elif opcode == 9:
+                        log(SWAP)
+                        memory[pointerOne], memory[pointerTwo] = memory[pointerTwo], memory[pointerOne]
+                        dirty[pointerOne >> 8] = dirty[pointerTwo >> 8] = 1
+                        for address in (pointerOne, pointerTwo):
+                            if address in watchpoints:
+                                self.stopped = ("watch", address)
+                                start -= budget
+                                budget = 0
+                    elif opcode == 10:
+                        log(pointerOne << 16 | memory[pointerOne])
+                        memory[pointerOne] = 0
+                        dirty[pointerOne >> 8] = 1
+                        if pointerOne in watchpoints:
+                            self.stopped = ("watch", pointerOne)
+                            start -= budget
+                            budget = 0
+                    elif opcode == 11:
+                        log(pointerTwo << 16 | memory[pointerTwo])
+                        memory[pointerTwo] = 0
+                        dirty[pointerTwo >> 8] = 1
+                        if pointerTwo in watchpoints:
+                            self.stopped = ("watch", pointerTwo)
+                            start -= budget
+                            budget = 0
+                    elif opcode == 12:
+                        log(acc_entry | accumulator)
+                        accumulator = (accumulator + registerA) & 0xFFFF
+                    elif opcode == 13:
+                        log(acc_entry | accumulator)
+                        accumulator = (accumulator - registerA) & 0xFFFF
+                    elif opcode == 14:
+                        log(acc_entry | accumulator)
+                        accumulator = (accumulator * registerA) & 0xFFFF
+                    elif opcode == 15:
+                        # Logged after the division, which may raise
+                        old = accumulator
+                        accumulator //= registerA
+                        log(acc_entry | old)
+                    elif opcode == 16:
+                        log(acc_entry | accumulator)
+                        accumulator = registerA
+                    elif opcode == 17:
+                        log(acc_entry | accumulator)
+                        accumulator = (accumulator * accumulator) & 0xFFFF
+                    elif opcode == 18:
+                        log(a_entry | registerA)
+                        registerA = memory[pointerOne]
+                    elif opcode == 19:
+                        log(a_entry | registerA)
+                        registerA = memory[pointerTwo]
+                    elif opcode == 20:
+                        log((JUMP, jumpModification))
+                        if checkFlag == 1:
+                            jumpModification = memory[pointerOne]
+                        else:
+                            jumpModification = -memory[pointerOne]
+                    elif opcode == 21 or opcode == 23:
+                        log(pointerOne << 16 | memory[pointerOne])
+                        memory[pointerOne] = (memory[pointerOne] + (1 if opcode == 21 else -1)) & 0xFFFF
+                        dirty[pointerOne >> 8] = 1
+                        if pointerOne in watchpoints:
+                            self.stopped = ("watch", pointerOne)
+                            start -= budget
+                            budget = 0
+                    elif opcode == 22 or opcode == 24:
+                        log(pointerTwo << 16 | memory[pointerTwo])
+                        memory[pointerTwo] = (memory[pointerTwo] + (1 if opcode == 22 else -1)) & 0xFFFF
+                        dirty[pointerTwo >> 8] = 1
+                        if pointerTwo in watchpoints:
+                            self.stopped = ("watch", pointerTwo)
+                            start -= budget
+                            budget = 0
+                    elif opcode == 25:
+                        log((PC, pc))
+                        pc += accumulator
+                    elif opcode == 26:
+                        log((PC, pc))
+                        pc -= accumulator
+                        if pc < -1:
+                            pc = -1
+                    elif opcode == 27:
+                        log(pointerOne << 16 | memory[pointerOne])
+                        memory[pointerOne] = accumulator
+                        dirty[pointerOne >> 8] = 1
+                        if pointerOne in watchpoints:
+                            self.stopped = ("watch", pointerOne)
+                            start -= budget
+                            budget = 0
+                    elif opcode == 28:
+                        log(pointerTwo << 16 | memory[pointerTwo])
+                        memory[pointerTwo] = accumulator
+                        dirty[pointerTwo >> 8] = 1
+                        if pointerTwo in watchpoints:
+                            self.stopped = ("watch", pointerTwo)
+                            start -= budget
+                            budget = 0
+                    elif opcode == 29:
+                        char = getc()
+                        if char is None:
+                            log(SAME)
+                        else:
+                            log(pointerOne << 16 | memory[pointerOne])
+                            memory[pointerOne] = char & 0xFFFF
+                            dirty[pointerOne >> 8] = 1
+                            if pointerOne in watchpoints:
+                                self.stopped = ("watch", pointerOne)
+                                start -= budget
+                                budget = 0
+                    elif opcode == 30:
+                        log(SAME)
+                        putc(memory[pointerOne])
+                    elif opcode == 31:
+                        log(flag_entry | checkFlag)
+                        checkFlag = 1 if accumulator == registerA else 0
+                    elif opcode == 32:
+                        log(flag_entry | checkFlag)
+                        checkFlag = 1 if accumulator < registerA else 0
+                    elif opcode == 33:
+                        log(acc_entry | accumulator)
+                        accumulator = checkFlag
+                    elif opcode == 34:
+                        log(flag_entry | checkFlag)
+                        checkFlag = 1 - checkFlag
+                    else:
+                        log(SAME)
+                    pc += 1
+                else:
+                    log((EXIT, overheadPC, pc, jumpModification))
+                    in_word = False
+                    overheadPC += jumpModification
+                    overheadPC += 1
+                    continue
+                break
+        finally:
+            self.steps += start - budget
+            self.pointerOne = pointerOne
+            self.pointerTwo = pointerTwo
+            self.accumulator = accumulator
+            self.registerA = registerA
+            self.checkFlag = checkFlag
+            self.overheadPC = overheadPC
+            self.jumpModification = jumpModification
+            self.pc = pc
+            self.in_word = in_word
+        return status
+
+def describe(vm, overheadPC, pc, entry):
+    # One line for a recorded step: where it ran and what it changed
+    opcode = vm.table[vm.program[overheadPC]][pc]
+    line = f"word {overheadPC} pc {pc:04X}: {MNEMONICS.get(opcode, f'UNKNOWN_{opcode}')}"
+    if type(entry) is tuple:
+        if entry[0] == JUMP:
+            return f"{line}  (JM was {entry[1]})"
+        return line
+    if entry < 0:
+        return line
+    target, old = entry >> 16, entry & 0xFFFF
+    name = NAMES[target] if target in NAMES else f"${target}"
+    return f"{line}  ({name} was {old})"
+
+class Debugger:
+    def __init__(self, vm):
+        self.vm = vm
+        self.redo = []           # (entry, new) for undone steps, newest last
+        self.words = set()       # breakpoints
+        self.pcs = set()
+        self.opcodes = set()
+        self.watchpoints = set()
+
+    def where(self):
+        vm = self.vm
+        if vm.halted:
+            return f"halted after {vm.steps} steps"
+        if not vm.in_word and vm.overheadPC < 0:
+            return f"overheadPC went negative ({vm.overheadPC}), no word can run again"
+        pc = vm.pc if vm.in_word else 0
+        opcodes = vm.table[vm.program[vm.overheadPC]]
+        if pc >= len(opcodes):
+            return f"word {vm.overheadPC} pc {pc:04X}: end of word"
+        opcode = opcodes[pc]
+        return f"word {vm.overheadPC} pc {pc:04X}: {MNEMONICS.get(opcode, f'UNKNOWN_{opcode}')}"
+
+    def listing(self):
+        # The current word, with the next microinstruction marked
+        vm = self.vm
+        if self.stuck():
+            return [self.where()]
+        pc = vm.pc if vm.in_word else 0
+        opcodes = vm.table[vm.program[vm.overheadPC]]
+        lines = [f"; word {vm.overheadPC} (slot {vm.program[vm.overheadPC]}, {len(opcodes)} opcodes)"]
+        for addr, op in enumerate(opcodes):
+            lines.append(f"{'=>' if addr == pc else '  '} {addr:04X}: {MNEMONICS.get(op, f'UNKNOWN_{op}')}")
+        return lines
+
+    def stuck(self):
+        vm = self.vm
+        return vm.halted or (not vm.in_word and vm.overheadPC < 0)
+
+    def _at_breakpoint(self):
+        vm = self.vm
+        if self.stuck():
+            return False
+        pc = vm.pc if vm.in_word else 0
+        if pc == 0 and vm.overheadPC in self.words:
+            return True
+        opcodes = vm.table[vm.program[vm.overheadPC]]
+        return pc < len(opcodes) and (pc in self.pcs or opcodes[pc] in self.opcodes)
+
+    def _watched(self, entry):
+        # Address of a watchpoint the step that logged entry wrote, or None
+        vm = self.vm
+        if type(entry) is tuple or entry == SAME:
+            return None
+        if entry == SWAP:
+            return next((address for address in (vm.pointerOne, vm.pointerTwo) if address in self.watchpoints), None)
+        target = entry >> 16
+        return target if target in self.watchpoints else None
+
+    def _replay(self):
+        # Redoes the newest undone step with the input it read the first time
+        vm = self.vm
+        entry, new = self.redo.pop()
+        vm.getc, getc = (lambda: new), vm.getc
+        vm.putc, putc = (lambda val: None), vm.putc
+        vm.breakpoints, vm.watchpoints = None, frozenset()
+        try:
+            vm.run(1)
+        finally:
+            vm.getc, vm.putc = getc, putc
+        return entry
+
+    def _run(self, steps, stop):
+        vm = self.vm
+        vm.breakpoints = (self.words, self.pcs, self.opcodes) if stop else None
+        vm.watchpoints = frozenset(self.watchpoints) if stop else frozenset()
+        try:
+            vm.run(steps)
+        except ZeroDivisionError:
+            return "division by zero"
+        if vm.stopped is not None:
+            kind, address = vm.stopped
+            return "breakpoint" if kind == "break" else f"watchpoint ${address} = {vm.memory[address]}"
+        return None
+
+    def step(self, count=1, stop=False):
+        # Runs count steps forwards (replaying undone ones first); with
+        # stop, ends early at a breakpoint or watchpoint. Returns why it
+        # stopped early, or None.
+        first = True
+        while count > 0 and self.redo:
+            if stop and not first and self._at_breakpoint():
+                return "breakpoint"
+            first = False
+            address = self._watched(self._replay())
+            count -= 1
+            if stop and address is not None:
+                return f"watchpoint ${address} = {self.vm.memory[address]}"
+        while count > 0 and not self.stuck():
+            if stop and not first and self._at_breakpoint():
+                return "breakpoint"
+            first = False
+            done = self.vm.steps
+            reason = self._run(min(count, CHUNK), stop)
+            if reason is not None:
+                return reason
+            count -= self.vm.steps - done
+        return None
+
+    def cont(self):
+        return self.step(float("inf"), stop=True)
+
+    def back(self, count=1, stop=False):
+        # Undoes count steps; with stop, ends early just before a step that
+        # hits a breakpoint or wrote a watched address
+        while count > 0:
+            undone = self.vm.back()
+            if undone is None:
+                return "start of history"
+            self.redo.append(undone)
+            count -= 1
+            if stop and self._at_breakpoint():
+                return "breakpoint"
+            address = self._watched(undone[0])
+            if stop and address is not None:
+                return f"watchpoint ${address} = {self.vm.memory[address]}"
+        return None
+
+    def reverse(self):
+        return self.back(float("inf"), stop=True)
+
+    def trail(self, count):
+        # The last count recorded steps, oldest first
+        lines = []
+        for overheadPC, pc, entry in self.vm.recent():
+            if len(lines) == count:
+                break
+            lines.append(describe(self.vm, overheadPC, pc, entry))
+        return lines[::-1]
+
+class Shell(cmd.Cmd):
+    intro = "SARCASM time-travel debugger. Type help or ? to list commands."
+    prompt = "(sdb) "
+
+    def __init__(self, debugger):
+        super().__init__()
+        self.debugger = debugger
+
+    def _count(self, arg):
+        return int(arg, 0) if arg.strip() else 1
+
+    def _report(self, reason=None):
+        if reason is not None:
+            print(f"stopped: {reason}")
+        print(self.debugger.where())
+
+    def do_step(self, arg):
+        "step [N]: run N microinstructions forwards"
+        self._report(self.debugger.step(self._count(arg)))
+
+    def do_back(self, arg):
+        "back [N]: undo N microinstructions"
+        self._report(self.debugger.back(self._count(arg)))
+
+    def do_continue(self, arg):
+        "continue: run forwards to a breakpoint, a watchpoint or the end"
+        self._report(self.debugger.cont())
+
+    def do_reverse(self, arg):
+        "reverse: run backwards to a breakpoint, a watchpoint or the start of history"
+        self._report(self.debugger.reverse())
+
+    def do_break(self, arg):
+        "break word N | pc N | op N: stop before word N is entered, at pc N or on opcode N"
+        try:
+            kind, value = arg.split()
+            value = int(value, 0)
+            {"word": self.debugger.words, "pc": self.debugger.pcs, "op": self.debugger.opcodes}[kind].add(value)
+        except (ValueError, KeyError):
+            print("usage: break word N | pc N | op N")
+
+    def do_watch(self, arg):
+        "watch ADDR: stop after memory cell ADDR is written"
+        try:
+            self.debugger.watchpoints.add(int(arg, 0) & 0xFFFF)
+        except ValueError:
+            print("usage: watch ADDR")
+
+    def do_delete(self, arg):
+        "delete: remove every breakpoint and watchpoint"
+        for points in (self.debugger.words, self.debugger.pcs, self.debugger.opcodes, self.debugger.watchpoints):
+            points.clear()
+
+    def do_info(self, arg):
+        "info: registers, breakpoints and watchpoints"
+        vm = self.debugger.vm
+        print(f"P1: {vm.pointerOne} P2: {vm.pointerTwo} ACC: {vm.accumulator} REG: {vm.registerA} "
+              f"CHKF: {vm.checkFlag} OHPC: {vm.overheadPC} JM: {vm.jumpModification} steps: {vm.steps}")
+        print(f"breakpoints: words {sorted(self.debugger.words)} pcs {sorted(self.debugger.pcs)} "
+              f"opcodes {sorted(self.debugger.opcodes)}; watchpoints {sorted(self.debugger.watchpoints)}")
+        print(f"history: {len(vm.history)} entries recorded, {len(self.debugger.redo)} steps undone")
+
+    def do_mem(self, arg):
+        "mem ADDR [N]: N memory cells from ADDR"
+        try:
+            parts = [int(part, 0) for part in arg.split()]
+            start, count = parts[0], parts[1] if len(parts) > 1 else 16
+        except (ValueError, IndexError):
+            print("usage: mem ADDR [N]")
+            return
+        print(self.debugger.vm.memory[start:start + count].tolist())
+
+    def do_list(self, arg):
+        "list: the current word, next microinstruction marked"
+        print("\n".join(self.debugger.listing()))
+
+    def do_trail(self, arg):
+        "trail [N]: the last N recorded steps"
+        print("\n".join(self.debugger.trail(self._count(arg) if arg.strip() else 10)))
+
+    def do_quit(self, arg):
+        "quit: leave the debugger"
+        return True
+
+    do_s = do_step
+    do_b = do_back
+    do_c = do_continue
+    do_rc = do_reverse
+    do_l = do_list
+    do_q = do_quit
+    do_EOF = do_quit
+
+if __name__ == "__main__":
+    import argparse
+
+    import main
+
+    parser = argparse.ArgumentParser(description="Step a SARCASM program forwards and backwards")
+    parser.add_argument("filename")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--input", help="file the program reads its input from")
+    group.add_argument("--stdin", default="", help="input text for the program")
+    parser.add_argument("--history", type=int, default=HISTORY, help=f"steps kept for going back (default: {HISTORY})")
+    args = parser.parse_args()
+
+    table, program = main.read_program(args.filename)
+    data = args.stdin
+    if args.input:
+        with open(args.input, 'rb') as file:
+            data = file.read().decode('utf-8', errors='replace')
+
+    def putc(value):
+        sys.stdout.write(to_char(value))
+        sys.stdout.flush()
+
+    vm = RecordingVM(table, program, MemoryInput(data).getc, putc, history=args.history)
+    shell = Shell(Debugger(vm))
+    print(shell.debugger.where())
+    shell.cmdloop()
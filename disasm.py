@@ -0,0 +1,182 @@
+# Whole-program disassembler.
+#
+#     python disasm.py prog.asm                  listing on stdout
+#     python disasm.py prog.sarc --json          one JSON object per word
+#     python disasm.py big.asm -j 8 -o big.lst   decode on 8 processes
+#
+# disassemble(path) is a generator over the listing of a source file or a
+# compiled .sarc (told apart by its magic bytes, not its name). Every word
+# gets a header line with its index and either its text or its table slot,
+# then one line per opcode at its address within the word. Opcode 20 and
+# 25/26 sites are marked on the header and on the opcode's own line:
+#
+#     ; word 145: afflmivccmwanvb (13 opcodes) [20]
+#     0000: MOV ACC, REGA
+#     ...
+#     000C: JMP $PTR1, CF  ; word jump by memory[pointerOne], backwards when checkFlag is 0
+#
+# With as_json every word is one JSON line instead:
+#
+#     {"word": 145, "text": "afflmivccmwanvb", "opcodes": [16, 31, ...],
+#      "mnemonics": ["MOV ACC, REGA", ...], "word_jumps": [12], "pc_jumps": []}
+#
+# Words are read and listed CHUNK at a time, so memory stays flat however
+# long the program: source files stream through tokenizer.words, .sarc
+# files are mapped. With jobs > 1 the chunks are decoded and formatted on a
+# process pool, at most 2 * jobs of them in flight, and come back in order.
+
+import collections
+import itertools
+import json
+
+import bytecode
+import tokenizer
+from core import MNEMONICS, fast_instruction_to_microinstructions
+
+# Words per chunk
+CHUNK = 4096
+
+# Distinct words a process keeps decoded before starting over
+CACHED_WORDS = 1 << 16
+
+MARKS = {
+    20: "word jump by memory[pointerOne], backwards when checkFlag is 0",
+    25: "pc += accumulator",
+    26: "pc -= accumulator",
+}
+
+# Worker-process state: word -> opcodes, and .sarc path -> its Bytecode
+_decoded = {}
+_mapped = {}
+
+def _mnemonic(op):
+    return MNEMONICS.get(op, f"UNKNOWN_{op}")
+
+# What follows the address on an opcode's line, built once
+_TAILS = {op: f": {_mnemonic(op)}  ; {MARKS[op]}" if op in MARKS else f": {_mnemonic(op)}" for op in range(37)}
+
+def word_lines(position, opcodes, text=None, slot=None):
+    # Listing lines of one word; text (source) or slot (.sarc) labels it
+    if text is not None:
+        header = f"; word {position}: {text} ({len(opcodes)} opcodes)"
+    elif slot is not None:
+        header = f"; word {position} (slot {slot}, {len(opcodes)} opcodes)"
+    else:
+        header = f"; word {position} ({len(opcodes)} opcodes)"
+    if 20 in opcodes:
+        header += " [20]"
+    if 25 in opcodes or 26 in opcodes:
+        header += " [25/26]"
+    lines = [header]
+    for addr, op in enumerate(opcodes):
+        tail = _TAILS.get(op)
+        lines.append(f"{addr:04X}{tail if tail is not None else ': ' + _mnemonic(op)}")
+    return lines
+
+def word_record(position, opcodes, text=None, slot=None):
+    record = {"word": position}
+    if text is not None:
+        record["text"] = text
+    if slot is not None:
+        record["slot"] = slot
+    record["opcodes"] = list(opcodes)
+    record["mnemonics"] = [_mnemonic(op) for op in opcodes]
+    record["word_jumps"] = [addr for addr, op in enumerate(opcodes) if op == 20]
+    record["pc_jumps"] = [addr for addr, op in enumerate(opcodes) if op in (25, 26)]
+    return json.dumps(record)
+
+def _decode(word):
+    opcodes = _decoded.get(word)
+    if opcodes is None:
+        if len(_decoded) >= CACHED_WORDS:
+            _decoded.clear()
+        opcodes = _decoded[word] = fast_instruction_to_microinstructions(word)
+    return opcodes
+
+def list_words(start, words, as_json=False):
+    # Lines for source words start, start + 1, ...
+    lines = []
+    for position, word in enumerate(words, start):
+        opcodes = _decode(word)
+        if as_json:
+            lines.append(word_record(position, opcodes, text=word))
+        else:
+            lines.extend(word_lines(position, opcodes, text=word))
+    return lines
+
+def list_sarc(path, start, stop, as_json=False):
+    # Lines for words [start, stop) of a .sarc, sliced straight from the
+    # mapped opcode stream
+    code = _mapped.get(path)
+    if code is None:
+        code = _mapped[path] = bytecode.load(path)
+    stream, offsets = code.table.opcodes, code.table.offsets
+    lines = []
+    for position in range(start, stop):
+        slot = code.program[position]
+        opcodes = stream[offsets[slot]:offsets[slot + 1]].tobytes()
+        if as_json:
+            lines.append(word_record(position, opcodes, slot=slot))
+        else:
+            lines.extend(word_lines(position, opcodes, slot=slot))
+    return lines
+
+def is_sarc(path):
+    with open(path, "rb") as file:
+        return file.read(len(bytecode.MAGIC)) == bytecode.MAGIC
+
+def _tasks(path, as_json, chunk):
+    # (function, arguments) per chunk, in program order
+    if is_sarc(path):
+        with bytecode.load(path) as code:
+            count = len(code.program)
+        for start in range(0, count, chunk):
+            yield list_sarc, (path, start, min(start + chunk, count), as_json)
+    else:
+        words = tokenizer.words(path)
+        for start in itertools.count(0, chunk):
+            block = list(itertools.islice(words, chunk))
+            if not block:
+                break
+            yield list_words, (start, block, as_json)
+
+def disassemble(path, jobs=1, as_json=False, chunk=CHUNK):
+    tasks = _tasks(path, as_json, chunk)
+    if jobs <= 1:
+        for function, arguments in tasks:
+            yield from function(*arguments)
+        return
+
+    import concurrent.futures
+
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        pending = collections.deque()
+        for function, arguments in tasks:
+            pending.append(pool.submit(function, *arguments))
+            if len(pending) >= 2 * jobs:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import sys
+
+    parser = argparse.ArgumentParser(description="Disassemble a whole SARCASM source or .sarc file")
+    parser.add_argument("filename")
+    parser.add_argument("-o", "--output", help="write the listing here instead of stdout")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="processes decoding chunks of words (0: one per CPU)")
+    parser.add_argument("--json", action="store_true", help="one JSON object per word")
+    parser.add_argument("--chunk", type=int, default=CHUNK, help=f"words per chunk (default: {CHUNK})")
+    args = parser.parse_args()
+
+    jobs = args.jobs or os.cpu_count() or 1
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for line in disassemble(args.filename, jobs, args.json, args.chunk):
+            output.write(line + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
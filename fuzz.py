@@ -0,0 +1,394 @@
+# Coverage-guided fuzzer.
+#
+#     python fuzz.py examples/CAT.ASM --seconds 60 -j 4 --out findings
+#     python fuzz.py prog.asm --corpus corpus --max-steps 100000
+#
+# Fuzzer.execute(data) runs a program in process on one input, the bytes
+# decoded as UTF-8 into the values opcode 29 reads (0 once they run out, as
+# streams.EOF), and returns what it covered plus what went wrong, if
+# anything. Words are compiled to Python once, as in compiler.py, with
+# bookkeeping added:
+#
+#     coverage   (word index, pc, opcode) for the first opcode of every word
+#                entered and every pc a 25/26 lands on, and (word index,
+#                next word index) for every word holding a 20
+#     dirty      every cell an opcode writes goes into a set; the next run
+#                zeroes only those (or the whole memory when most of it is
+#                dirty) instead of allocating 65,536 fresh cells
+#     steps      counted down from max_steps per run, inside 25/26 words too
+#
+# and the findings are
+#
+#     hang               the step budget ran out
+#     stuck              overheadPC went negative, so no word runs again
+#     division by zero   opcode 15 with registerA 0
+#     bad output         opcode 30 on a UTF-16 surrogate, printed as '?'
+#
+# each keyed by kind and the word index where it happened. campaign() is
+# the loop: pick a corpus input, apply a few random mutations (bit flips,
+# interesting bytes, inserts, deletes, copies, splices with another input),
+# run it, and keep it if it covered something new. fuzz() runs campaigns on
+# a process pool in rounds of SYNC seconds, merging every worker's corpus
+# and findings between rounds and culling the corpus to the shortest inputs
+# that keep all coverage. Findings are minimized at the end by deleting
+# ever smaller chunks while the same finding still happens.
+
+import collections
+import functools
+import random
+import time
+
+import compiler
+from core import new_memory
+from streams import EOF
+
+# Microinstructions per run before it counts as a hang
+MAX_STEPS = 100_000
+
+# Seconds between merges of the workers' results
+SYNC = 5.0
+
+# Longest input mutation produces, in bytes
+MAX_INPUT = 1024
+
+# Dirty cells beyond which resetting copies a whole zeroed memory
+RESET_COPY = 4096
+
+# Runs minimize() may spend on one finding
+MINIMIZE_RUNS = 2000
+
+INTERESTING = (0, 1, 9, 10, 13, 32, 48, 65, 97, 127, 128, 255)
+
+SEEDS = (b"", b"\r", b"a", b"hello\r")
+
+WRITES_P1 = (7, 9, 10, 21, 23, 27, 29)
+WRITES_P2 = (8, 9, 11, 22, 24, 28)
+JUMPS = (25, 26)
+
+_ZERO = new_memory()
+
+def _statements(opcodes):
+    lines = []
+    for op in opcodes:
+        lines.extend(compiler.STATEMENTS[op].split("\n"))
+        if op in WRITES_P1:
+            lines.append("dirty.add(p1)")
+        if op in WRITES_P2:
+            lines.append("dirty.add(p2)")
+    return lines
+
+def _leaf(opcodes, start):
+    # Entering the word at pc == start: straight-line up to the next 25/26
+    # or the leaf boundary compiler.py uses (the next multiple of start's
+    # lowest set bit, compiler.CHUNK at most), then the next pc
+    span = min(start & -start or compiler.CHUNK, compiler.CHUNK)
+    end = start
+    while end < len(opcodes) - 1 and end - start < span - 1 and opcodes[end] not in JUMPS:
+        end += 1
+    op = opcodes[end]
+    lines = [f"covered.add((position, {start}, {opcodes[start]}))", f"budget -= {end - start + 1}"]
+    if op == 25:
+        return lines + _statements(opcodes[start:end]) + [f"pc = {end + 1} + acc"]
+    if op == 26:
+        return lines + _statements(opcodes[start:end]) + [f"pc = {end + 1} - acc", "if pc < 0: pc = 0"]
+    return lines + _statements(opcodes[start:end + 1]) + [f"pc = {end + 1}"]
+
+def _switch(opcodes, lo, hi, depth):
+    pad = "    " * depth
+    if hi - lo == 1:
+        return [pad + line for line in _leaf(opcodes, lo)]
+    mid = (lo + hi) // 2
+    return ([f"{pad}if pc < {mid}:"] + _switch(opcodes, lo, mid, depth + 1)
+            + [f"{pad}else:"] + _switch(opcodes, mid, hi, depth + 1))
+
+def word_source(opcodes):
+    # word(...) returns the registers, jumpModification and the budget left;
+    # a 25/26 word stops once the budget is gone, returning None for
+    # jumpModification
+    lines = ["def word(mem, p1, p2, acc, a, flag, getc, putc, dirty, covered, position, budget):", "    jm = 0"]
+    if any(op in JUMPS for op in opcodes):
+        lines += ["    pc = 0", f"    while pc < {len(opcodes)}:", "        if budget <= 0:", "            return p1, p2, acc, a, flag, None, budget"]
+        lines += _switch(opcodes, 0, len(opcodes), 2)
+    else:
+        lines += ["    " + line for line in _statements(opcodes)]
+        lines.append(f"    budget -= {len(opcodes)}")
+    lines.append("    return p1, p2, acc, a, flag, jm, budget")
+    return "\n".join(lines)
+
+def compile_word(opcodes):
+    namespace = {}
+    exec(compile(word_source(opcodes), "<sarcasm fuzz word>", "exec"), namespace)
+    return namespace["word"]
+
+class Fuzzer:
+    def __init__(self, table, program, max_steps=MAX_STEPS):
+        self.table = table
+        self.program = program
+        self.max_steps = max_steps
+        self.words = [None] * len(table)
+        self.straight = [not any(op in JUMPS for op in opcodes) for opcodes in table]
+        self.jumping = [20 in opcodes for opcodes in table]
+        self.memory = new_memory()
+        self.dirty = set()
+        self.execs = 0
+
+    def reset(self):
+        if len(self.dirty) > RESET_COPY:
+            self.memory[:] = _ZERO
+        else:
+            memory = self.memory
+            for addr in self.dirty:
+                memory[addr] = 0
+        self.dirty.clear()
+
+    def execute(self, data):
+        # Returns (coverage, finding); finding is (kind, word index) or None
+        self.reset()
+        self.execs += 1
+        table, program, words = self.table, self.program, self.words
+        straight, jumping = self.straight, self.jumping
+        memory, dirty = self.memory, self.dirty
+        covered = set()
+        bad = []
+
+        def putc(value):
+            if 0xD800 <= value <= 0xDFFF:
+                bad.append(value)
+
+        getc = _values(data)
+        p1 = p2 = acc = a = flag = 0
+        overheadPC = 0
+        budget = self.max_steps
+        finding = bad_at = None
+        while overheadPC < len(program):
+            if overheadPC < 0:
+                finding = ("stuck", position)
+                break
+            position = overheadPC
+            slot = program[position]
+            word = words[slot]
+            if word is None:
+                word = words[slot] = compile_word(table[slot])
+            if straight[slot]:
+                covered.add((position, 0, table[slot][0]))
+            try:
+                p1, p2, acc, a, flag, jm, budget = word(memory, p1, p2, acc, a, flag, getc, putc,
+                                                        dirty, covered, position, budget)
+            except ZeroDivisionError:
+                finding = ("division by zero", position)
+                break
+            if jm is None:
+                finding = ("hang", position)
+                break
+            overheadPC += jm + 1
+            if jumping[slot]:
+                covered.add((position, overheadPC))
+            if bad and bad_at is None:
+                bad_at = position
+            if budget <= 0 and overheadPC < len(program):
+                finding = ("hang", position)
+                break
+        if finding is None and bad_at is not None:
+            finding = ("bad output", bad_at)
+        return covered, finding
+
+def _values(data):
+    # getc over the characters of data, then EOF forever
+    return functools.partial(next, iter([ord(c) for c in data.decode("utf-8", errors="replace")]), EOF)
+
+def mutate(data, rng, corpus=()):
+    data = bytearray(data)
+    for _ in range(rng.randint(1, 4)):
+        choice = rng.randrange(7)
+        if choice == 0 and data:
+            data[rng.randrange(len(data))] ^= 1 << rng.randrange(8)
+        elif choice == 1 and data:
+            data[rng.randrange(len(data))] = rng.choice(INTERESTING)
+        elif choice == 2:
+            at = rng.randint(0, len(data))
+            data[at:at] = bytes(rng.randrange(256) for _ in range(rng.randint(1, 8)))
+        elif choice == 3 and data:
+            start = rng.randrange(len(data))
+            del data[start:start + rng.randint(1, 8)]
+        elif choice == 4 and data:
+            start = rng.randrange(len(data))
+            piece = data[start:start + rng.randint(1, 16)]
+            at = rng.randint(0, len(data))
+            data[at:at] = piece
+        elif choice == 5 and corpus:
+            other = rng.choice(corpus)
+            cut = rng.randint(0, len(data))
+            data = data[:cut] + other[rng.randint(0, len(other)):]
+        else:
+            data.insert(rng.randint(0, len(data)), rng.choice(INTERESTING))
+    return bytes(data[:MAX_INPUT])
+
+def campaign(fuzzer, corpus, seconds, rng, covered=None):
+    # Fuzzes for seconds starting from corpus (a list of inputs). Returns
+    # (new inputs with their coverage, findings: key -> input, coverage)
+    covered = set() if covered is None else covered
+    queue = list(corpus) or list(SEEDS)
+    added = []
+    findings = {}
+
+    def consider(data):
+        coverage, finding = fuzzer.execute(data)
+        if finding is not None and finding not in findings:
+            findings[finding] = data
+        if not coverage <= covered:
+            covered.update(coverage)
+            added.append((data, coverage))
+            return True
+        return False
+
+    for data in queue:
+        consider(data)
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        child = mutate(rng.choice(queue), rng, queue)
+        if consider(child):
+            queue.append(child)
+    return added, findings, covered
+
+def cull(entries):
+    # Shortest inputs that together keep all the coverage of entries,
+    # a list of (input, coverage)
+    kept = []
+    covered = set()
+    for data, coverage in sorted(entries, key=lambda entry: (len(entry[0]), entry[0])):
+        if not coverage <= covered:
+            covered |= coverage
+            kept.append((data, coverage))
+    return kept
+
+def minimize(fuzzer, data, finding, runs=MINIMIZE_RUNS):
+    # A shorter input giving the same finding, by deleting chunks
+    chunk = max(len(data) // 2, 1)
+    while chunk and runs > 0:
+        start = 0
+        while start < len(data) and runs > 0:
+            candidate = data[:start] + data[start + chunk:]
+            runs -= 1
+            if fuzzer.execute(candidate)[1] == finding:
+                data = candidate
+            else:
+                start += chunk
+        chunk //= 2
+    return data
+
+# Worker-process state: the Fuzzer for the program it was last given
+_worker = {}
+
+def _run_round(table, program, max_steps, corpus, seconds, seed):
+    key = (table, program, max_steps)
+    fuzzer = _worker.get(key)
+    if fuzzer is None:
+        _worker.clear()
+        fuzzer = _worker[key] = Fuzzer(table, program, max_steps)
+    execs = fuzzer.execs
+    added, findings, covered = campaign(fuzzer, corpus, seconds, random.Random(seed))
+    return added, findings, fuzzer.execs - execs
+
+class Report:
+    def __init__(self):
+        self.corpus = []                # (input, coverage), culled
+        self.covered = set()
+        self.findings = {}              # (kind, word index) -> input
+        self.execs = 0
+        self.seconds = 0.0
+
+    def merge(self, added, findings):
+        for data, coverage in added:
+            self.covered |= coverage
+        self.corpus = cull(self.corpus + list(added))
+        for finding, data in findings.items():
+            old = self.findings.get(finding)
+            if old is None or len(data) < len(old):
+                self.findings[finding] = data
+
+    def summary(self):
+        rate = self.execs / self.seconds if self.seconds else 0.0
+        kinds = collections.Counter(kind for kind, position in self.findings)
+        found = ", ".join(f"{kind}: {n}" for kind, n in kinds.most_common()) or "none"
+        return (f"{self.seconds:.1f} s: {self.execs} execs ({rate:.0f}/s), {len(self.covered)} edges, "
+                f"{len(self.corpus)} inputs; findings: {found}")
+
+def fuzz(table, program, corpus=(), seconds=60.0, jobs=1, max_steps=MAX_STEPS, seed=None, progress=None):
+    # Returns a Report. progress(report) is called after every round.
+    rng = random.Random(seed)
+    report = Report()
+    inputs = list(corpus) or list(SEEDS)
+    pool = None
+    if jobs > 1:
+        import concurrent.futures
+        pool = concurrent.futures.ProcessPoolExecutor(jobs)
+    try:
+        start = time.perf_counter()
+        while True:
+            left = seconds - (time.perf_counter() - start)
+            if left <= 0:
+                break
+            length = min(SYNC, left)
+            seeds = [rng.getrandbits(64) for _ in range(jobs)]
+            if pool is None:
+                results = [_run_round(table, program, max_steps, inputs, length, seeds[0])]
+            else:
+                results = list(pool.map(_run_round, *zip(*[(table, program, max_steps, inputs, length, s)
+                                                             for s in seeds])))
+            for added, findings, execs in results:
+                report.merge(added, findings)
+                report.execs += execs
+            report.seconds = time.perf_counter() - start
+            inputs = [data for data, coverage in report.corpus] or list(SEEDS)
+            if progress is not None:
+                progress(report)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    fuzzer = Fuzzer(table, program, max_steps)
+    for finding, data in report.findings.items():
+        report.findings[finding] = minimize(fuzzer, data, finding)
+    return report
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import sys
+
+    import main
+
+    parser = argparse.ArgumentParser(description="Coverage-guided fuzzing of a SARCASM program's input")
+    parser.add_argument("filename")
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="worker processes (0: one per CPU)")
+    parser.add_argument("--max-steps", type=int, default=MAX_STEPS,
+                        help=f"microinstructions per run before it is a hang (default: {MAX_STEPS})")
+    parser.add_argument("--corpus", metavar="DIR", help="read seed inputs from DIR and write the final corpus back")
+    parser.add_argument("--out", metavar="DIR", help="write one minimized input per finding to DIR")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    table, program = main.read_program(args.filename)
+    corpus = []
+    if args.corpus and os.path.isdir(args.corpus):
+        for name in sorted(os.listdir(args.corpus)):
+            with open(os.path.join(args.corpus, name), "rb") as file:
+                corpus.append(file.read())
+    report = fuzz(table, program, corpus, args.seconds, args.jobs or os.cpu_count() or 1, args.max_steps,
+                  args.seed, progress=lambda report: print(report.summary(), file=sys.stderr, flush=True))
+
+    for (kind, position), data in sorted(report.findings.items()):
+        print(f"{kind} at word {position}: {data!r}")
+    if args.corpus:
+        os.makedirs(args.corpus, exist_ok=True)
+        for name in os.listdir(args.corpus):
+            if name.startswith("input-"):
+                os.remove(os.path.join(args.corpus, name))
+        for number, (data, coverage) in enumerate(report.corpus):
+            with open(os.path.join(args.corpus, f"input-{number:05d}"), "wb") as file:
+                file.write(data)
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        for (kind, position), data in report.findings.items():
+            with open(os.path.join(args.out, f"{kind.replace(' ', '-')}-word-{position}"), "wb") as file:
+                file.write(data)
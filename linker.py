@@ -0,0 +1,164 @@
+# Word-packing linker.
+#
+# Every word costs a trip through the outer loop (fetching its slot, the
+# bounds checks, resetting jumpModification) however few opcodes it holds,
+# so a program written one opcode per word spends most of its time there.
+# pack() groups runs of consecutive words that can become one word holding
+# all their opcodes, and link() rewrites a .asm file that way: any opcode
+# sequence is a word (core.microinstructions_to_instruction).
+#
+# A boundary between two words is kept whenever merging across it could
+# change what the program does:
+#
+#     20     every boundary from the end of a word whose 20 can jump to
+#            the start of its target, both included: after the word and
+#            through the target's start going forward, from the target's
+#            start through the word's end going back. The distance comes
+#            from memory and counts words from the word's end, so the words
+#            in between must stay as they are; merges outside the span
+#            (such as into the jumping word from before, for a forward
+#            jump) leave it intact. Targets come from dataflow.analyze; if
+#            any 20 can land anywhere, or the analysis gives up, nothing is
+#            merged
+#     25     after a word with 25: a jump past its last opcode must still end it
+#     26     before a word with 26: a pc going below 0 must still stop at its start
+#     unreachable  around words control never reaches, which must not start running
+#
+# The packed program runs the same opcodes in the same order, so input,
+# output, memory and registers match the original. The exception is
+# overheadPC, which counts words and so is smaller by the merges before it.
+#
+#     python linker.py prog.asm -o packed.asm
+#     python linker.py prog.asm -o packed.asm --measure --input case.txt
+
+import collections
+import itertools
+
+import dataflow
+from core import decode_program, fast_instruction_to_microinstructions, fast_microinstructions_to_instruction
+
+JUMPS = (25, 26)
+
+def kept_boundaries(table, program, budget=dataflow.BUDGET):
+    # Why each boundary must be kept, or None where words may merge across
+    # it; boundary b lies between words b - 1 and b (index 0 is unused)
+    size = len(program)
+    kept = [None] * (size + 1)
+    analysis = dataflow.analyze(table, program, budget)
+    if analysis is None:
+        return ["analysis gave up"] * (size + 1)
+
+    # +1 where a frozen span of boundaries starts, -1 just after it ends
+    spans = [0] * (size + 2)
+    for position, slot in enumerate(program):
+        opcodes = table[slot]
+        state = analysis.entry(position)
+        if state is None:
+            kept[position] = kept[position + 1] = "unreachable"
+            continue
+        if 26 in opcodes:
+            kept[position] = kept[position] or "26"
+        if 25 in opcodes:
+            kept[position + 1] = kept[position + 1] or "25"
+        if 20 not in opcodes:
+            continue
+        distances = None if any(op in JUMPS for op in opcodes) else dataflow.distances(opcodes, state)
+        if distances is None:
+            return ["20 with unknown target"] * (size + 1)
+        for distance in distances - {0}:
+            low, high = sorted((position + 1, position + distance + 1))
+            spans[max(low, 1)] += 1
+            spans[min(high, size) + 1] -= 1
+    frozen = 0
+    for boundary in range(1, size):
+        frozen += spans[boundary]
+        if frozen and kept[boundary] is None:
+            kept[boundary] = "20"
+    return kept
+
+def pack(table, program, budget=dataflow.BUDGET):
+    # Returns (groups, kept): the [start, stop) word ranges that each become
+    # one word, and how many boundaries were kept for each reason
+    kept = kept_boundaries(table, program, budget)
+    groups = []
+    start = 0
+    for boundary in range(1, len(program)):
+        if kept[boundary] is not None:
+            groups.append((start, boundary))
+            start = boundary
+    if program:
+        groups.append((start, len(program)))
+    return groups, collections.Counter(reason for reason in kept[1:len(program)] if reason is not None)
+
+def encode(opcodes):
+    # A word for opcodes; the rare sequences the encoding does not give
+    # back get NOPs appended until they do (as bench.word)
+    opcodes = list(opcodes)
+    while True:
+        text = fast_microinstructions_to_instruction(opcodes)
+        if text and fast_instruction_to_microinstructions(text) == opcodes:
+            return text
+        opcodes.append(35)
+
+def link(words):
+    # Packs a program given as its words. Returns (packed words, groups,
+    # kept); unmerged words come back as they were
+    words = list(words)
+    table, program = decode_program(words)
+    groups, kept = pack(table, program)
+    packed = []
+    for start, stop in groups:
+        if stop - start == 1:
+            packed.append(words[start])
+        else:
+            packed.append(encode(itertools.chain.from_iterable(table[program[i]] for i in range(start, stop))))
+    return packed, groups, kept
+
+def measure(table, program, data=b""):
+    # Runs program to the end on the profiling loop; returns (outer-loop
+    # iterations, output values, memory, registers)
+    from core import new_memory
+    from profiler import Profile, run_profiled
+    from streams import MemoryInput
+
+    profile = Profile(table, program)
+    output = []
+    memory, registers = run_profiled(table, program, new_memory(), MemoryInput(data).getc, output.append, profile)
+    return sum(profile.visits), output, memory, registers
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    import tokenizer
+
+    parser = argparse.ArgumentParser(description="Merge consecutive words of a SARCASM program")
+    parser.add_argument("filename")
+    parser.add_argument("-o", "--output", required=True, help="where to write the packed .asm")
+    parser.add_argument("--measure", action="store_true",
+                        help="run both programs to the end and compare outer-loop iterations")
+    parser.add_argument("--input", help="input for --measure (default: none)")
+    args = parser.parse_args()
+
+    words = list(tokenizer.words(args.filename))
+    packed, groups, kept = link(words)
+    with open(args.output, "w", encoding="ascii") as file:
+        for word in packed:
+            file.write(word + "\n")
+    reasons = ", ".join(f"{reason}: {count}" for reason, count in kept.most_common()) or "none"
+    print(f"words: {len(words)} -> {len(packed)} ({len(words) - len(packed)} merged away); boundaries kept: {reasons}")
+
+    if args.measure:
+        data = b""
+        if args.input:
+            with open(args.input, "rb") as file:
+                data = file.read()
+        before = measure(*decode_program(words), data)
+        after = measure(*decode_program(packed), data)
+        saved = before[0] - after[0]
+        share = f" ({100 * saved / before[0]:.1f}% fewer)" if before[0] else ""
+        print(f"outer-loop iterations: {before[0]} -> {after[0]}{share}")
+        # overheadPC counts words, so it is left out of the comparison
+        if before[1:3] != after[1:3] or before[3][:5] != after[3][:5]:
+            print("packed program behaves differently", file=sys.stderr)
+            sys.exit(1)
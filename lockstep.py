@@ -0,0 +1,357 @@
+# Lockstep execution of one program over many inputs.
+#
+# run_batch(table, program, inputs) runs one instance of the program per
+# input. With NumPy installed the instances share a single interpreter
+# loop: their registers are uint16 vectors, and each round the instances
+# standing on the lowest (word, pc) run that word's next straight-line block
+# (up to and including a 25/26, or to the end of the word) together, one
+# vector operation per opcode. Instances split up on opcode 20, 25 and 26
+# and join up again when they reach the same (word, pc). Running the group
+# furthest behind first lets instances that took a loop fewer times wait at
+# the exit for the rest.
+#
+# Memory is paged: 256 pages of 256 cells per instance, all mapped to one
+# shared zero page until first written, so N instances cost N page tables
+# plus the pages they actually touch instead of N x 128 KiB.
+#
+# Without NumPy, run_batch falls back to one vm.VM per input; both kinds of
+# batch have the same interface.
+
+import array
+
+from streams import EOF, MemoryInput
+from vm import MEMORY_SIZE, HALTED, RUNNING, VM
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Status of an instance stopped by a division by zero (opcode 15)
+FAULTED = 2
+
+JUMPS = (25, 26)
+
+PAGE_BITS = 8
+PAGE_SIZE = 1 << PAGE_BITS
+
+class PagedMemory:
+    # Memory of N instances; pool[0] is the shared zero page, never written
+    def __init__(self, size):
+        self.pages = np.zeros((size, MEMORY_SIZE >> PAGE_BITS), dtype=np.int64)
+        self.pool = np.zeros((1 + size, PAGE_SIZE), dtype=np.uint16)
+        self.used = 1
+
+    def read(self, instances, addr):
+        return self.pool[self.pages[instances, addr >> PAGE_BITS], addr & (PAGE_SIZE - 1)]
+
+    def write(self, instances, addr, values):
+        page = addr >> PAGE_BITS
+        slots = self.pages[instances, page]
+        fresh = slots == 0
+        if fresh.any():
+            count = int(fresh.sum())
+            if self.used + count > len(self.pool):
+                pool = np.zeros((max(2 * len(self.pool), self.used + count), PAGE_SIZE), dtype=np.uint16)
+                pool[:self.used] = self.pool[:self.used]
+                self.pool = pool
+            new = np.arange(self.used, self.used + count)
+            self.used += count
+            slots[fresh] = new
+            self.pages[instances[fresh], page[fresh]] = new
+        self.pool[slots, addr & (PAGE_SIZE - 1)] = values
+
+    def cells(self, instance):
+        return self.pool[self.pages[instance]].reshape(-1)
+
+class LockstepBatch:
+    def __init__(self, table, program, inputs):
+        if np is None:
+            raise ImportError("lockstep execution needs numpy")
+        self.table = table
+        self.program = program
+        data = [MemoryInput(item).data for item in inputs]
+        size = self.size = len(data)
+
+        self.memory_ = PagedMemory(size)
+        self.pointerOne = np.zeros(size, dtype=np.uint16)
+        self.pointerTwo = np.zeros(size, dtype=np.uint16)
+        self.accumulator = np.zeros(size, dtype=np.uint16)
+        self.registerA = np.zeros(size, dtype=np.uint16)
+        self.checkFlag = np.zeros(size, dtype=np.uint16)
+        self.overheadPC = np.zeros(size, dtype=np.int64)
+        self.pc = np.zeros(size, dtype=np.int64)
+        self.jumpModification = np.zeros(size, dtype=np.int64)
+        self.steps_ = np.zeros(size, dtype=np.int64)
+        self.status_ = np.full(size, RUNNING, dtype=np.int8)
+
+        width = max(1, max(map(len, data), default=0))
+        self.input = np.zeros((size, width), dtype=np.uint16)
+        for instance, values in enumerate(data):
+            self.input[instance, :len(values)] = np.array(values, dtype=np.int64) & 0xFFFF
+        self.input_length = np.array([len(values) for values in data], dtype=np.int64)
+        self.input_pos = np.zeros(size, dtype=np.int64)
+        self.writes = []        # (instances, values) for every opcode 30 run
+        self.outputs = None
+
+        # Word lengths by position, and for each position the first position
+        # at or after it whose word is not empty (an empty word only moves
+        # overheadPC on by one)
+        self.lengths = [len(table[slot]) for slot in program]
+        self.next_word = np.arange(len(program) + 1, dtype=np.int64)
+        for position in reversed(range(len(program))):
+            if not self.lengths[position]:
+                self.next_word[position] = self.next_word[position + 1]
+        self.stride = max(self.lengths, default=0) + 1
+        self.blocks = {}
+
+        self._enter(np.arange(size), np.zeros(size, dtype=np.int64))
+
+    def _enter(self, instances, position):
+        # Moves instances to word position (or halts them past the end)
+        inside = (position >= 0) & (position < len(self.program))
+        position[inside] = self.next_word[position[inside]]
+        self.overheadPC[instances] = position
+        self.pc[instances] = 0
+        starting = instances[position >= 0]
+        self.jumpModification[starting] = 0
+        self.status_[instances[position >= len(self.program)]] = HALTED
+
+    def _block(self, slot, pc):
+        key = (slot, pc)
+        ops = self.blocks.get(key)
+        if ops is None:
+            opcodes = self.table[slot]
+            end = pc
+            while end < len(opcodes) and opcodes[end] not in JUMPS:
+                end += 1
+            ops = self.blocks[key] = tuple(opcodes[pc:end + 1])
+        return ops
+
+    def run(self, max_steps=None):
+        # Runs every instance until it halts, faults or has executed
+        # max_steps microinstructions in total. Instances whose overheadPC
+        # went negative never run another word and stay RUNNING.
+        memory = self.memory_
+        words = len(self.program)
+        while True:
+            runnable = (self.status_ == RUNNING) & (self.overheadPC >= 0)
+            if max_steps is not None:
+                runnable &= self.steps_ < max_steps
+            active = np.flatnonzero(runnable)
+            if not len(active):
+                break
+            key = self.overheadPC[active] * self.stride + self.pc[active]
+            first = key.min()
+            instances = active[key == first]
+            position, start = divmod(int(first), self.stride)
+            ops = self._block(self.program[position], start)
+            limit = len(ops)
+            if max_steps is not None:
+                limit = min(limit, int(max_steps - self.steps_[instances].max()))
+
+            pointerOne = self.pointerOne[instances]
+            pointerTwo = self.pointerTwo[instances]
+            accumulator = self.accumulator[instances]
+            registerA = self.registerA[instances]
+            checkFlag = self.checkFlag[instances]
+            jumpModification = self.jumpModification[instances]
+            pc = np.full(len(instances), start + limit, dtype=np.int64)
+
+            for offset in range(limit):
+                op = ops[offset]
+                if op == 1:
+                    pointerOne = pointerOne + 1
+                elif op == 2:
+                    pointerTwo = pointerTwo + 1
+                elif op == 3:
+                    pointerOne = accumulator
+                elif op == 4:
+                    pointerTwo = accumulator
+                elif op == 5:
+                    pointerOne = memory.read(instances, pointerOne)
+                elif op == 6:
+                    pointerTwo = memory.read(instances, pointerOne)
+                elif op == 7:
+                    memory.write(instances, pointerOne, memory.read(instances, pointerTwo))
+                elif op == 8:
+                    memory.write(instances, pointerTwo, memory.read(instances, pointerOne))
+                elif op == 9:
+                    first_value = memory.read(instances, pointerTwo)
+                    second_value = memory.read(instances, pointerOne)
+                    memory.write(instances, pointerOne, first_value)
+                    memory.write(instances, pointerTwo, second_value)
+                elif op == 10:
+                    memory.write(instances, pointerOne, 0)
+                elif op == 11:
+                    memory.write(instances, pointerTwo, 0)
+                elif op == 12:
+                    accumulator = accumulator + registerA
+                elif op == 13:
+                    accumulator = accumulator - registerA
+                elif op == 14:
+                    accumulator = accumulator * registerA
+                elif op == 15:
+                    zero = registerA == 0
+                    if zero.any():
+                        # Leave the faulting instances on the 15, as vm.VM does
+                        failed = instances[zero]
+                        self.status_[failed] = FAULTED
+                        self.steps_[failed] += offset + 1
+                        self.pc[failed] = start + offset
+                        self.pointerOne[failed] = pointerOne[zero]
+                        self.pointerTwo[failed] = pointerTwo[zero]
+                        self.accumulator[failed] = accumulator[zero]
+                        self.registerA[failed] = registerA[zero]
+                        self.checkFlag[failed] = checkFlag[zero]
+                        self.jumpModification[failed] = jumpModification[zero]
+                        keep = ~zero
+                        instances = instances[keep]
+                        pointerOne = pointerOne[keep]
+                        pointerTwo = pointerTwo[keep]
+                        accumulator = accumulator[keep]
+                        registerA = registerA[keep]
+                        checkFlag = checkFlag[keep]
+                        jumpModification = jumpModification[keep]
+                        pc = pc[keep]
+                    accumulator = accumulator // registerA
+                elif op == 16:
+                    accumulator = registerA
+                elif op == 17:
+                    accumulator = accumulator * accumulator
+                elif op == 18:
+                    registerA = memory.read(instances, pointerOne)
+                elif op == 19:
+                    registerA = memory.read(instances, pointerTwo)
+                elif op == 20:
+                    distance = memory.read(instances, pointerOne).astype(np.int64)
+                    jumpModification = np.where(checkFlag == 1, distance, -distance)
+                elif op == 21:
+                    memory.write(instances, pointerOne, memory.read(instances, pointerOne) + 1)
+                elif op == 22:
+                    memory.write(instances, pointerTwo, memory.read(instances, pointerTwo) + 1)
+                elif op == 23:
+                    memory.write(instances, pointerOne, memory.read(instances, pointerOne) - 1)
+                elif op == 24:
+                    memory.write(instances, pointerTwo, memory.read(instances, pointerTwo) - 1)
+                elif op == 25:
+                    pc = start + offset + accumulator.astype(np.int64) + 1
+                elif op == 26:
+                    pc = np.maximum(start + offset - accumulator.astype(np.int64), -1) + 1
+                elif op == 27:
+                    memory.write(instances, pointerOne, accumulator)
+                elif op == 28:
+                    memory.write(instances, pointerTwo, accumulator)
+                elif op == 29:
+                    pos = self.input_pos[instances]
+                    available = pos < self.input_length[instances]
+                    values = self.input[instances, np.minimum(pos, self.input.shape[1] - 1)]
+                    values[~available] = EOF
+                    self.input_pos[instances] = pos + available
+                    memory.write(instances, pointerOne, values)
+                elif op == 30:
+                    self.writes.append((instances, memory.read(instances, pointerOne)))
+                elif op == 31:
+                    checkFlag = (accumulator == registerA).astype(np.uint16)
+                elif op == 32:
+                    checkFlag = (accumulator < registerA).astype(np.uint16)
+                elif op == 33:
+                    accumulator = checkFlag
+                elif op == 34:
+                    checkFlag = 1 - checkFlag
+                if not len(instances):
+                    break
+
+            self.pointerOne[instances] = pointerOne
+            self.pointerTwo[instances] = pointerTwo
+            self.accumulator[instances] = accumulator
+            self.registerA[instances] = registerA
+            self.checkFlag[instances] = checkFlag
+            self.jumpModification[instances] = jumpModification
+            self.pc[instances] = pc
+            self.steps_[instances] += limit
+
+            # Instances that ran off the end of the word move on by jumpModification + 1
+            finished = pc >= self.lengths[position]
+            if finished.any():
+                self._enter(instances[finished], position + jumpModification[finished] + 1)
+        self.outputs = None
+        return RUNNING if np.any(self.status_ == RUNNING) else HALTED
+
+    def status(self, instance):
+        return int(self.status_[instance])
+
+    def steps(self, instance):
+        return int(self.steps_[instance])
+
+    def registers(self, instance):
+        return (int(self.pointerOne[instance]), int(self.pointerTwo[instance]), int(self.accumulator[instance]),
+                int(self.registerA[instance]), int(self.checkFlag[instance]), int(self.overheadPC[instance]))
+
+    def memory(self, instance):
+        return array.array('H', self.memory_.cells(instance).tobytes())
+
+    def output(self, instance):
+        if self.outputs is None:
+            # Regroup the write log by instance, keeping each one's order
+            outputs = [[] for _ in range(self.size)]
+            if self.writes:
+                instances = np.concatenate([instances for instances, values in self.writes])
+                values = np.concatenate([values for instances, values in self.writes])
+                order = np.argsort(instances, kind="stable")
+                instances = instances[order]
+                values = values[order].tolist()
+                bounds = np.searchsorted(instances, np.arange(self.size + 1)).tolist()
+                for index in range(self.size):
+                    outputs[index] = values[bounds[index]:bounds[index + 1]]
+            self.outputs = outputs
+        return self.outputs[instance]
+
+class SequentialBatch:
+    # The same interface over one vm.VM per input
+    def __init__(self, table, program, inputs):
+        self.vms = []
+        self.outputs = []
+        self.faulted = []
+        for item in inputs:
+            output = []
+            self.vms.append(VM(table, program, MemoryInput(item).getc, output.append))
+            self.outputs.append(output)
+            self.faulted.append(False)
+        self.size = len(self.vms)
+
+    def run(self, max_steps=None):
+        for instance, vm in enumerate(self.vms):
+            if self.faulted[instance]:
+                continue
+            try:
+                vm.run(None if max_steps is None else max(0, max_steps - vm.steps))
+            except ZeroDivisionError:
+                self.faulted[instance] = True
+        return RUNNING if any(self.status(i) == RUNNING for i in range(self.size)) else HALTED
+
+    def status(self, instance):
+        if self.faulted[instance]:
+            return FAULTED
+        return HALTED if self.vms[instance].halted else RUNNING
+
+    def steps(self, instance):
+        return self.vms[instance].steps
+
+    def registers(self, instance):
+        return self.vms[instance].registers()
+
+    def memory(self, instance):
+        return self.vms[instance].memory
+
+    def output(self, instance):
+        return self.outputs[instance]
+
+def run_batch(table, program, inputs, max_steps=None, lockstep=None):
+    # One instance per item of inputs (str, bytes or ints, as for
+    # streams.MemoryInput). lockstep=None uses NumPy when it is installed.
+    if lockstep is None:
+        lockstep = np is not None
+    batch = (LockstepBatch if lockstep else SequentialBatch)(table, program, inputs)
+    batch.run(max_steps)
+    return batch
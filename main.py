@@ -1,100 +1,12 @@
 import sys
-import array
-import sys
-
-if sys.platform.startswith('win'):
-    import msvcrt
-    def getch():
-        return msvcrt.getch().decode('utf-8', errors='ignore')
-else:
-    import tty
-    import termios
-
-    def getch():
-        fd = sys.stdin.fileno()
-        old_settings = termios.tcgetattr(fd)
-        try:
-            tty.setraw(fd)
-            ch = sys.stdin.read(1)
-        finally:
-            termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-        return ch
-
-class UInt16:
-    def __init__(self, value):
-        self.value = value & 0xFFFF  # Force 16-bit range
-
-    def __int__(self):
-        return self.value
-
-    # Arithmetic operations
-    def __add__(self, other):
-        return UInt16(self.value + int(other))
-
-    def __sub__(self, other):
-        return UInt16(self.value - int(other))
-
-    def __mul__(self, other):
-        return UInt16(self.value * int(other))
-
-    def __floordiv__(self, other):
-        return UInt16(self.value // int(other))
-
-    def __pow__(self, power, modulo=None):
-        return UInt16(pow(self.value, int(power), 0x10000))
-
-    # In-place variants (return new objects to prevent aliasing bugs)
-    def __iadd__(self, other):
-        return self.__add__(other)
-
-    def __isub__(self, other):
-        return self.__sub__(other)
-
-    def __imul__(self, other):
-        return self.__mul__(other)
-
-    def __ifloordiv__(self, other):
-        return self.__floordiv__(other)
-
-    # Comparisons
-    def __eq__(self, other):
-        return self.value == int(other)
-
-    def __lt__(self, other):
-        return self.value < int(other)
-
-    def __le__(self, other):
-        return self.value <= int(other)
-
-    def __gt__(self, other):
-        return self.value > int(other)
-
-    def __ge__(self, other):
-        return self.value >= int(other)
-
-    # String representation
-    def __repr__(self):
-        return str(self.value)
-
-    def __str__(self):
-        return str(self.value)
 
-class UInt16Array:
-    def __init__(self, size):
-        self.max_value = 2**16
-        self.data = [UInt16(0) for _ in range(size)]
+from core import (UInt16, UInt16Array, decode_program, fetch, getch, instruction_to_microinstructions,
+                  microinstructions_to_instruction, new_memory, shuffle, to_base_n_1_indexed)
+from streams import stdio
 
-    def __getitem__(self, index):
-        return self.data[index]
-
-    def __setitem__(self, index, value):
-        if isinstance(value, UInt16):
-            self.data[index] = value
-        else:
-            self.data[index] = UInt16(value)
-
-    def __len__(self):
-        return len(self.data)
+Input = True
+Output =  True
+Debug = False
 
 def extract_letters_and_spaces(filename):
     with open(filename, 'r', encoding='utf-8') as file:
@@ -109,171 +21,296 @@ def extract_letters_and_spaces(filename):
     # Convert to lowercase
     return filtered.lower()
 
-def to_base_n_1_indexed(num, base):
-    if num <= 0:
-        raise ValueError("Number must be positive")
-
-    digits = []
-    n = num
-    while n > 0:
-        remainder = (n - 1) % base + 1  # digits 1..N
-        digits.append(remainder)
-        n = (n - 1) // base
-    digits.reverse()
-    return digits
-
-def shuffle(n):
-    # Swap even and odd:
-    if n % 2 == 0:
-        n = n + 1
-    else:
-        n = n - 1
-    
-    # Then swap mod3 pairs on the new n:
-    r = n % 3
-    base = n - r
-    if r == 0:
-        return base + 2
-    elif r == 2:
-        return base + 0
-    else:
-        return n
-
-
-def fetch(s: str) -> int:
-    filtered = ''.join(ch.lower() for ch in s if ch.isalpha())
-    result = 0
-    for ch in filtered:
-        digit = ord(ch) - ord('a') + 1  # 1-26 instead of 0-25
-        result = result * 26 + digit
-    return result
-    
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python run.py <filename>")
-        sys.exit(1)
-
-    Input = True
-    Output =  True
-    Debug = False
-    
-    input_file = sys.argv[1]
-    sentence = extract_letters_and_spaces(input_file)
-    sentence = sentence.split()
-
-    memory = UInt16Array(65536) # Fix this because this is supposed to have all range of 16 bits
-
-    pointerOne = UInt16(0)
-    pointerTwo = UInt16(0)
-    accumulator = UInt16(0)
-    registerA = UInt16(0)
+def read_program(filename):
+    # decode_program over the words of filename, read as a stream
+    # (tokenizer.py) rather than as one string
+    import tokenizer
+
+    return decode_program(tokenizer.words(filename))
+
+def load_program(filename, cache_dir=None):
+    # (table, program) for filename through the .sarc cache (bytecode.py).
+    # A missing or stale artifact is rebuilt; if it cannot be written the
+    # freshly decoded program is used as is.
+    import bytecode
+
+    if filename.endswith(".sarc"):
+        code = bytecode.load(filename)
+        return code.table, code.program
+
+    with open(filename, 'rb') as file:
+        digest = bytecode.source_hash(file.read())
+    path = bytecode.cache_path(filename, digest, cache_dir)
+    code = bytecode.load_matching(path, digest)
+    if code is None:
+        table, program = read_program(filename)
+        try:
+            bytecode.write(path, table, program, digest)
+        except OSError:
+            return table, program
+        code = bytecode.load(path)
+    return code.table, code.program
+
+def source_digest(filename):
+    # bytecode.source_hash of filename's source; a .sarc records it
+    import bytecode
+
+    if filename.endswith(".sarc"):
+        with bytecode.load(filename) as code:
+            return code.digest
+    with open(filename, 'rb') as file:
+        return bytecode.source_hash(file.read())
+
+def run_reference(table, program, console):
+    # Reference interpreter: the if/elif dispatch chain in vm.VM, run to the end
+    from vm import VM
+
+    getc = console.getc if Input else (lambda: None)
+    out = console.putc if Output else (lambda val: None)
+    vm = VM(table, program, getc, out)
+    vm.run()
+    return vm.memory, vm.registers()
+
+def run_watchdog(table, program, console):
+    # Reference semantics under the infinite-loop watchdog (watchdog.py):
+    # stops with a report on stderr once the program provably never ends
+    from watchdog import WatchedVM, LOOPING
+
+    getc = console.getc if Input else (lambda: None)
+    out = console.putc if Output else (lambda val: None)
+    vm = WatchedVM(table, program, getc, out)
+    if vm.run() == LOOPING:
+        console.flush()
+        print(f"watchdog: {vm.loop}", file=sys.stderr)
+    return vm.memory, vm.registers()
+
+def run_checkpointed(table, program, console, resume=None, checkpoint=None, max_steps=None, source=None):
+    # Reference semantics from the snapshot file resume (if given) for at
+    # most max_steps microinstructions; if the program has not halted by
+    # then, its state is written to the snapshot file checkpoint. source is
+    # the program's source hash: it is saved with the checkpoint, and a
+    # snapshot saved with another one is refused (snapshot.SnapshotError)
+    import snapshot
+    from vm import VM, HALTED
+
+    getc = console.getc if Input else (lambda: None)
+    out = console.putc if Output else (lambda val: None)
+    vm = VM(table, program, getc, out)
+    if resume:
+        snapshot.restore(vm, snapshot.load(resume, source=source), source)
+    if vm.run(max_steps) != HALTED and checkpoint:
+        snapshot.save(checkpoint, snapshot.take(vm, source=source))
+        console.flush()
+        print(f"checkpoint: saved {checkpoint} after {vm.steps} steps", file=sys.stderr)
+    return vm.memory, vm.registers()
+
+def run_recorded(table, program, console, history):
+    # Reference semantics with the debugger's step recording (debugger.py)
+    # on; if the program divides by zero, the last steps it ran are listed
+    # on stderr before the error propagates
+    from debugger import RecordingVM, Debugger
+
+    getc = console.getc if Input else (lambda: None)
+    out = console.putc if Output else (lambda val: None)
+    vm = RecordingVM(table, program, getc, out, history=history)
+    try:
+        vm.run()
+    except ZeroDivisionError:
+        console.flush()
+        print("record: division by zero; last steps:", file=sys.stderr)
+        for line in Debugger(vm).trail(20):
+            print(f"  {line}", file=sys.stderr)
+        raise
+    return vm.memory, vm.registers()
+
+def run_compiled(table, program, console, optimize=False):
+    # Runs each word as a Python function generated by compiler.compile_word,
+    # compiling every distinct word the first time it is reached. optimize
+    # runs the peephole pass (peephole.py) over each word first.
+    from compiler import compile_word
+
+    getc = console.getc if Input else (lambda: None)
+    out = console.putc if Output else (lambda val: None)
+    words = [None] * len(table)
+    memory = new_memory()
+
+    pointerOne = 0
+    pointerTwo = 0
+    accumulator = 0
+    registerA = 0
     checkFlag = 0
     overheadPC = 0
-    
-    while overheadPC < len(sentence):
+    jumpModification = 0
+
+    while overheadPC < len(program):
         if overheadPC >= 0:
-            word = sentence[overheadPC]
-            wordz = fetch(word)
-            wordz = shuffle(wordz)
-            base = 36
-            wordz += 1
-            array = to_base_n_1_indexed(wordz, base)
-            pc = 0  # program counter
-            jumpModification = 0
-            while pc < len(array):
-                if pc >= 0:
-                    opcode = array[pc]
-                    if opcode == 1: # Increment pointer
-                        pointerOne += UInt16(1)
-                    elif opcode == 2: # Decrement pointer
-                        pointerTwo += UInt16(1)
-                    elif opcode == 3: # Set pointerone to accumlator
-                        pointerOne = UInt16(int(accumulator))
-                    elif opcode == 4: # Set pointertwo to accumlator
-                        pointerTwo = UInt16(int(accumulator))
-                    elif opcode == 5: # Set pointer to the memory addr it is pointing at
-                        pointerOne = memory[int(pointerOne)]
-                    elif opcode == 6: # Set pointer to the memory addr it is pointing at
-                        pointerTwo = memory[int(pointerOne)]
-                    elif opcode == 7: # set pointerOne addr to pointerTwo addr
-                        memory[int(pointerOne)] = UInt16(int(memory[int(pointerTwo)]))
-                    elif opcode == 8: # set pointerTwo addr to pointerOne addr
-                        memory[int(pointerTwo)] = memory[int(pointerOne)]
-                    elif opcode == 9: # swap values
-                        memory[int(pointerOne)], memory[int(pointerTwo)] = memory[int(pointerTwo)], memory[int(pointerOne)]
-                    elif opcode == 10:
-                        memory[int(pointerOne)] = UInt16(0)
-                    elif opcode == 11:
-                        memory[int(pointerTwo)] = UInt16(0)
-                    elif opcode == 12:
-                        accumulator += registerA
-                    elif opcode == 13:
-                        accumulator -= registerA
-                    elif opcode == 14:
-                        accumulator  *= registerA
-                    elif opcode == 15:
-                        accumulator  //= registerA
-                    elif opcode == 16:
-                        accumulator = UInt16(int(registerA))
-                    elif opcode == 17:
-                        accumulator = accumulator  ** 2
-                    elif opcode == 18:
-                        registerA = UInt16(int(memory[int(pointerOne)]))
-                    elif opcode == 19:
-                        registerA = UInt16(int(memory[int(pointerTwo)]))
-                    elif opcode == 20:
-                        if checkFlag == 1:
-                            jumpModification = int(memory[int(pointerOne)])
-                        else:
-                            jumpModification = int(memory[int(pointerOne)])*-1
-                    elif opcode == 21:
-                        memory[int(pointerOne)] += 1
-                    elif opcode == 22:
-                        memory[int(pointerTwo)] += 1
-                    elif opcode == 23:
-                        memory[int(pointerOne)] -= 1
-                    elif opcode == 24:
-                        memory[int(pointerTwo)] -= 1
-                    elif opcode == 25:
-                        pc += int(accumulator)
-                    elif opcode == 26:
-                        pc -= int(accumulator)
-                    elif opcode == 27:
-                        memory[int(pointerOne)] = UInt16(int(accumulator))
-                    elif opcode == 28:
-                        memory[int(pointerTwo)] = UInt16(int(accumulator))
-                    elif opcode == 29: # input
-                        if Input:
-                            char = getch()
-                            memory[int(pointerOne)] = ord(char)
-                    elif opcode == 30:
-                        if Output:
-                            val = int(memory[int(pointerOne)])
-                            try:
-                                print(chr(val), end='') 
-                            except ValueError:
-                                print('?', end='')
-                    elif opcode == 31:
-                        if int(accumulator) == int(registerA):
-                            checkFlag = 1
-                        else:
-                            checkFlag = 0
-                    elif opcode == 32:
-                        if int(accumulator) < int(registerA):
-                            checkFlag = 1
-                        else:
-                            checkFlag = 0
-                    elif opcode == 33:
-                        accumulator = UInt16(checkFlag)
-                    elif opcode == 34: # Not Checkflag
-                        checkFlag = 1-checkFlag 
-                    elif opcode:
-                        pass
-                pc += 1
+            slot = program[overheadPC]
+            word = words[slot]
+            if word is None:
+                word = words[slot] = compile_word(table[slot], optimize)
+            pointerOne, pointerTwo, accumulator, registerA, checkFlag, jumpModification = word(
+                memory, pointerOne, pointerTwo, accumulator, registerA, checkFlag, getc, out)
         overheadPC += jumpModification
         overheadPC += 1
+    if optimize:
+        compiled = [word for word in words if word is not None]
+        removed = sum(word.removed for word in compiled)
+        print(f"peephole: removed {removed} microinstructions from {len(compiled)} words", file=sys.stderr)
+    return memory, (pointerOne, pointerTwo, accumulator, registerA, checkFlag, overheadPC)
+
+def run_traced(table, program, console):
+    # Compiled words, with hot opcode-20 loops recorded and run as traces
+    # (tracer.py); trace statistics go to stderr
+    from tracer import Tracer
+
+    getc = console.getc if Input else (lambda: None)
+    out = console.putc if Output else (lambda val: None)
+    memory = new_memory()
+    tracer = Tracer(table, program)
+    registers = tracer.run(memory, getc, out)
+    print(tracer.summary(), file=sys.stderr)
+    return memory, registers
+
+def run_c(table, program, console):
+    # Runs the program as C (cbackend.py), built and cached on first use;
+    # without a working C compiler this is the reference interpreter
+    import cbackend
+
+    compiled = cbackend.load(table)
+    if compiled is None:
+        print("c backend: no working C compiler, using the reference interpreter", file=sys.stderr)
+        return run_reference(table, program, console)
+    getc = console.getc if Input else (lambda: None)
+    out = console.putc if Output else (lambda val: None)
+    memory = new_memory()
+    status, registers = compiled.run(program, memory, getc, out)
+    if status == cbackend.FAULTED:
+        raise ZeroDivisionError("integer division or modulo by zero")
+    if status == cbackend.NEGATIVE:
+        # No word runs again, so the reference loop would idle forever
+        raise cbackend.NegativePCError(f"overheadPC went negative ({registers[5]}); the program never halts")
+    return memory, registers
+
+def run_profile(table, program, console, profile):
+    # Profiling loop variant (profiler.py): reference semantics, plus the
+    # per-pc, per-word and opcode-20 counters recorded into profile
+    from profiler import run_profiled
+
+    getc = console.getc if Input else (lambda: None)
+    out = console.putc if Output else (lambda val: None)
+    return run_profiled(table, program, new_memory(), getc, out, profile)
+
+BACKENDS = {
+    "reference": run_reference,
+    "compiled": run_compiled,
+    "c": run_c,
+    "traced": run_traced,
+}
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a SARCASM program")
+    parser.add_argument("filename")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="reference",
+                        help="execution engine (default: reference)")
+    parser.add_argument("-O", "--optimize", action="store_true",
+                        help="peephole-optimize words (compiled backend only)")
+    parser.add_argument("--dataflow", action="store_true",
+                        help="run the whole-program dataflow optimizer before executing")
+    parser.add_argument("--watchdog", action="store_true",
+                        help="stop and report when the program provably loops forever (reference backend only)")
+    parser.add_argument("--max-steps", type=int,
+                        help="stop after this many microinstructions (reference backend only)")
+    parser.add_argument("--checkpoint", metavar="SNAPSHOT",
+                        help="if the program has not halted when it stops, save its state here")
+    parser.add_argument("--resume", metavar="SNAPSHOT",
+                        help="start from a state saved with --checkpoint instead of from the beginning")
+    parser.add_argument("--record", metavar="N", type=int,
+                        help="keep the last N steps and list them if the program faults (reference backend only)")
+    parser.add_argument("--profile", metavar="JSON",
+                        help="run the profiling loop, write its counters to JSON and a report to stderr")
+    parser.add_argument("--stream", action="store_true",
+                        help="decode words on demand instead of loading the whole program (reference backend only)")
+    parser.add_argument("--compile", action="store_true",
+                        help="write the .sarc bytecode for filename and exit")
+    parser.add_argument("--run-compiled", action="store_true",
+                        help="run through the .sarc cache (filename may be a .sarc)")
+    parser.add_argument("--disassemble", action="store_true",
+                        help="list the .sarc bytecode for filename and exit")
+    parser.add_argument("--cache-dir",
+                        help="keep .sarc files here instead of next to the source")
+    args = parser.parse_args()
+    if args.optimize and args.backend != "compiled":
+        parser.error("--optimize needs --backend compiled")
+    if args.profile and args.backend != "reference":
+        parser.error("--profile runs its own loop; drop --backend")
+    if args.watchdog and (args.backend != "reference" or args.profile):
+        parser.error("--watchdog runs on the reference backend only")
+    if args.stream and (args.backend != "reference" or args.profile or args.dataflow
+                        or args.run_compiled or args.compile or args.disassemble):
+        parser.error("--stream runs on the reference backend only")
+    if args.record is not None and (args.backend != "reference" or args.profile or args.watchdog):
+        parser.error("--record runs on the reference backend only")
+    checkpointed = args.max_steps is not None or args.checkpoint or args.resume
+    if checkpointed and (args.backend != "reference" or args.profile or args.watchdog or args.record is not None):
+        parser.error("--max-steps, --checkpoint and --resume run on the reference backend only")
+
+    if args.compile or args.disassemble:
+        import bytecode
+        table, program = load_program(args.filename, args.cache_dir)
+        if args.disassemble:
+            for line in bytecode.disassemble(table, program):
+                print(line)
+        sys.exit(0)
+
+    if args.run_compiled:
+        table, program = load_program(args.filename, args.cache_dir)
+    elif args.stream:
+        import tokenizer
+        table, program = tokenizer.load(args.filename)
+    else:
+        table, program = read_program(args.filename)
+
+    if args.dataflow:
+        import dataflow
+        table, program, removed = dataflow.optimize(table, program)
+        print(f"dataflow: removed {removed} microinstructions", file=sys.stderr)
+
+    with stdio() as console:
+        if args.profile:
+            from profiler import Profile
+            profile = Profile(table, program)
+            result = run_profile(table, program, console, profile)
+        elif args.record is not None:
+            result = run_recorded(table, program, console, args.record)
+        elif checkpointed:
+            import snapshot
+            try:
+                result = run_checkpointed(table, program, console, args.resume, args.checkpoint, args.max_steps,
+                                          source_digest(args.filename))
+            except snapshot.SnapshotError as error:
+                sys.exit(f"resume: {args.resume}: {error}")
+        elif args.watchdog:
+            result = run_watchdog(table, program, console)
+        elif args.optimize:
+            result = run_compiled(table, program, console, optimize=True)
+        elif args.backend == "c":
+            import cbackend
+            try:
+                result = run_c(table, program, console)
+            except cbackend.NegativePCError as error:
+                console.flush()
+                sys.exit(f"c backend: {error}")
+        else:
+            result = BACKENDS[args.backend](table, program, console)
+    memory, (pointerOne, pointerTwo, accumulator, registerA, checkFlag, overheadPC) = result
+    if args.profile:
+        with open(args.profile, 'w', encoding='utf-8') as file:
+            file.write(profile.to_json())
+        print(profile.report(), file=sys.stderr)
     if Debug:
         print("")
         print(f"P1: {pointerOne} P2: {pointerTwo}\nACC: {accumulator}  REG:{registerA} CHKF:{checkFlag} OHPC:{checkFlag}")
-        print(memory[:30])
+        print(memory[:30].tolist())
 
@@ -0,0 +1,181 @@
+# Peephole optimizer for straight-line runs of microinstructions.
+#
+# optimize() rewrites a run of opcodes that contains no 25/26 into a list of
+# IR instructions. An IR instruction is either a plain opcode (an int) or a
+# superinstruction tuple (name, arg):
+#
+#     ("acc_add", k)      accumulator = accumulator + k * registerA   (runs of 12/13)
+#     ("acc_mul", k)      accumulator = accumulator * registerA ** k  (runs of 14)
+#     ("acc_pow", e)      accumulator = accumulator ** e              (runs of 17)
+#     ("p1_add", k)       pointerOne += k                             (runs of 1)
+#     ("p2_add", k)       pointerTwo += k                             (runs of 2)
+#     ("p1_cell_add", k)  memory[pointerOne] += k                     (runs of 21/23)
+#     ("p2_cell_add", k)  memory[pointerTwo] += k                     (runs of 22/24)
+#     ("p1_cell_set", k)  memory[pointerOne] = k                      (10 then 21/23)
+#     ("p2_cell_set", k)  memory[pointerTwo] = k                      (11 then 22/24)
+#
+# All arithmetic stays modulo 2**16. Runs are fused only inside the slice
+# handed to optimize(), so callers that can be entered mid-word through a
+# 25/26 jump must optimize each entry point's run separately (compiler.py
+# does exactly that).
+
+JUMPS = (25, 26)
+NOPS = (35, 36)
+
+REGISTERS = frozenset(("p1", "p2", "acc", "a", "flag", "jm"))
+
+# opcode -> (registers read, registers written, reads memory, memory pointer written, overwrites the whole cell)
+EFFECTS = {
+    1:  ({"p1"}, {"p1"}, False, None, False),
+    2:  ({"p2"}, {"p2"}, False, None, False),
+    3:  ({"acc"}, {"p1"}, False, None, False),
+    4:  ({"acc"}, {"p2"}, False, None, False),
+    5:  ({"p1"}, {"p1"}, True, None, False),
+    6:  ({"p1"}, {"p2"}, True, None, False),
+    7:  ({"p1", "p2"}, set(), True, "p1", True),
+    8:  ({"p1", "p2"}, set(), True, "p2", True),
+    9:  ({"p1", "p2"}, set(), True, "both", False),
+    10: ({"p1"}, set(), False, "p1", True),
+    11: ({"p2"}, set(), False, "p2", True),
+    12: ({"acc", "a"}, {"acc"}, False, None, False),
+    13: ({"acc", "a"}, {"acc"}, False, None, False),
+    14: ({"acc", "a"}, {"acc"}, False, None, False),
+    15: ({"acc", "a"}, {"acc"}, False, None, False),
+    16: ({"a"}, {"acc"}, False, None, False),
+    17: ({"acc"}, {"acc"}, False, None, False),
+    18: ({"p1"}, {"a"}, True, None, False),
+    19: ({"p2"}, {"a"}, True, None, False),
+    20: ({"p1", "flag"}, {"jm"}, True, None, False),
+    21: ({"p1"}, set(), True, "p1", False),
+    22: ({"p2"}, set(), True, "p2", False),
+    23: ({"p1"}, set(), True, "p1", False),
+    24: ({"p2"}, set(), True, "p2", False),
+    27: ({"p1", "acc"}, set(), False, "p1", True),
+    28: ({"p2", "acc"}, set(), False, "p2", True),
+    29: ({"p1"}, set(), False, "p1", False),   # EOF leaves the cell as it was
+    30: ({"p1"}, set(), True, None, False),
+    31: ({"acc", "a"}, {"flag"}, False, None, False),
+    32: ({"acc", "a"}, {"flag"}, False, None, False),
+    33: ({"flag"}, {"acc"}, False, None, False),
+    34: ({"flag"}, {"flag"}, False, None, False),
+    "acc_add":     ({"acc", "a"}, {"acc"}, False, None, False),
+    "acc_mul":     ({"acc", "a"}, {"acc"}, False, None, False),
+    "acc_pow":     ({"acc"}, {"acc"}, False, None, False),
+    "p1_add":      ({"p1"}, {"p1"}, False, None, False),
+    "p2_add":      ({"p2"}, {"p2"}, False, None, False),
+    "p1_cell_add": ({"p1"}, set(), True, "p1", False),
+    "p2_cell_add": ({"p2"}, set(), True, "p2", False),
+    "p1_cell_set": ({"p1"}, set(), False, "p1", True),
+    "p2_cell_set": ({"p2"}, set(), False, "p2", True),
+}
+
+# Opcodes that must never be dropped: I/O, and 15 which raises when registerA is 0
+SIDE_EFFECTS = (15, 29, 30)
+
+def _kind(instr):
+    return instr if isinstance(instr, int) else instr[0]
+
+def _run_end(opcodes, i, members):
+    while i < len(opcodes) and opcodes[i] in members:
+        i += 1
+    return i
+
+def _net(run, up):
+    return sum(1 if op == up else -1 for op in run) % 65536
+
+def _fuse(opcodes):
+    ir = []
+    i = 0
+    while i < len(opcodes):
+        op = opcodes[i]
+        if op in NOPS:
+            i += 1
+        elif op in (12, 13):
+            j = _run_end(opcodes, i, (12, 13))
+            k = _net(opcodes[i:j], 12)
+            if k == 1:
+                ir.append(12)
+            elif k == 65535:
+                ir.append(13)
+            elif k:
+                ir.append(("acc_add", k))
+            i = j
+        elif op in (1, 2, 14, 17, 34):
+            j = _run_end(opcodes, i, (op,))
+            k = j - i
+            if op == 34:
+                if k % 2:
+                    ir.append(34)
+            elif k == 1:
+                ir.append(op)
+            elif op == 14:
+                ir.append(("acc_mul", k))
+            elif op == 17:
+                # x ** (2 ** k) mod 2**16 stops changing once k reaches 16
+                ir.append(("acc_pow", 1 << min(k, 16)))
+            else:
+                ir.append(("p1_add" if op == 1 else "p2_add", k % 65536))
+            i = j
+        elif op in (10, 11, 21, 22, 23, 24):
+            ptr = "p1" if op in (10, 21, 23) else "p2"
+            up, down = (21, 23) if ptr == "p1" else (22, 24)
+            start = i + 1 if op in (10, 11) else i
+            j = _run_end(opcodes, start, (up, down))
+            k = _net(opcodes[start:j], up)
+            if op in (10, 11):
+                ir.append((ptr + "_cell_set", k) if k else op)
+            elif k == 1:
+                ir.append(up)
+            elif k == 65535:
+                ir.append(down)
+            elif k:
+                ir.append((ptr + "_cell_add", k))
+            i = j
+        else:
+            ir.append(op)
+            i += 1
+    return ir
+
+def _eliminate_dead(ir):
+    # Walk backwards dropping writes nobody reads before they are overwritten.
+    # Every register is live at the end of the run: it carries over into the
+    # next word (or the next entry point of this one).
+    live = set(REGISTERS)
+    killed = {"p1": False, "p2": False}  # memory[ptr] is overwritten before being read
+    kept = []
+    for instr in reversed(ir):
+        kind = _kind(instr)
+        reads, writes, mem_read, mem_write, full = EFFECTS[kind]
+        if kind in SIDE_EFFECTS:
+            dead = False
+        elif mem_write is None:
+            dead = not (writes & live)
+        elif mem_write == "both":
+            dead = False
+        else:
+            dead = killed[mem_write] and not (writes & live)
+        if dead:
+            continue
+        kept.append(instr)
+        if kind == 15:
+            # 15 may raise, so everything written before it stays observable
+            live = set(REGISTERS)
+            killed = {"p1": False, "p2": False}
+            continue
+        live = (live - writes) | reads
+        if mem_read or mem_write == "both":
+            killed = {"p1": False, "p2": False}
+        for ptr in writes & {"p1", "p2"}:
+            killed[ptr] = False
+        if full and not mem_read:
+            killed[mem_write] = True
+    kept.reverse()
+    return kept
+
+def optimize(opcodes):
+    # Returns (ir, removed) where removed is how many microinstructions the
+    # pass saved.
+    if any(op in JUMPS for op in opcodes):
+        raise ValueError("optimize() only handles runs without 25/26 jumps")
+    ir = _eliminate_dead(_fuse(opcodes))
+    return ir, len(opcodes) - len(ir)
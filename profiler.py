@@ -0,0 +1,195 @@
+# Profiling interpreter loop.
+#
+# run_profiled() is a copy of the reference loop that also records, in a
+# Profile, how often every pc of every word ran, how often each word index
+# was entered and where opcode 20 sent control. It is selected instead of
+# the plain loop (main.py --profile), so normal runs pay nothing for it.
+
+import json
+
+from core import MNEMONICS
+
+JUMPS = (25, 26)
+
+class Profile:
+    def __init__(self, table, program):
+        self.table = table
+        self.program = program
+        self.visits = [0] * len(program)   # word index -> times entered
+        self.hits = [None] * len(table)    # slot -> per-pc execution counts
+        self.jumps = {}                    # (word index, next word index) -> count, for words that ran 20
+
+    def word_hits(self, slot):
+        hits = self.hits[slot]
+        if hits is None:
+            hits = self.hits[slot] = [0] * len(self.table[slot])
+        return hits
+
+    def opcode_counts(self):
+        counts = [0] * 37
+        for slot, hits in enumerate(self.hits):
+            if hits is not None:
+                for op, n in zip(self.table[slot], hits):
+                    counts[op] += n
+        return counts
+
+    def steps(self):
+        return sum(self.opcode_counts())
+
+    def intra_word_jumps(self):
+        counts = self.opcode_counts()
+        return counts[25] + counts[26]
+
+    def to_dict(self):
+        counts = self.opcode_counts()
+        return {
+            "steps": sum(counts),
+            "opcodes": {str(op): n for op, n in enumerate(counts) if n},
+            "words": [{"index": index, "slot": self.program[index], "visits": n}
+                      for index, n in enumerate(self.visits) if n],
+            "jumps": [{"word": word, "target": target, "count": n,
+                       "taken": target != word + 1}
+                      for (word, target), n in sorted(self.jumps.items())],
+            "intra_word_jumps": counts[25] + counts[26],
+            "pc_hits": {str(slot): hits for slot, hits in enumerate(self.hits) if hits is not None},
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def report(self, top=10):
+        counts = self.opcode_counts()
+        lines = [f"steps: {sum(counts)}", "", "opcodes:"]
+        for op in sorted(range(37), key=lambda op: -counts[op]):
+            if counts[op]:
+                lines.append(f"  {counts[op]:>12}  {op:>2} {MNEMONICS.get(op, f'UNKNOWN_{op}')}")
+
+        lines += ["", f"hottest words (top {top}):"]
+        hot = sorted((index for index, n in enumerate(self.visits) if n), key=lambda index: -self.visits[index])
+        for index in hot[:top]:
+            slot = self.program[index]
+            hits = self.word_hits(slot)
+            lines.append(f"  word {index} (slot {slot}): entered {self.visits[index]} times")
+            for addr, op in enumerate(self.table[slot]):
+                lines.append(f"    {hits[addr]:>12}  {addr:04X}: {MNEMONICS.get(op, f'UNKNOWN_{op}')}")
+
+        lines += ["", "opcode 20 outcomes:"]
+        for (word, target), n in sorted(self.jumps.items(), key=lambda item: -item[1]):
+            kind = "taken" if target != word + 1 else "fall-through"
+            lines.append(f"  word {word} -> {target}: {n} ({kind})")
+        lines += ["", f"intra-word 25/26 jumps: {counts[25] + counts[26]}"]
+        return "\n".join(lines)
+
+def run_word(opcodes, hits, memory, pointerOne, pointerTwo, accumulator, registerA, checkFlag, getc, putc):
+    # One word through the reference dispatch chain, counting every pc.
+    # Returns the registers, jumpModification and whether opcode 20 ran.
+    pc = 0
+    jumpModification = 0
+    jumped = False
+    while pc < len(opcodes):
+        if pc >= 0:
+            hits[pc] += 1
+            opcode = opcodes[pc]
+            if opcode == 1:
+                pointerOne = (pointerOne + 1) & 0xFFFF
+            elif opcode == 2:
+                pointerTwo = (pointerTwo + 1) & 0xFFFF
+            elif opcode == 3:
+                pointerOne = accumulator
+            elif opcode == 4:
+                pointerTwo = accumulator
+            elif opcode == 5:
+                pointerOne = memory[pointerOne]
+            elif opcode == 6:
+                pointerTwo = memory[pointerOne]
+            elif opcode == 7:
+                memory[pointerOne] = memory[pointerTwo]
+            elif opcode == 8:
+                memory[pointerTwo] = memory[pointerOne]
+            elif opcode == 9:
+                memory[pointerOne], memory[pointerTwo] = memory[pointerTwo], memory[pointerOne]
+            elif opcode == 10:
+                memory[pointerOne] = 0
+            elif opcode == 11:
+                memory[pointerTwo] = 0
+            elif opcode == 12:
+                accumulator = (accumulator + registerA) & 0xFFFF
+            elif opcode == 13:
+                accumulator = (accumulator - registerA) & 0xFFFF
+            elif opcode == 14:
+                accumulator = (accumulator * registerA) & 0xFFFF
+            elif opcode == 15:
+                accumulator //= registerA
+            elif opcode == 16:
+                accumulator = registerA
+            elif opcode == 17:
+                accumulator = (accumulator * accumulator) & 0xFFFF
+            elif opcode == 18:
+                registerA = memory[pointerOne]
+            elif opcode == 19:
+                registerA = memory[pointerTwo]
+            elif opcode == 20:
+                jumped = True
+                if checkFlag == 1:
+                    jumpModification = memory[pointerOne]
+                else:
+                    jumpModification = -memory[pointerOne]
+            elif opcode == 21:
+                memory[pointerOne] = (memory[pointerOne] + 1) & 0xFFFF
+            elif opcode == 22:
+                memory[pointerTwo] = (memory[pointerTwo] + 1) & 0xFFFF
+            elif opcode == 23:
+                memory[pointerOne] = (memory[pointerOne] - 1) & 0xFFFF
+            elif opcode == 24:
+                memory[pointerTwo] = (memory[pointerTwo] - 1) & 0xFFFF
+            elif opcode == 25:
+                pc += accumulator
+            elif opcode == 26:
+                pc -= accumulator
+            elif opcode == 27:
+                memory[pointerOne] = accumulator
+            elif opcode == 28:
+                memory[pointerTwo] = accumulator
+            elif opcode == 29:
+                char = getc()
+                if char is not None:
+                    memory[pointerOne] = char & 0xFFFF
+            elif opcode == 30:
+                putc(memory[pointerOne])
+            elif opcode == 31:
+                checkFlag = 1 if accumulator == registerA else 0
+            elif opcode == 32:
+                checkFlag = 1 if accumulator < registerA else 0
+            elif opcode == 33:
+                accumulator = checkFlag
+            elif opcode == 34:
+                checkFlag = 1 - checkFlag
+        pc += 1
+    return pointerOne, pointerTwo, accumulator, registerA, checkFlag, jumpModification, jumped
+
+def run_profiled(table, program, memory, getc, putc, profile):
+    # Same contract as main.run_reference, filling in profile as it goes
+    pointerOne = 0
+    pointerTwo = 0
+    accumulator = 0
+    registerA = 0
+    checkFlag = 0
+    overheadPC = 0
+    jumpModification = 0
+
+    visits = profile.visits
+    jumps = profile.jumps
+    while overheadPC < len(program):
+        if overheadPC >= 0:
+            slot = program[overheadPC]
+            visits[overheadPC] += 1
+            (pointerOne, pointerTwo, accumulator, registerA, checkFlag,
+             jumpModification, jumped) = run_word(
+                table[slot], profile.word_hits(slot), memory,
+                pointerOne, pointerTwo, accumulator, registerA, checkFlag, getc, putc)
+            if jumped:
+                key = (overheadPC, overheadPC + jumpModification + 1)
+                jumps[key] = jumps.get(key, 0) + 1
+        overheadPC += jumpModification
+        overheadPC += 1
+    return memory, (pointerOne, pointerTwo, accumulator, registerA, checkFlag, overheadPC)
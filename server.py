@@ -0,0 +1,282 @@
+# Asyncio session server: many interactive SARCASM programs in one process.
+#
+#     python server.py examples/CAT.ASM --port 7000
+#     python server.py examples/CAT.ASM --unix /tmp/sarcasm.sock
+#     python server.py examples/CAT.ASM --clients 2000 --input "hello\r"
+#
+# Every connection gets its own VM over one shared decoded program. A
+# session is a coroutine that runs its VM QUANTUM microinstructions at a
+# time and yields to the event loop between slices, so the sessions that
+# are running take turns round robin. Bytes from the connection are decoded
+# as UTF-8 into the session's input queue; when the program reaches an IN
+# with the queue empty, getc() answers vm.WAIT, run() returns WAITING and
+# the session sleeps until input comes or the client shuts its side, after
+# which IN reads 0 as at the end of a file. OUT values are written to the
+# connection after every slice, waiting for the client to drain them when
+# it falls behind.
+#
+# A session ends when its program halts or divides by zero, when it has used
+# its step budget (max_steps) or CPU budget (seconds spent running it), or
+# when the client goes away. A program whose overheadPC went negative can
+# never run another word, so its session just waits for the client to
+# leave. A session that has waited for input for PARK_AFTER seconds keeps
+# its memory as a snapshot, where all-zero pages are one shared object, and
+# gets it back when input arrives, so thousands of idle sessions take little
+# memory.
+#
+# simulate() stands in for the clients: it serves a program on a local
+# socket and connects one client per input, all at once, each sending its
+# input, shutting its side and reading until the server closes.
+
+import asyncio
+import codecs
+import collections
+import sys
+import time
+
+import snapshot
+from streams import EOF, to_char
+from vm import VM, HALTED, WAITING, WAIT
+
+# Microinstructions a session runs before letting the others have a turn
+QUANTUM = 10_000
+
+# Seconds of waiting for input before a session's memory is packed away
+PARK_AFTER = 5.0
+
+READ_CHUNK = 4096
+BACKLOG = 1024
+
+class Session:
+    def __init__(self, server, number, reader, writer):
+        self.server = server
+        self.number = number
+        self.reader = reader
+        self.writer = writer
+        self.input = collections.deque()
+        self.shut = False              # the client sent its last byte
+        self.arrived = asyncio.Event()  # set when input comes or the client shuts its side
+        self.output = []
+        self.vm = VM(server.table, server.program, self.getc, self.output.append)
+        self.parked = None             # snapshot holding the memory while idle
+        self.cpu = 0.0
+        self.outcome = None
+
+    def getc(self):
+        if self.input:
+            return self.input.popleft()
+        return EOF if self.shut else WAIT
+
+    async def read(self):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        try:
+            while True:
+                data = await self.reader.read(READ_CHUNK)
+                self.input.extend(map(ord, decoder.decode(data, final=not data)))
+                if not data:
+                    break
+                self.arrived.set()
+        except ConnectionError:
+            pass
+        self.shut = True
+        self.arrived.set()
+
+    async def flush(self):
+        if self.output:
+            text = "".join(map(to_char, self.output))
+            self.output.clear()
+            self.writer.write(text.encode("utf-8"))
+            await self.writer.drain()
+
+    def park(self):
+        self.parked = snapshot.take(self.vm)
+        self.vm.memory = None
+
+    def unpark(self):
+        self.vm.memory = self.parked.memory()
+        self.parked = None
+
+    async def wait(self):
+        # Until there is input or the client has shut its side
+        self.arrived.clear()
+        if self.input or self.shut:
+            return
+        try:
+            await asyncio.wait_for(self.arrived.wait(), PARK_AFTER)
+        except asyncio.TimeoutError:
+            self.park()
+            try:
+                await self.arrived.wait()
+            finally:
+                self.unpark()
+
+    async def run(self):
+        vm = self.vm
+        server = self.server
+        reading = asyncio.create_task(self.read())
+        try:
+            while True:
+                budget = QUANTUM
+                if server.max_steps is not None:
+                    budget = min(budget, server.max_steps - vm.steps)
+                    if budget <= 0:
+                        self.outcome = "step budget"
+                        break
+                started = time.perf_counter()
+                try:
+                    status = vm.run(budget)
+                except ZeroDivisionError:
+                    self.outcome = "division by zero"
+                    break
+                finally:
+                    self.cpu += time.perf_counter() - started
+                await self.flush()
+                if status == HALTED:
+                    self.outcome = "halted"
+                    break
+                if server.cpu is not None and self.cpu >= server.cpu:
+                    self.outcome = "cpu budget"
+                    break
+                if self.writer.is_closing():
+                    self.outcome = "client gone"
+                    break
+                if status == WAITING:
+                    await self.wait()
+                elif not vm.in_word and vm.overheadPC < 0:
+                    await reading
+                    self.outcome = "stuck"
+                    break
+                else:
+                    await asyncio.sleep(0)
+        except ConnectionError:
+            self.outcome = "client gone"
+        finally:
+            await self.flush_quietly()
+            reading.cancel()
+
+    async def flush_quietly(self):
+        try:
+            await self.flush()
+        except ConnectionError:
+            pass
+
+class Server:
+    def __init__(self, table, program, max_steps=None, cpu=None, log=None):
+        self.table = table
+        self.program = program
+        self.max_steps = max_steps
+        self.cpu = cpu
+        self.log = log                          # text stream for one line per finished session
+        self.sessions = {}                      # number -> live Session
+        self.opened = 0
+        self.outcomes = collections.Counter()   # outcome -> finished sessions
+
+    def parked(self):
+        return sum(session.parked is not None for session in self.sessions.values())
+
+    async def handle(self, reader, writer):
+        self.opened += 1
+        session = self.sessions[self.opened] = Session(self, self.opened, reader, writer)
+        try:
+            await session.run()
+        finally:
+            del self.sessions[session.number]
+            self.outcomes[session.outcome] += 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+            if self.log is not None:
+                print(f"session {session.number}: {session.outcome} after {session.vm.steps} steps, "
+                      f"{session.cpu:.3f} s", file=self.log, flush=True)
+
+    async def start(self, host="127.0.0.1", port=0, path=None):
+        # A listening asyncio server on a Unix socket at path, else on TCP
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle, path, backlog=BACKLOG)
+        return await asyncio.start_server(self.handle, host, port, backlog=BACKLOG)
+
+async def client(connect, data):
+    # One stand-in client: sends data, shuts its side, returns all output
+    reader, writer = await connect()
+    try:
+        writer.write(data.encode("utf-8"))
+        await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+        output = await reader.read()
+    finally:
+        writer.close()
+    return output.decode("utf-8", errors="replace")
+
+async def simulate(table, program, inputs, max_steps=None, cpu=None, path=None):
+    # Serves program on a local socket, connects one client per input and
+    # returns (their outputs, the server)
+    server = Server(table, program, max_steps, cpu)
+    listening = await server.start(path=path)
+    if path is not None:
+        def connect():
+            return asyncio.open_unix_connection(path)
+    else:
+        host, port = listening.sockets[0].getsockname()[:2]
+
+        def connect():
+            return asyncio.open_connection(host, port)
+    async with listening:
+        outputs = await asyncio.gather(*(client(connect, data) for data in inputs))
+    return outputs, server
+
+def _raise_file_limit():
+    # Every simulated session holds two sockets in this process
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+async def serve(server, host, port, path):
+    listening = await server.start(host, port, path)
+    where = path or "%s:%d" % listening.sockets[0].getsockname()[:2]
+    print(f"serving on {where}", file=sys.stderr, flush=True)
+    async with listening:
+        await listening.serve_forever()
+
+if __name__ == "__main__":
+    import argparse
+
+    import main
+
+    parser = argparse.ArgumentParser(description="Serve a SARCASM program to many clients at once")
+    parser.add_argument("filename")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7000)
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--max-steps", type=int, help="microinstructions each session may run")
+    parser.add_argument("--cpu", type=float, help="seconds of CPU each session may use")
+    parser.add_argument("--clients", type=int,
+                        help="instead of serving, connect this many local clients and report")
+    parser.add_argument("--input", default="",
+                        help="what every --clients client sends (backslash escapes allowed)")
+    args = parser.parse_args()
+
+    table, program = main.read_program(args.filename)
+    if args.clients is None:
+        server = Server(table, program, args.max_steps, args.cpu, log=sys.stderr)
+        try:
+            asyncio.run(serve(server, args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
+    else:
+        _raise_file_limit()
+        data = args.input.encode("latin-1", "backslashreplace").decode("unicode_escape")
+        start = time.perf_counter()
+        outputs, server = asyncio.run(simulate(table, program, [data] * args.clients,
+                                               args.max_steps, args.cpu, args.unix))
+        elapsed = time.perf_counter() - start
+        outcomes = ", ".join(f"{outcome}: {count}" for outcome, count in server.outcomes.most_common())
+        print(f"{args.clients} sessions in {elapsed:.2f} s ({outcomes})")
+        for output, count in collections.Counter(outputs).most_common():
+            print(f"{count} x {output!r}")
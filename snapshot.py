@@ -0,0 +1,278 @@
+# VM snapshots: checkpoint, restore and fork.
+#
+# take(vm) captures the complete state of a vm.VM as an immutable Snapshot:
+# its registers plus the memory image, held as 256 pages of 256 cells. Pages
+# are bytes objects shared between snapshots: take(vm, base) reuses every
+# page of base that the VM has not changed since, and all-zero pages are one
+# shared object, so a chain of checkpoints, or many snapshots forked from
+# one, only pays for the pages each of them dirtied.
+#
+# The VM marks every page it writes in vm.dirty, and remembers in vm.clean
+# the snapshot its memory last matched (the one it was taken as or restored
+# to). take(vm) then only copies the dirty pages out of memory and keeps the
+# rest of vm.clean's pages as they are, and restore(vm, snapshot) only
+# rewrites pages that are dirty or not shared between the two snapshots, so
+# both cost O(dirty pages) rather than O(memory) when checkpointing one VM.
+# take(vm, base) with some other base reads the whole memory once.
+#
+# fork(vm or snapshot) starts a new VM from the same state, e.g. to feed it
+# different input from a common prefix. Its memory is a plain array('H'),
+# which cannot share pages, so fork copies the 128 KiB image in one go; the
+# fork inherits clean and dirty, so its own snapshots again only copy the
+# pages it writes.
+#
+# A snapshot only makes sense with the program it was taken from, so it can
+# carry that program's source hash (bytecode.source_hash, as in .sarc
+# headers): take(vm, source=...) records it, and loads() and restore() given
+# a source raise SnapshotError when the snapshot records a different one.
+#
+# dumps()/loads() serialize a Snapshot. Layout (all integers little-endian):
+#
+#     header   magic "SARS", version (u32), flags (u32, bit 0: delta),
+#              SHA-256 of the base image for a delta (else zeros),
+#              source hash of the program (else zeros),
+#              P1, P2, ACC, A (u16), flag, in_word (u8), overheadPC,
+#              jumpModification, pc (i64), steps (u64), run count (u32)
+#     runs     per run of non-zero cells: first address (u16), length - 1
+#              (u16), then the cells (u16 each)
+#
+# Zero cells between runs are not stored at all. A delta snapshot stores the
+# cells XORed with its base's image, so cells the base already had are zero
+# too, and loads() needs that base back to rebuild it.
+
+import array
+import hashlib
+import re
+import struct
+import sys
+
+from vm import VM, MEMORY_SIZE, PAGE_BITS
+
+MAGIC = b"SARS"
+VERSION = 2
+HEADER = struct.Struct("<4sII32s32sHHHHBBqqqQI")
+RUN = struct.Struct("<HH")
+DELTA = 1
+
+PAGE_CELLS = 1 << PAGE_BITS
+PAGE_BYTES = 2 * PAGE_CELLS
+PAGES = MEMORY_SIZE // PAGE_CELLS
+ZERO_PAGE = bytes(PAGE_BYTES)
+
+# VM attributes a snapshot carries besides memory, in header order
+FIELDS = ("pointerOne", "pointerTwo", "accumulator", "registerA", "checkFlag", "in_word",
+          "overheadPC", "jumpModification", "pc", "steps")
+
+# Runs of non-zero cells in a one-byte-per-cell mask; gaps of one or two
+# zero cells are cheaper to store than a new run header
+_runs = re.compile(rb"[^\x00]+(?:\x00{1,2}[^\x00]+)*")
+
+class SnapshotError(Exception):
+    pass
+
+class Snapshot:
+    def __init__(self, state, pages, table=None, program=None, source=None):
+        self.state = state      # values of FIELDS, also set as attributes
+        self.pages = pages      # PAGES bytes objects, native byte order
+        self.table = table      # the program it was taken from, if known
+        self.program = program
+        self.source = source    # source hash of that program, if known
+        self._digest = None
+        for field, value in zip(FIELDS, state):
+            setattr(self, field, value)
+
+    def registers(self):
+        # Same tuple as VM.registers()
+        return self.state[:5] + self.state[6:7]
+
+    def image(self):
+        return b"".join(self.pages)
+
+    def memory(self):
+        # A fresh, writable copy of the memory image
+        memory = array.array('H')
+        memory.frombytes(self.image())
+        return memory
+
+    def digest(self):
+        # SHA-256 of the memory image in little-endian order; identifies the
+        # base of a delta
+        if self._digest is None:
+            self._digest = hashlib.sha256(_little_endian(self.image())).digest()
+        return self._digest
+
+    def shared(self, other):
+        # Number of pages this snapshot shares with other (not copied)
+        return sum(page is theirs for page, theirs in zip(self.pages, other.pages))
+
+def _little_endian(image):
+    if sys.byteorder != "little":
+        cells = array.array('H', image)
+        cells.byteswap()
+        return cells.tobytes()
+    return image
+
+def _paginate(image, base=None):
+    pages = []
+    for number in range(PAGES):
+        page = image[number * PAGE_BYTES:(number + 1) * PAGE_BYTES]
+        if base is not None and page == base.pages[number]:
+            page = base.pages[number]
+        elif page == ZERO_PAGE:
+            page = ZERO_PAGE
+        pages.append(page)
+    return tuple(pages)
+
+def _check_source(snapshot_source, source):
+    if source is not None and snapshot_source is not None and snapshot_source != source:
+        raise SnapshotError("snapshot was taken from a different program")
+
+def _dirty(vm):
+    # Numbers of the pages vm has written since vm.clean
+    dirty = vm.dirty
+    number = dirty.find(1)
+    while number >= 0:
+        yield number
+        number = dirty.find(1, number + 1)
+
+def _mark_clean(vm, snapshot):
+    vm.clean = snapshot
+    vm.dirty[:] = bytes(PAGES)
+
+def take(vm, base=None, source=None):
+    # Snapshot of vm, sharing unchanged pages with base when given; source
+    # is the program's source hash (by default the one of vm.clean, if any)
+    state = tuple(getattr(vm, field) for field in FIELDS)
+    previous = vm.clean
+    if source is None and previous is not None:
+        source = previous.source
+    if previous is None or (base is not None and base is not previous):
+        pages = _paginate(vm.memory.tobytes(), base)
+    else:
+        pages = list(previous.pages)
+        with memoryview(vm.memory).cast('B') as view:
+            for number in _dirty(vm):
+                start = number * PAGE_BYTES
+                page = view[start:start + PAGE_BYTES].tobytes()
+                if page == pages[number]:
+                    continue
+                pages[number] = ZERO_PAGE if page == ZERO_PAGE else page
+        pages = tuple(pages)
+    snapshot = Snapshot(state, pages, vm.table, vm.program, source)
+    _mark_clean(vm, snapshot)
+    return snapshot
+
+def restore(vm, snapshot, source=None):
+    # Puts vm back into the state of snapshot; the program is not touched,
+    # but with source (its source hash) given it has to be the snapshot's
+    _check_source(snapshot.source, source)
+    for field, value in zip(FIELDS, snapshot.state):
+        setattr(vm, field, value)
+    clean = vm.clean
+    dirty = vm.dirty
+    with memoryview(vm.memory).cast('B') as view:
+        for number, page in enumerate(snapshot.pages):
+            if clean is not None and not dirty[number] and page is clean.pages[number]:
+                # memory still holds this very page
+                continue
+            start = number * PAGE_BYTES
+            if view[start:start + PAGE_BYTES] != page:
+                view[start:start + PAGE_BYTES] = page
+    _mark_clean(vm, snapshot)
+    return vm
+
+def fork(source, getc=None, putc=None):
+    # New VM in the state of source (a VM or a Snapshot) with its own
+    # memory and I/O; source is left as it is
+    if isinstance(source, Snapshot):
+        if source.table is None:
+            raise SnapshotError("snapshot has no program; pass table and program to loads()")
+        memory = source.memory()
+    else:
+        memory = array.array('H', source.memory)
+    vm = VM(source.table, source.program, getc, putc, memory)
+    for field in FIELDS:
+        setattr(vm, field, getattr(source, field))
+    if isinstance(source, Snapshot):
+        _mark_clean(vm, source)
+    else:
+        vm.clean = source.clean
+        vm.dirty[:] = source.dirty
+    return vm
+
+def _xor(image, other):
+    return (int.from_bytes(image, 'little') ^ int.from_bytes(other, 'little')).to_bytes(len(image), 'little')
+
+def dumps(snapshot, base=None):
+    # Serialized snapshot; with base, only what differs from it is stored
+    image = snapshot.image()
+    flags = 0
+    digest = bytes(32)
+    if base is not None:
+        image = _xor(image, base.image())
+        flags |= DELTA
+        digest = base.digest()
+
+    # One byte per cell, zero where the cell is zero
+    mask = bytearray(MEMORY_SIZE)
+    for number in range(PAGES):
+        page = image[number * PAGE_BYTES:(number + 1) * PAGE_BYTES]
+        if page != ZERO_PAGE:
+            mask[number * PAGE_CELLS:(number + 1) * PAGE_CELLS] = bytes(map(bool, array.array('H', page)))
+
+    image = _little_endian(image)
+    body = []
+    for run in _runs.finditer(mask):
+        start, end = run.span()
+        body.append(RUN.pack(start, end - start - 1))
+        body.append(image[2 * start:2 * end])
+    state = snapshot.state
+    header = HEADER.pack(MAGIC, VERSION, flags, digest, snapshot.source or bytes(32),
+                         *state[:5], int(state[5]), *state[6:], len(body) // 2)
+    return header + b"".join(body)
+
+def loads(data, base=None, table=None, program=None, source=None):
+    # Snapshot from dumps() output; a delta needs the snapshot it was made
+    # against as base, and its unchanged pages are shared with it. With
+    # source given, a snapshot of another program is refused.
+    data = memoryview(data)
+    if len(data) < HEADER.size:
+        raise SnapshotError("truncated snapshot header")
+    magic, version, flags, digest, program_source, *state, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise SnapshotError(f"not a version {VERSION} snapshot")
+    program_source = program_source if any(program_source) else None
+    _check_source(program_source, source)
+    state[5] = bool(state[5])
+
+    image = bytearray(2 * MEMORY_SIZE)
+    offset = HEADER.size
+    for _ in range(count):
+        if len(data) < offset + RUN.size:
+            raise SnapshotError("truncated snapshot")
+        start, length = RUN.unpack_from(data, offset)
+        offset += RUN.size
+        end = offset + 2 * (length + 1)
+        if len(data) < end or start + length >= MEMORY_SIZE:
+            raise SnapshotError("truncated snapshot")
+        image[2 * start:2 * (start + length + 1)] = data[offset:end]
+        offset = end
+    image = _little_endian(bytes(image))  # swapping back is the same swap
+
+    if flags & DELTA:
+        if base is None:
+            raise SnapshotError("delta snapshot needs its base")
+        if base.digest() != digest:
+            raise SnapshotError("delta snapshot was made against a different base")
+        image = _xor(image, base.image())
+        if table is None:
+            table, program = base.table, base.program
+    return Snapshot(tuple(state), _paginate(image, base), table, program, program_source)
+
+def save(path, snapshot, base=None):
+    with open(path, 'wb') as file:
+        file.write(dumps(snapshot, base))
+
+def load(path, base=None, table=None, program=None, source=None):
+    with open(path, 'rb') as file:
+        return loads(file.read(), base, table, program, source)
@@ -0,0 +1,187 @@
+# I/O for opcodes 29 (IN $PTR1) and 30 (OUT $PTR1).
+#
+# A Console pairs an input source with an output sink. Sources expose
+# getc() -> int, returning 0 once input is exhausted; sinks expose putc(value)
+# and flush(). stdio() picks the right pair for the current process:
+# raw-mode terminal input entered once for the whole run when stdin is a TTY,
+# bulk reads when stdin is a pipe or file, and buffered stdout either way.
+
+import codecs
+import sys
+
+EOF = 0
+
+# Characters buffered by BufferedOutput before it writes them out
+OUTPUT_BUFFER = 8192
+
+# Bytes requested per read from a pipe or file
+READ_CHUNK = 65536
+
+def to_char(val):
+    # Opcode 30 prints '?' for cells that are not a valid character; within
+    # 16 bits those are the UTF-16 surrogates, which cannot be encoded
+    if 0xD800 <= val <= 0xDFFF:
+        return '?'
+    return chr(val)
+
+class MemoryInput:
+    # Serves input from memory: a str (one value per character), bytes (one
+    # value per byte) or any iterable of ints.
+    interactive = False
+
+    def __init__(self, data=()):
+        if isinstance(data, str):
+            data = [ord(c) for c in data]
+        self.data = list(data)
+        self.pos = 0
+
+    def getc(self):
+        if self.pos >= len(self.data):
+            return EOF
+        val = self.data[self.pos]
+        self.pos += 1
+        return val
+
+    def close(self):
+        pass
+
+class StreamInput:
+    # Reads a binary stream (a pipe or a file) in large chunks and decodes it
+    # as UTF-8, handing out one character per getc().
+    interactive = False
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.chars = ""
+        self.pos = 0
+        self.done = False
+
+    def _fill(self):
+        while self.pos >= len(self.chars) and not self.done:
+            read = getattr(self.stream, "read1", self.stream.read)
+            data = read(READ_CHUNK)
+            self.done = not data
+            self.chars = self.decoder.decode(data, final=self.done)
+            self.pos = 0
+
+    def getc(self):
+        if self.pos >= len(self.chars):
+            self._fill()
+            if self.pos >= len(self.chars):
+                return EOF
+        char = self.chars[self.pos]
+        self.pos += 1
+        return ord(char)
+
+    def close(self):
+        pass
+
+if sys.platform.startswith('win'):
+    import msvcrt
+
+    class TerminalInput:
+        # Unbuffered console keystrokes, like getch()
+        interactive = True
+
+        def getc(self):
+            return ord(msvcrt.getwch())
+
+        def close(self):
+            pass
+else:
+    import termios
+    import tty
+
+    class TerminalInput:
+        # Puts the terminal into raw mode once for the whole run (getch()
+        # pays for tcgetattr/setraw/tcsetattr on every key). Output
+        # post-processing stays on so '\n' still returns the carriage.
+        interactive = True
+
+        def __init__(self, stream=None):
+            self.stream = stream or sys.stdin
+            self.fd = self.stream.fileno()
+            self.saved = termios.tcgetattr(self.fd)
+            tty.setraw(self.fd)
+            mode = termios.tcgetattr(self.fd)
+            mode[1] |= termios.OPOST
+            termios.tcsetattr(self.fd, termios.TCSADRAIN, mode)
+
+        def getc(self):
+            char = self.stream.read(1)
+            return ord(char) if char else EOF
+
+        def close(self):
+            if self.saved is not None:
+                termios.tcsetattr(self.fd, termios.TCSADRAIN, self.saved)
+                self.saved = None
+
+class MemoryOutput:
+    # Collects output values in memory
+    def __init__(self):
+        self.values = []
+        self.putc = self.values.append
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return "".join(to_char(val) for val in self.values)
+
+class BufferedOutput:
+    # Buffers output characters and writes them to a text stream in blocks
+    def __init__(self, stream=None, size=OUTPUT_BUFFER):
+        self.stream = stream or sys.stdout
+        self.size = size
+        self.chars = []
+
+    def putc(self, val):
+        self.chars.append(to_char(val))
+        if len(self.chars) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.chars:
+            self.stream.write("".join(self.chars))
+            self.chars = []
+        self.stream.flush()
+
+class Console:
+    # Pending output is flushed before every read from an interactive source
+    # so prompts appear before the program blocks.
+    def __init__(self, source=None, sink=None):
+        self.source = source if source is not None else MemoryInput()
+        self.sink = sink if sink is not None else MemoryOutput()
+        self.putc = self.sink.putc
+        if self.source.interactive:
+            self.getc = self._interactive_getc
+        else:
+            self.getc = self.source.getc
+
+    def _interactive_getc(self):
+        self.sink.flush()
+        return self.source.getc()
+
+    def flush(self):
+        self.sink.flush()
+
+    def close(self):
+        try:
+            self.sink.flush()
+        finally:
+            self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def stdio():
+    # Console over this process's stdin/stdout
+    if sys.stdin.isatty():
+        source = TerminalInput()
+    else:
+        source = StreamInput(sys.stdin.buffer)
+    return Console(source, BufferedOutput(sys.stdout))
@@ -0,0 +1,488 @@
+# Superoptimizer: shortest opcode sequences with the same effect.
+#
+# A word's opcodes are the bijective base-36 digits of the number its
+# letters spell, so fewer opcodes also means a shorter word. Table(length)
+# enumerates opcode sequences of up to length opcodes breadth first and
+# keeps the first, so shortest, one for every distinct effect. Effects are
+# told apart by a fingerprint: the registers, jumpModification and changed
+# memory cells a sequence leaves behind when run from TESTS fixed starting
+# states (the machine's initial state, aliased pointers, self-pointing
+# cells, small values and random ones), memoized as a hash. A sequence
+# whose fingerprint was already seen is dropped together with everything
+# that would extend it, and each level of the search can be spread over
+# worker processes.
+#
+# optimize() cuts a word at the opcodes that are never searched over (15,
+# which can raise, the I/O opcodes 29/30 and the pc-relative jumps 25/26)
+# and walks along every run between them. At each position it takes the
+# window that shrinks the most, found either in the table or by a search()
+# from the states the run has reached there, which knows what the opcodes
+# before it did (CLR $PTR1, INC $PTR1, MOV REGA, $PTR1 makes registerA 1)
+# and tries only opcodes that write what the window writes. A replacement
+# is only made when it agrees with the window from every corner state (the
+# pointers, accumulator, registerA and the cells under the pointers drawn
+# from 0, 1, 0xFFFF and two random values, in every combination) and from
+# VERIFY random ones. In a word with 25/26 only the opcodes after its last
+# 26 and before its first 25 are optimized: no jump can land in them or
+# jump across them, so shrinking them moves every target by the same amount
+# as the jump itself. Everything a 25/26 can reach or cross keeps its
+# opcodes and its pcs.
+#
+#     python superopt.py 10 21 18 16 12 12 12 17 13 13 13
+#     python superopt.py --word someword --length 4 -j 8
+
+import concurrent.futures
+import itertools
+import os
+import random
+
+from core import disassemble, instruction_to_microinstructions, microinstructions_to_instruction
+
+MASK = 0xFFFF
+
+# Opcodes never searched over; the runs between them are optimized separately
+BARRIERS = (15, 25, 26, 29, 30)
+ALPHABET = tuple(op for op in range(1, 35) if op not in BARRIERS)
+
+LENGTH = 3             # longest replacement the table holds by default
+WINDOW = 12            # longest window optimize() tries to replace
+TESTS = 12             # starting states a fingerprint is taken from
+VERIFY = 2000          # random states a replacement must also agree on
+FRONTIER = 400_000     # new sequences in one level before the table stops growing
+PARALLEL = 2_000       # frontier size from which a level goes to the worker pool
+SEARCH = 2_000         # sequences one search in context may try
+
+class Start:
+    # A starting state: registers (P1, P2, ACC, A, flag, jumpModification),
+    # a few fixed cells, and every other cell given by a hash of its address
+    # (0 everywhere when salt is 0)
+    __slots__ = ("registers", "fixed", "salt", "mask")
+
+    def __init__(self, registers, fixed=None, salt=0, mask=MASK):
+        self.registers = registers
+        self.fixed = fixed or {}
+        self.salt = salt
+        self.mask = mask
+
+    def memory(self, addr):
+        value = self.fixed.get(addr)
+        if value is not None:
+            return value
+        if not self.salt:
+            return 0
+        return ((addr ^ self.salt) * 0x9E3779B97F4A7C15 >> 40) & self.mask
+
+    def state(self):
+        # [P1, P2, ACC, A, flag, jumpModification, changed cells]
+        return [*self.registers, {}]
+
+def _load(cells, start, addr):
+    value = cells.get(addr)
+    return start.memory(addr) if value is None else value
+
+def _store(cells, start, addr, value):
+    # Only cells that differ from the start are kept, so equal states have
+    # equal dicts
+    if value == start.memory(addr):
+        cells.pop(addr, None)
+    else:
+        cells[addr] = value
+
+def step(state, op, start):
+    # Runs one opcode that is not a barrier on state, in place
+    p1, p2, acc, a, flag, jm, cells = state
+    if op == 1:
+        state[0] = (p1 + 1) & MASK
+    elif op == 2:
+        state[1] = (p2 + 1) & MASK
+    elif op == 3:
+        state[0] = acc
+    elif op == 4:
+        state[1] = acc
+    elif op == 5:
+        state[0] = _load(cells, start, p1)
+    elif op == 6:
+        state[1] = _load(cells, start, p1)
+    elif op == 7:
+        _store(cells, start, p1, _load(cells, start, p2))
+    elif op == 8:
+        _store(cells, start, p2, _load(cells, start, p1))
+    elif op == 9:
+        first, second = _load(cells, start, p1), _load(cells, start, p2)
+        _store(cells, start, p1, second)
+        _store(cells, start, p2, first)
+    elif op == 10:
+        _store(cells, start, p1, 0)
+    elif op == 11:
+        _store(cells, start, p2, 0)
+    elif op == 12:
+        state[2] = (acc + a) & MASK
+    elif op == 13:
+        state[2] = (acc - a) & MASK
+    elif op == 14:
+        state[2] = (acc * a) & MASK
+    elif op == 16:
+        state[2] = a
+    elif op == 17:
+        state[2] = (acc * acc) & MASK
+    elif op == 18:
+        state[3] = _load(cells, start, p1)
+    elif op == 19:
+        state[3] = _load(cells, start, p2)
+    elif op == 20:
+        value = _load(cells, start, p1)
+        state[5] = value if flag == 1 else -value
+    elif op == 21:
+        _store(cells, start, p1, (_load(cells, start, p1) + 1) & MASK)
+    elif op == 22:
+        _store(cells, start, p2, (_load(cells, start, p2) + 1) & MASK)
+    elif op == 23:
+        _store(cells, start, p1, (_load(cells, start, p1) - 1) & MASK)
+    elif op == 24:
+        _store(cells, start, p2, (_load(cells, start, p2) - 1) & MASK)
+    elif op == 27:
+        _store(cells, start, p1, acc)
+    elif op == 28:
+        _store(cells, start, p2, acc)
+    elif op == 31:
+        state[4] = 1 if acc == a else 0
+    elif op == 32:
+        state[4] = 1 if acc < a else 0
+    elif op == 33:
+        state[2] = flag
+    elif op == 34:
+        state[4] = 1 - flag
+    elif op not in (35, 36):
+        raise ValueError(f"opcode {op} cannot be searched over")
+
+def fingerprint(state):
+    return (*state[:6], *sorted(state[6].items()))
+
+def final(opcodes, start):
+    state = start.state()
+    for op in opcodes:
+        step(state, op, start)
+    return fingerprint(state)
+
+def _random_start(rng):
+    registers = [rng.getrandbits(16) for _ in range(4)] + [rng.getrandbits(1), rng.getrandbits(16)]
+    return Start(registers, salt=rng.getrandbits(32) | 1)
+
+def test_starts(seed=0):
+    # The TESTS starting states fingerprints are taken from
+    rng = random.Random(seed)
+    starts = [Start([0, 0, 0, 0, 0, 0]), Start([0, 0, 0, 0, 1, 0], salt=rng.getrandbits(32) | 1)]
+    p1_is_p2 = _random_start(rng)
+    p1_is_p2.registers[1] = p1_is_p2.registers[0]
+    self_pointer = _random_start(rng)
+    self_pointer.fixed = {self_pointer.registers[0]: self_pointer.registers[0]}
+    acc_is_a = _random_start(rng)
+    acc_is_a.registers[3] = acc_is_a.registers[2]
+    small = Start([rng.randrange(4) for _ in range(4)] + [1, 0], salt=rng.getrandbits(32) | 1, mask=3)
+    starts += [p1_is_p2, self_pointer, acc_is_a, small]
+    while len(starts) < TESTS:
+        starts.append(_random_start(rng))
+    return starts
+
+def corner_starts(seed=0):
+    # Every combination of P1, P2, ACC, A, memory[P1] and memory[P2] drawn
+    # from 0, 1, 0xFFFF and two random values
+    rng = random.Random(seed + 1)
+    pool = (0, 1, MASK, rng.getrandbits(16), rng.getrandbits(16))
+    for p1, p2, acc, a, under_p1, under_p2 in itertools.product(pool, repeat=6):
+        if p1 == p2 and under_p1 != under_p2:
+            continue
+        yield Start([p1, p2, acc, a, (acc ^ a) & 1, 0], {p1: under_p1, p2: under_p2}, rng.getrandbits(32) | 1)
+
+# seed -> corner and random states replacements are checked from
+_checks = {}
+
+def check_starts(seed=0):
+    starts = _checks.get(seed)
+    if starts is None:
+        rng = random.Random(seed + 2)
+        starts = list(corner_starts(seed)) + [_random_start(rng) for _ in range(VERIFY)]
+        _checks[seed] = starts
+    return starts
+
+class Checker:
+    # The check states, advanced along a run as it is rewritten, so a
+    # window and its replacement are compared from wherever the run has got
+    # to without replaying what came before
+    def __init__(self, seed=0):
+        self.starts = check_starts(seed)
+        self.states = None
+        self.applied = 0
+
+    def agree(self, prefix, window, replacement):
+        # True when window and replacement leave the same state after prefix
+        if self.states is None:
+            self.states = [start.state() for start in self.starts]
+        for op in prefix[self.applied:]:
+            for state, start in zip(self.states, self.starts):
+                step(state, op, start)
+        self.applied = len(prefix)
+        for state, start in zip(self.states, self.starts):
+            first = state[:6] + [dict(state[6])]
+            second = state[:6] + [dict(state[6])]
+            for op in window:
+                step(first, op, start)
+            for op in replacement:
+                step(second, op, start)
+            if first != second:
+                return False
+        return True
+
+def agree(first, second, seed=0):
+    # True when two barrier-free sequences leave the same state from every
+    # corner state and VERIFY random ones
+    return Checker(seed).agree((), first, second)
+
+# Worker-process cache: seed -> test_starts(seed)
+_starts = {}
+
+def _key(opcodes, starts):
+    return hash(tuple(final(opcodes, start) for start in starts))
+
+def _expand(frontier, seed):
+    # (sequence, key) of every one-opcode extension of frontier whose key
+    # was not already produced by an earlier one in this chunk
+    starts = _starts.get(seed)
+    if starts is None:
+        starts = _starts[seed] = test_starts(seed)
+    found = []
+    seen = set()
+    for sequence in frontier:
+        states = []
+        for start in starts:
+            state = start.state()
+            for op in sequence:
+                step(state, op, start)
+            states.append(state)
+        for op in ALPHABET:
+            key = []
+            for state, start in zip(states, starts):
+                state = state[:6] + [dict(state[6])]
+                step(state, op, start)
+                key.append(fingerprint(state))
+            key = hash(tuple(key))
+            if key not in seen:
+                seen.add(key)
+                found.append((sequence + (op,), key))
+    return found
+
+class Table:
+    def __init__(self, length=LENGTH, seed=0, workers=1):
+        self.length = length
+        self.seed = seed
+        self.starts = test_starts(seed)
+        self.shortest = {_key((), self.starts): ()}   # fingerprint hash -> shortest sequence
+        self.complete = True                          # every sequence up to length was searched
+        self.replacements = {}                        # window -> verified replacement or None
+        pool = None
+        frontier = [()]
+        try:
+            for level in range(1, length + 1):
+                if workers > 1 and len(frontier) >= PARALLEL:
+                    if pool is None:
+                        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+                    size = -(-len(frontier) // (4 * workers))
+                    chunks = [frontier[i:i + size] for i in range(0, len(frontier), size)]
+                    found = itertools.chain.from_iterable(pool.map(_expand, chunks, itertools.repeat(seed)))
+                else:
+                    found = _expand(frontier, seed)
+                frontier = []
+                for sequence, key in found:
+                    if key not in self.shortest:
+                        self.shortest[key] = sequence
+                        frontier.append(sequence)
+                if len(frontier) > FRONTIER and level < length:
+                    self.length = level
+                    self.complete = False
+                    break
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def __len__(self):
+        return len(self.shortest)
+
+    def replacement(self, window):
+        # A verified sequence shorter than window with the same effect, or None
+        window = tuple(window)
+        if window in self.replacements:
+            return self.replacements[window]
+        found = self.shortest.get(_key(window, self.starts))
+        if found is not None and (len(found) >= len(window) or not agree(window, found, self.seed)):
+            found = None
+        self.replacements[window] = found
+        return found
+
+def _written(op):
+    # What op writes: a register's index in the state, "memory", or None
+    if op in (1, 3, 5):
+        return 0
+    if op in (2, 4, 6):
+        return 1
+    if op in (12, 13, 14, 16, 17, 33):
+        return 2
+    if op in (18, 19):
+        return 3
+    if op in (31, 32, 34):
+        return 4
+    if op == 20:
+        return 5
+    if op in (35, 36):
+        return None
+    return "memory"
+
+WRITTEN = {op: _written(op) for op in range(1, 37) if op not in BARRIERS}
+
+def search(contexts, starts, run, limit=SEARCH):
+    # Breadth-first search from the states contexts (reached from starts by
+    # what came before run) for sequences with the same effect as the
+    # prefixes of run, using only opcodes that write what run writes.
+    # Returns (size, sequence) for every prefix that has a shorter one, the
+    # biggest saving first; gives up after trying limit sequences
+    def key(states):
+        return hash(tuple(map(fingerprint, states)))
+
+    def advance(states, op):
+        advanced = []
+        for state, start in zip(states, starts):
+            state = state[:6] + [dict(state[6])]
+            step(state, op, start)
+            advanced.append(state)
+        return advanced
+
+    # Effect -> longest prefix of run with it
+    goals = {}
+    states = contexts
+    for size, op in enumerate(run, 1):
+        states = advance(states, op)
+        goals[key(states)] = size
+    found = {}
+    here = key(contexts)
+    if here in goals:
+        found[goals[here]] = ()
+    seen = {here}
+    targets = {WRITTEN[op] for op in run}
+    alphabet = [op for op in ALPHABET if WRITTEN[op] in targets]
+    frontier = [((), contexts)]
+    level = 0
+    tried = 0
+    while frontier and level + 1 < max(goals.values()) and tried < limit:
+        level += 1
+        expanded = []
+        for sequence, states in frontier:
+            if tried >= limit:
+                break
+            tried += len(alphabet)
+            for op in alphabet:
+                advanced = advance(states, op)
+                effect = key(advanced)
+                if effect in seen:
+                    continue
+                seen.add(effect)
+                size = goals.get(effect)
+                if size is not None and size > level and size not in found:
+                    found[size] = sequence + (op,)
+                expanded.append((sequence + (op,), advanced))
+        frontier = expanded
+    return sorted(found.items(), key=lambda item: (len(item[1]) - item[0], -item[0]))
+
+def _optimize_run(run, table, window):
+    # Greedy left to right: at each position, the window the table or a
+    # search from the states the run has reached there shortens the most
+    result = []
+    contexts = [start.state() for start in table.starts]
+    checker = Checker(table.seed)
+    i = 0
+    while i < len(run):
+        size, found = 1, run[i:i + 1]
+        for width in range(min(window, len(run) - i), 0, -1):
+            replacement = table.replacement(run[i:i + width])
+            if replacement is not None:
+                size, found = width, replacement
+                break
+        for width, replacement in search(contexts, table.starts, run[i:i + window]):
+            if width - len(replacement) <= size - len(found):
+                break
+            if checker.agree(result, run[i:i + width], replacement):
+                size, found = width, replacement
+                break
+        result.extend(found)
+        for state, start in zip(contexts, table.starts):
+            for op in found:
+                step(state, op, start)
+        i += size
+    return result
+
+def jump_free(opcodes):
+    # (start, stop) of the opcodes no 25/26 can jump into or across: after
+    # the last 26 (which only jumps back) and before the first 25 (which
+    # only jumps forward); start > stop when there are none
+    start = max((pc + 1 for pc, op in enumerate(opcodes) if op == 26), default=0)
+    stop = next((pc for pc, op in enumerate(opcodes) if op == 25), len(opcodes))
+    return start, stop
+
+def optimize(opcodes, table=None, window=WINDOW):
+    # The shortest equivalent of opcodes found window by window, repeated
+    # until a pass changes nothing; in a word with 25/26 only the part
+    # jump_free() gives is touched
+    table = table or Table()
+    current = list(opcodes)
+    while True:
+        start, stop = jump_free(current)
+        if start >= stop:
+            break
+        result = current[:start]
+        run = []
+        for op in current[start:stop] + [None]:
+            if op is None or op in BARRIERS:
+                result += _optimize_run(run, table, window)
+                run = []
+                if op is not None:
+                    result.append(op)
+            else:
+                run.append(op)
+        result += current[stop:]
+        if len(result) == len(current):
+            break
+        current = result
+    return current
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Find the shortest word with the same effect as a sequence of opcodes")
+    parser.add_argument("opcodes", nargs="*", type=int, help="opcodes (1-36) of the target sequence")
+    parser.add_argument("--word", action="append", default=[], help="optimize the opcodes of this word instead")
+    parser.add_argument("--length", type=int, default=LENGTH,
+                        help=f"longest replacement searched for (default: {LENGTH})")
+    parser.add_argument("--window", type=int, default=WINDOW,
+                        help=f"longest run of opcodes replaced at once (default: {WINDOW})")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="worker processes for the search (default: one per core)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the test states")
+    args = parser.parse_args()
+
+    targets = [args.opcodes] if args.opcodes else []
+    targets += [instruction_to_microinstructions(word.lower()) for word in args.word]
+    if not targets:
+        parser.error("no opcodes or --word given")
+    if any(not 1 <= op <= 36 for target in targets for op in target):
+        parser.error("opcodes must be between 1 and 36")
+
+    table = Table(args.length, args.seed, args.jobs)
+    note = "" if table.complete else f", stopped after length {table.length}"
+    print(f"; {len(table)} distinct effects of up to {table.length} opcodes{note}")
+    for target in targets:
+        optimized = optimize(target, table, args.window)
+        print(f"; {len(target)} -> {len(optimized)} opcodes")
+        print(optimized)
+        print(disassemble(optimized))
+        if optimized:
+            print(microinstructions_to_instruction(optimized))
+        else:
+            print("; the opcodes cancel out: the word has no effect")
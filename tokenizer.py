@@ -0,0 +1,171 @@
+# Streaming tokenizer.
+#
+# words(path) yields exactly the words of
+# main.extract_letters_and_spaces(path).split(), but reads the file in
+# CHUNK-byte blocks instead of holding it, and three more copies of it, in
+# memory. Blocks are cut just after a space or line break, bytes that never
+# occur inside a UTF-8 sequence, so no word or character is split between
+# two of them. Pure ASCII blocks are filtered and lowercased with one
+# bytes.translate; others are decoded and filtered per character.
+#
+# WordIndex gives random access to the words of a file: one pass records the
+# byte offset and first word number of every BLOCK-byte block, and a word is
+# found by decoding only its block. StreamedProgram builds on it a (table,
+# program) pair the VM can run without the whole word list ever being
+# loaded: program[n] decodes blocks on demand, keeping the last few, and
+# gives the word a table slot. Only the CACHED_WORDS most recently used
+# distinct words keep theirs; after that the least recently used word's
+# slot is handed to the next new word, and an evicted word that comes back
+# is decoded again. A slot is therefore only good until CACHED_WORDS other
+# distinct words have been looked up, which is plenty for the VM: it reads
+# table[program[n]] straight away.
+
+import array
+import bisect
+import collections
+
+from core import fast_instruction_to_microinstructions
+
+CHUNK = 1 << 20
+
+# Block size for WordIndex, and decoded blocks and distinct words
+# StreamedProgram keeps
+BLOCK = 1 << 16
+CACHED_BLOCKS = 16
+CACHED_WORDS = 1 << 16
+
+# Text mode reading turns \r and \r\n into \n, and \n becomes a space
+SEPARATORS = (b" ", b"\n", b"\r")
+
+_letters = bytes(range(ord("A"), ord("Z") + 1)) + bytes(range(ord("a"), ord("z") + 1))
+_ascii_table = bytes.maketrans(b"\r\n" + _letters[:26], b"  " + _letters[26:])
+_ascii_delete = bytes(byte for byte in range(128) if byte not in _letters + b" \r\n")
+_newlines = str.maketrans("\r\n", "  ")
+
+def _blocks(file, size):
+    # (offset, data) pieces of file, each ending just after a separator
+    # (except the last)
+    offset = 0
+    tail = b""
+    while True:
+        chunk = file.read(size)
+        if not chunk:
+            break
+        data = tail + chunk if tail else chunk
+        cut = max(data.rfind(separator) for separator in SEPARATORS) + 1
+        if cut == 0:
+            tail = data
+            continue
+        yield offset, data[:cut]
+        offset += cut
+        tail = data[cut:]
+    if tail:
+        yield offset, tail
+
+def split(data):
+    # Words of a block of UTF-8 source
+    if data.isascii():
+        return data.translate(_ascii_table, _ascii_delete).decode("ascii").split()
+    text = data.decode("utf-8").translate(_newlines)
+    return "".join(c for c in text if c.isalpha() or c == " ").lower().split()
+
+def words(path, chunk=CHUNK):
+    with open(path, "rb") as file:
+        for offset, data in _blocks(file, chunk):
+            yield from split(data)
+
+def opcodes(path, chunk=CHUNK):
+    # Opcode tuple of every word, decoding each distinct word once
+    decoded = {}
+    for word in words(path, chunk):
+        ops = decoded.get(word)
+        if ops is None:
+            ops = decoded[word] = tuple(fast_instruction_to_microinstructions(word))
+        yield ops
+
+class WordIndex:
+    def __init__(self, path, block=BLOCK):
+        self.path = path
+        self.offsets = array.array("Q")   # byte offset of every block holding words
+        self.lengths = array.array("Q")
+        self.starts = array.array("Q")    # number of its first word
+        self.count = 0
+        self.cached = (None, None)        # (block number, its words)
+        with open(path, "rb") as file:
+            for offset, data in _blocks(file, block):
+                found = len(split(data))
+                if found:
+                    self.offsets.append(offset)
+                    self.lengths.append(len(data))
+                    self.starts.append(self.count)
+                    self.count += found
+
+    def __len__(self):
+        return self.count
+
+    def locate(self, position):
+        # (block number, position within it) of word position
+        if not 0 <= position < self.count:
+            raise IndexError("word index out of range")
+        number = bisect.bisect_right(self.starts, position) - 1
+        return number, position - self.starts[number]
+
+    def block(self, number):
+        with open(self.path, "rb") as file:
+            file.seek(self.offsets[number])
+            return split(file.read(self.lengths[number]))
+
+    def __getitem__(self, position):
+        number, offset = self.locate(position)
+        if self.cached[0] != number:
+            self.cached = (number, self.block(number))
+        return self.cached[1][offset]
+
+class StreamedProgram:
+    # Sequence of table slots, one per word of the indexed file
+    def __init__(self, index, cached=CACHED_BLOCKS, words=CACHED_WORDS):
+        self.decode = fast_instruction_to_microinstructions
+        self.index = index
+        self.table = []                       # opcode tuple per slot, at most words of them
+        self.slots = collections.OrderedDict()  # word -> its slot, least recently used first
+        self.blocks = collections.OrderedDict()
+        self.cached = cached
+        self.words = words
+
+    def __len__(self):
+        return len(self.index)
+
+    def _words(self, number):
+        block = self.blocks.get(number)
+        if block is not None:
+            self.blocks.move_to_end(number)
+            return block
+        block = self.blocks[number] = self.index.block(number)
+        if len(self.blocks) > self.cached:
+            self.blocks.popitem(last=False)
+        return block
+
+    def slot(self, word):
+        slot = self.slots.get(word)
+        if slot is not None:
+            self.slots.move_to_end(word)
+            return slot
+        opcodes = tuple(self.decode(word))
+        if len(self.table) < self.words:
+            slot = len(self.table)
+            self.table.append(opcodes)
+        else:
+            slot = self.slots.popitem(last=False)[1]
+            self.table[slot] = opcodes
+        self.slots[word] = slot
+        return slot
+
+    def __getitem__(self, position):
+        number, offset = self.index.locate(position)
+        return self.slot(self._words(number)[offset])
+
+def load(path, block=BLOCK):
+    # (table, program) for path with words decoded on demand; table is a
+    # list of at most CACHED_WORDS slots, filled and reused as program is read
+    program = StreamedProgram(WordIndex(path, block))
+    return program.table, program
@@ -0,0 +1,251 @@
+# Tracing tier for hot opcode-20 loops.
+#
+# Tracer.run() runs a program on compiler.compile_word functions, as
+# main.run_compiled does, and counts the backward word jumps made by opcode
+# 20. Once a loop head has been jumped back to HOT times, the next iteration
+# is recorded: every word runs through run_word(), which logs the offset
+# (accumulator) every 25/26 took, until control is back at the head. The
+# recorded words become one Python function that runs the iteration over and
+# over without word lookups or calls:
+#
+#     def trace(mem, p1, p2, acc, a, flag, getc, putc):
+#         n = 0
+#         while True:
+#             <opcodes of the recorded path, peephole-optimized>
+#             if acc != 3: return 1, 7, n, p1, p2, acc, a, flag, jm      # a 25/26 offset
+#             ...
+#             if jm != -61: return 4, None, n, p1, p2, acc, a, flag, jm  # an opcode 20 distance
+#             n += 1
+#
+# Each word ending in a 20 is guarded on the distance it set (memory
+# [pointerOne], negated when checkFlag is 0); each 25/26 on the offset it
+# jumped by. A failed guard is a side exit: the trace returns which word it
+# was in, the pc of the 25/26 not yet taken (None when the word is done),
+# the registers and jumpModification, and the interpreter goes on from
+# there. Every iteration that passes all guards took the recorded path, so
+# trace and interpreter always agree.
+#
+# Traces are kept per loop head and checkFlag on entry (loop bodies often
+# branch on it). An entry that exits before completing an iteration counts
+# as a bailout; recording is given up for good on a head whose
+# iteration leaves the program or runs past MAX_OPS opcodes. Tracer.report()
+# lists every trace with its entries, completed iterations and where it
+# exited.
+#
+#     python tracer.py prog.asm [--input FILE] [--hot N]
+
+import collections
+
+import compiler
+import peephole
+
+# Backward jumps to a loop head before its next iteration is recorded
+HOT = 50
+
+# Opcodes (and taken 25/26 offsets) one trace may hold
+MAX_OPS = 20_000
+
+JUMPS = (25, 26)
+NOPS = (35, 36)
+
+def _op_function(op):
+    source = "\n".join(["def op(mem, p1, p2, acc, a, flag, jm, getc, putc):"]
+                       + ["    " + line for line in compiler.STATEMENTS[op].split("\n")]
+                       + ["    return p1, p2, acc, a, flag, jm"])
+    namespace = {}
+    exec(compile(source, "<sarcasm opcode>", "exec"), namespace)
+    return namespace["op"]
+
+# opcode -> function running it on explicit registers (25/26 are run_word's)
+OPS = {op: _op_function(op) for op in compiler.STATEMENTS}
+
+def run_word(opcodes, pc, registers, jm, mem, getc, putc, path=None):
+    # Runs a word from pc to its end; registers is (p1, p2, acc, a, flag).
+    # Returns (registers, jm). path, if given, gets (pc, offset) for every
+    # 25/26 taken, up to MAX_OPS of them.
+    p1, p2, acc, a, flag = registers
+    while pc < len(opcodes):
+        op = opcodes[pc]
+        if op in JUMPS:
+            if path is not None and len(path) < MAX_OPS:
+                path.append((pc, acc))
+            pc = pc + 1 + acc if op == 25 else max(pc + 1 - acc, 0)
+            continue
+        p1, p2, acc, a, flag, jm = OPS[op](mem, p1, p2, acc, a, flag, jm, getc, putc)
+        pc += 1
+    return (p1, p2, acc, a, flag), jm
+
+def _statement(instr):
+    if isinstance(instr, int):
+        return compiler.STATEMENTS[instr]
+    return compiler.SUPERINSTRUCTIONS[instr[0]].format(instr[1])
+
+def trace_source(steps):
+    # steps: (position, opcodes, path, jm) per recorded word, path being the
+    # word's 25/26 log (None for words without them)
+    lines = ["def trace(mem, p1, p2, acc, a, flag, getc, putc):", "    n = 0", "    while True:"]
+    pending = []
+
+    def flush():
+        if pending:
+            instrs, removed = peephole.optimize([op for op in pending if op not in NOPS])
+            for instr in instrs:
+                lines.extend("        " + line for line in _statement(instr).split("\n"))
+            pending.clear()
+
+    def side_exit(index, pc, condition):
+        flush()
+        lines.append(f"        if {condition}: return {index}, {pc}, n, p1, p2, acc, a, flag, jm")
+
+    for index, (position, opcodes, path, jm) in enumerate(steps):
+        if path is None:
+            pending.extend(opcodes)
+        else:
+            flush()
+            lines.append("        jm = 0")
+            pc = 0
+            for at, offset in path:
+                pending.extend(opcodes[pc:at])
+                side_exit(index, at, f"acc != {offset}")
+                pc = at + 1 + offset if opcodes[at] == 25 else max(at + 1 - offset, 0)
+            pending.extend(opcodes[pc:])
+        if 20 in opcodes:
+            side_exit(index, None, f"jm != {jm}")
+    flush()
+    lines.append("        n += 1")
+    return "\n".join(lines)
+
+class Trace:
+    def __init__(self, head, flag, steps):
+        self.head = head
+        self.flag = flag                          # checkFlag the trace is entered with
+        self.positions = [step[0] for step in steps]
+        namespace = {}
+        exec(compile(trace_source(steps), f"<sarcasm trace {head}>", "exec"), namespace)
+        self.function = namespace["trace"]
+        self.entries = 0
+        self.iterations = 0
+        self.bailouts = 0                         # entries that exited before completing an iteration
+        self.exits = collections.Counter()        # word position -> side exits taken there
+
+class Tracer:
+    def __init__(self, table, program, hot=HOT):
+        self.table = table
+        self.program = program
+        self.hot = hot
+        self.traces = []
+        self.aborted = 0                          # recordings given up
+
+    def record(self, head, registers, mem, getc, putc):
+        # Runs words from head until control comes back to it. Returns
+        # (registers, next position, jm, steps), steps being None when the
+        # recording was given up.
+        table, program = self.table, self.program
+        steps = []
+        ops = 0
+        position = head
+        while True:
+            opcodes = table[program[position]]
+            path = [] if any(op in JUMPS for op in opcodes) else None
+            registers, jm = run_word(opcodes, 0, registers, 0, mem, getc, putc, path)
+            steps.append((position, opcodes, path, jm))
+            ops += len(opcodes) * (1 + len(path or ()))
+            position += jm + 1
+            if position == head:
+                return registers, position, jm, steps
+            if not 0 <= position < len(program) or ops > MAX_OPS:
+                return registers, position, jm, None
+
+    def run(self, mem, getc, putc):
+        # Returns the final (pointerOne, pointerTwo, accumulator, registerA,
+        # checkFlag, overheadPC)
+        table, program = self.table, self.program
+        words = [None] * len(table)
+        heads = [None] * len(program)             # position -> {checkFlag: Trace}
+        heat = collections.Counter()
+        given_up = set()
+
+        p1 = p2 = acc = a = flag = 0
+        overheadPC = 0
+        jm = 0
+        while overheadPC < len(program):
+            if overheadPC >= 0:
+                traces = heads[overheadPC]
+                trace = traces.get(flag) if traces is not None else None
+                if trace is not None:
+                    index, pc, n, p1, p2, acc, a, flag, jm = trace.function(mem, p1, p2, acc, a, flag, getc, putc)
+                    position = trace.positions[index]
+                    trace.entries += 1
+                    trace.iterations += n
+                    trace.bailouts += not n
+                    trace.exits[position] += 1
+                    if pc is not None:
+                        (p1, p2, acc, a, flag), jm = run_word(table[program[position]], pc,
+                                                               (p1, p2, acc, a, flag), jm, mem, getc, putc)
+                    overheadPC = position + jm + 1
+                    continue
+
+                slot = program[overheadPC]
+                word = words[slot]
+                if word is None:
+                    word = words[slot] = compiler.compile_word(table[slot])
+                p1, p2, acc, a, flag, jm = word(mem, p1, p2, acc, a, flag, getc, putc)
+                if jm < 0:
+                    head = overheadPC + jm + 1
+                    heat[head] += 1
+                    if heat[head] >= self.hot and head >= 0 and head not in given_up and \
+                            (heads[head] is None or flag not in heads[head]):
+                        entry_flag = flag
+                        (p1, p2, acc, a, flag), overheadPC, jm, steps = self.record(
+                            head, (p1, p2, acc, a, flag), mem, getc, putc)
+                        if steps is None:
+                            given_up.add(head)
+                            self.aborted += 1
+                        else:
+                            trace = Trace(head, entry_flag, steps)
+                            self.traces.append(trace)
+                            heads[head] = heads[head] or {}
+                            heads[head][entry_flag] = trace
+                        continue
+            overheadPC += jm + 1
+        return p1, p2, acc, a, flag, overheadPC
+
+    def summary(self):
+        entries = sum(trace.entries for trace in self.traces)
+        iterations = sum(trace.iterations for trace in self.traces)
+        bailouts = sum(trace.bailouts for trace in self.traces)
+        return (f"tracer: {len(self.traces)} traces entered {entries} times, {iterations} iterations in traces, "
+                f"{bailouts} bailouts before a full iteration, {self.aborted} recordings given up")
+
+    def report(self):
+        lines = [self.summary()]
+        for trace in sorted(self.traces, key=lambda trace: -trace.iterations):
+            lines.append(f"  head {trace.head} (checkFlag {trace.flag}, {len(trace.positions)} words): "
+                         f"{trace.entries} entries, {trace.iterations} iterations, {trace.bailouts} bailouts")
+            for position, count in trace.exits.most_common():
+                lines.append(f"    exit at word {position}: {count}")
+        return "\n".join(lines)
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    import main
+    from core import new_memory
+    from streams import MemoryInput, to_char
+
+    parser = argparse.ArgumentParser(description="Run a SARCASM program with hot loops traced, and report the traces")
+    parser.add_argument("filename")
+    parser.add_argument("--input", help="file to read input from (default: none)")
+    parser.add_argument("--hot", type=int, default=HOT, help=f"backward jumps before a loop is traced (default: {HOT})")
+    args = parser.parse_args()
+
+    data = b""
+    if args.input:
+        with open(args.input, "rb") as file:
+            data = file.read()
+    table, program = main.read_program(args.filename)
+    tracer = Tracer(table, program, args.hot)
+    tracer.run(new_memory(), MemoryInput(data).getc, lambda value: sys.stdout.write(to_char(value)))
+    sys.stdout.flush()
+    print(tracer.report(), file=sys.stderr)
@@ -0,0 +1,229 @@
+# Resumable interpreter core.
+#
+# A VM holds the whole machine state of one running program: memory, the
+# registers, overheadPC (the word being run), pc (the microinstruction within
+# it) and jumpModification. run(max_steps) executes up to max_steps
+# microinstructions through the reference dispatch chain and returns
+#
+#     HALTED    overheadPC ran past the last word; the program is finished
+#     RUNNING   the step budget ran out; call run() again to continue
+#     WAITING   getc() returned WAIT: no input yet; run() again retries the 29
+#
+# so a host can interleave many VMs, or pause one, with the per-step cost
+# staying that of a plain loop. Registers live in locals while run() is
+# going and are written back to the VM when it returns (also when an
+# opcode 15 raises ZeroDivisionError, with pc left on the 15).
+#
+# Every memory write also sets dirty[address >> PAGE_BITS], so snapshot.py
+# can tell which pages changed since the snapshot in clean without looking
+# at the others. Code that writes vm.memory outside run() has to do the same.
+#
+# main.run_reference and workspace.run_snippet are frontends over this.
+
+import array
+
+MEMORY_SIZE = 65536
+
+# Memory pages of 1 << PAGE_BITS cells, as dirty tracks them
+PAGE_BITS = 8          # inlined as >> 8 in run()
+
+HALTED = 0
+RUNNING = 1
+WAITING = 4    # 2 and 3 are lockstep.FAULTED and watchdog.LOOPING
+
+# What getc() returns when input may still come but is not there yet
+WAIT = object()
+
+class VM:
+    def __init__(self, table, program, getc=None, putc=None, memory=None):
+        # getc() returns the next input value, None to leave the cell as it
+        # is, or WAIT to stop run() until there is input; putc(value)
+        # receives every output value
+        self.table = table
+        self.program = program
+        self.getc = getc if getc is not None else (lambda: 0)
+        self.putc = putc if putc is not None else (lambda val: None)
+        self.memory = memory if memory is not None else array.array('H', bytes(2 * MEMORY_SIZE))
+        self.dirty = bytearray(MEMORY_SIZE >> PAGE_BITS)   # 1 for pages written since clean was taken
+        self.clean = None                                   # snapshot memory matched then (snapshot.py)
+
+        self.pointerOne = 0
+        self.pointerTwo = 0
+        self.accumulator = 0
+        self.registerA = 0
+        self.checkFlag = 0
+        self.overheadPC = 0
+        self.jumpModification = 0
+        self.pc = 0
+        self.in_word = False   # pc is inside word overheadPC
+        self.steps = 0         # budget used so far: microinstructions, plus idle turns while overheadPC < 0
+
+    def registers(self):
+        # Same tuple the main.py engines return
+        return self.pointerOne, self.pointerTwo, self.accumulator, self.registerA, self.checkFlag, self.overheadPC
+
+    @property
+    def halted(self):
+        return not self.in_word and self.overheadPC >= len(self.program)
+
+    def run(self, max_steps=None, one_word=False):
+        # one_word returns as soon as the current word ends, before the next
+        # one starts, so jumpModification is still the one it set
+        table = self.table
+        program = self.program
+        memory = self.memory
+        dirty = self.dirty
+        getc = self.getc
+        putc = self.putc
+
+        pointerOne = self.pointerOne
+        pointerTwo = self.pointerTwo
+        accumulator = self.accumulator
+        registerA = self.registerA
+        checkFlag = self.checkFlag
+        overheadPC = self.overheadPC
+        jumpModification = self.jumpModification
+        pc = self.pc
+        in_word = self.in_word
+
+        # Counts down to 0; -1 never gets there
+        budget = start = -1 if max_steps is None else max_steps
+        status = RUNNING
+        try:
+            while True:
+                if not in_word:
+                    if overheadPC >= len(program):
+                        status = HALTED
+                        break
+                    if overheadPC < 0:
+                        # No word runs again: overheadPC moves by
+                        # jumpModification + 1 <= 0 forever
+                        if budget < 0:
+                            overheadPC += jumpModification + 1
+                            continue
+                        overheadPC += (jumpModification + 1) * budget
+                        budget = 0
+                        break
+                    pc = 0
+                    jumpModification = 0
+                    in_word = True
+                opcodes = table[program[overheadPC]]
+                while pc < len(opcodes):
+                    if budget == 0:
+                        break
+                    budget -= 1
+                    opcode = opcodes[pc]
+                    if opcode == 1:
+                        pointerOne = (pointerOne + 1) & 0xFFFF
+                    elif opcode == 2:
+                        pointerTwo = (pointerTwo + 1) & 0xFFFF
+                    elif opcode == 3:
+                        pointerOne = accumulator
+                    elif opcode == 4:
+                        pointerTwo = accumulator
+                    elif opcode == 5:
+                        pointerOne = memory[pointerOne]
+                    elif opcode == 6:
+                        pointerTwo = memory[pointerOne]
+                    elif opcode == 7:
+                        memory[pointerOne] = memory[pointerTwo]
+                        dirty[pointerOne >> 8] = 1
+                    elif opcode == 8:
+                        memory[pointerTwo] = memory[pointerOne]
+                        dirty[pointerTwo >> 8] = 1
+                    elif opcode == 9:
+                        memory[pointerOne], memory[pointerTwo] = memory[pointerTwo], memory[pointerOne]
+                        dirty[pointerOne >> 8] = dirty[pointerTwo >> 8] = 1
+                    elif opcode == 10:
+                        memory[pointerOne] = 0
+                        dirty[pointerOne >> 8] = 1
+                    elif opcode == 11:
+                        memory[pointerTwo] = 0
+                        dirty[pointerTwo >> 8] = 1
+                    elif opcode == 12:
+                        accumulator = (accumulator + registerA) & 0xFFFF
+                    elif opcode == 13:
+                        accumulator = (accumulator - registerA) & 0xFFFF
+                    elif opcode == 14:
+                        accumulator = (accumulator * registerA) & 0xFFFF
+                    elif opcode == 15:
+                        accumulator //= registerA
+                    elif opcode == 16:
+                        accumulator = registerA
+                    elif opcode == 17:
+                        accumulator = (accumulator * accumulator) & 0xFFFF
+                    elif opcode == 18:
+                        registerA = memory[pointerOne]
+                    elif opcode == 19:
+                        registerA = memory[pointerTwo]
+                    elif opcode == 20:
+                        if checkFlag == 1:
+                            jumpModification = memory[pointerOne]
+                        else:
+                            jumpModification = -memory[pointerOne]
+                    elif opcode == 21:
+                        memory[pointerOne] = (memory[pointerOne] + 1) & 0xFFFF
+                        dirty[pointerOne >> 8] = 1
+                    elif opcode == 22:
+                        memory[pointerTwo] = (memory[pointerTwo] + 1) & 0xFFFF
+                        dirty[pointerTwo >> 8] = 1
+                    elif opcode == 23:
+                        memory[pointerOne] = (memory[pointerOne] - 1) & 0xFFFF
+                        dirty[pointerOne >> 8] = 1
+                    elif opcode == 24:
+                        memory[pointerTwo] = (memory[pointerTwo] - 1) & 0xFFFF
+                        dirty[pointerTwo >> 8] = 1
+                    elif opcode == 25:
+                        pc += accumulator
+                    elif opcode == 26:
+                        # A negative pc only counts back up to 0, so go straight there
+                        pc -= accumulator
+                        if pc < -1:
+                            pc = -1
+                    elif opcode == 27:
+                        memory[pointerOne] = accumulator
+                        dirty[pointerOne >> 8] = 1
+                    elif opcode == 28:
+                        memory[pointerTwo] = accumulator
+                        dirty[pointerTwo >> 8] = 1
+                    elif opcode == 29:
+                        char = getc()
+                        if char is WAIT:
+                            # Not executed: pc stays on the 29 and it is not counted
+                            budget += 1
+                            status = WAITING
+                            break
+                        if char is not None:
+                            memory[pointerOne] = char & 0xFFFF
+                            dirty[pointerOne >> 8] = 1
+                    elif opcode == 30:
+                        putc(memory[pointerOne])
+                    elif opcode == 31:
+                        checkFlag = 1 if accumulator == registerA else 0
+                    elif opcode == 32:
+                        checkFlag = 1 if accumulator < registerA else 0
+                    elif opcode == 33:
+                        accumulator = checkFlag
+                    elif opcode == 34:
+                        checkFlag = 1 - checkFlag
+                    pc += 1
+                else:
+                    in_word = False
+                    overheadPC += jumpModification
+                    overheadPC += 1
+                    if one_word:
+                        break
+                    continue
+                break
+        finally:
+            self.steps += start - budget
+            self.pointerOne = pointerOne
+            self.pointerTwo = pointerTwo
+            self.accumulator = accumulator
+            self.registerA = registerA
+            self.checkFlag = checkFlag
+            self.overheadPC = overheadPC
+            self.jumpModification = jumpModification
+            self.pc = pc
+            self.in_word = in_word
+        return status
@@ -0,0 +1,288 @@
+# Infinite-loop watchdog.
+#
+# WatchedVM is a vm.VM whose run() also proves non-termination: the machine
+# is deterministic between I/O events, so once its complete state repeats
+# without an IN or OUT in between, it will repeat forever. Comparing 64K
+# memory cells every step would cost far too much, so memory is summarised
+# by a Zobrist-style hash, sum(memory[addr] * key[addr]) mod 2**64 with a
+# random 64-bit key per address, which every memory write (opcodes 7-11,
+# 21-24, 27-29) updates in constant time.
+#
+# The state is sampled at every word start and after every 25/26, which
+# every infinite loop keeps passing through: (memory hash, registers, flag,
+# overheadPC, pc, jumpModification). Brent's cycle detection compares each
+# sample with a saved one that is moved forward at powers of two, so only
+# O(log n) full memory copies are ever taken; a hash match is confirmed
+# against the saved copy, so a reported loop is never a hash collision. IN
+# and OUT forget all samples. A negative overheadPC is reported at once, as
+# no word can run again.
+#
+# run() returns LOOPING when it finds a loop and leaves a Loop describing it
+# in vm.loop, with the VM stopped where the repeat was seen. Normal runs use
+# vm.VM and pay nothing for any of this.
+
+import array
+import random
+
+from vm import VM, HALTED, RUNNING, WAIT, WAITING
+
+# Status returned by WatchedVM.run (lockstep.FAULTED is 2)
+LOOPING = 3
+
+MASK = (1 << 64) - 1
+
+# Steps replayed to find the words and pcs a loop covers
+TRACE_LIMIT = 1_000_000
+
+_keys = None
+
+def zobrist_keys():
+    global _keys
+    if _keys is None:
+        _keys = array.array('Q', random.Random(0x5A4C).randbytes(8 * 65536))
+    return _keys
+
+class Loop:
+    def __init__(self, period=None, words=None, overheadPC=None):
+        self.period = period          # steps per repetition
+        self.words = words or {}      # word position -> (lowest pc, highest pc) run in the loop
+        self.overheadPC = overheadPC  # set when overheadPC went negative instead
+
+    def __str__(self):
+        if self.overheadPC is not None:
+            return f"overheadPC went negative ({self.overheadPC}), no word can run again"
+        spans = ", ".join(f"word {word} pc {low:04X}-{high:04X}" for word, (low, high) in sorted(self.words.items()))
+        if self.words:
+            where = f"words {min(self.words)}-{max(self.words)} ({spans})"
+        else:
+            where = "no words"
+        return f"infinite loop over {where}, repeating every {self.period} steps"
+
+class WatchedVM(VM):
+    def __init__(self, table, program, getc=None, putc=None, memory=None):
+        super().__init__(table, program, getc, putc, memory)
+        keys = self.keys = zobrist_keys()
+        self.memory_hash = sum(value * keys[addr] for addr, value in enumerate(self.memory) if value) & MASK
+        self.loop = None
+        self.forget()
+
+    def forget(self):
+        # Drops every sample, e.g. after I/O
+        self.tortoise = None
+        self.tortoise_memory = None
+        self.tortoise_steps = 0
+        self.power = 1
+        self.lam = 1
+
+    def sample(self, key, steps):
+        # Brent's algorithm over the sampled states; returns True when key
+        # repeats the saved state exactly
+        if self.tortoise is None:
+            self.tortoise = key
+            self.tortoise_memory = array.array('H', self.memory)
+            self.tortoise_steps = steps
+            return False
+        if key == self.tortoise and self.memory == self.tortoise_memory:
+            return True
+        if self.lam == self.power:
+            self.tortoise = key
+            self.tortoise_memory = array.array('H', self.memory)
+            self.tortoise_steps = steps
+            self.power *= 2
+            self.lam = 0
+        self.lam += 1
+        return False
+
+    def trace(self, period):
+        # Replays one repetition (plain VM steps; memory ends up as it was,
+        # so the hash stays valid) and collects the pc range of each word
+        words = {}
+        steps = self.steps
+        for _ in range(min(period, TRACE_LIMIT)):
+            word = self.overheadPC
+            pc = self.pc if self.in_word else 0
+            low, high = words.get(word, (pc, pc))
+            words[word] = (min(low, pc), max(high, pc))
+            VM.run(self, 1)
+        self.steps = steps
+        return words
+
+    def run(self, max_steps=None):
+        table = self.table
+        program = self.program
+        memory = self.memory
+        dirty = self.dirty
+        getc = self.getc
+        putc = self.putc
+        keys = self.keys
+        memory_hash = self.memory_hash
+
+        pointerOne = self.pointerOne
+        pointerTwo = self.pointerTwo
+        accumulator = self.accumulator
+        registerA = self.registerA
+        checkFlag = self.checkFlag
+        overheadPC = self.overheadPC
+        jumpModification = self.jumpModification
+        pc = self.pc
+        in_word = self.in_word
+
+        budget = start = -1 if max_steps is None else max_steps
+        status = RUNNING
+        try:
+            while True:
+                if not in_word:
+                    if overheadPC >= len(program):
+                        status = HALTED
+                        break
+                    if overheadPC < 0:
+                        self.loop = Loop(overheadPC=overheadPC)
+                        status = LOOPING
+                        break
+                    if self.sample((memory_hash, pointerOne, pointerTwo, accumulator, registerA, checkFlag,
+                                    overheadPC, 0, 0), self.steps + start - budget):
+                        status = LOOPING
+                        break
+                    pc = 0
+                    jumpModification = 0
+                    in_word = True
+                opcodes = table[program[overheadPC]]
+                while pc < len(opcodes):
+                    if budget == 0:
+                        break
+                    budget -= 1
+                    opcode = opcodes[pc]
+                    if opcode == 1:
+                        pointerOne = (pointerOne + 1) & 0xFFFF
+                    elif opcode == 2:
+                        pointerTwo = (pointerTwo + 1) & 0xFFFF
+                    elif opcode == 3:
+                        pointerOne = accumulator
+                    elif opcode == 4:
+                        pointerTwo = accumulator
+                    elif opcode == 5:
+                        pointerOne = memory[pointerOne]
+                    elif opcode == 6:
+                        pointerTwo = memory[pointerOne]
+                    elif opcode == 7:
+                        value = memory[pointerTwo]
+                        memory_hash = (memory_hash + (value - memory[pointerOne]) * keys[pointerOne]) & MASK
+                        memory[pointerOne] = value
+                        dirty[pointerOne >> 8] = 1
+                    elif opcode == 8:
+                        value = memory[pointerOne]
+                        memory_hash = (memory_hash + (value - memory[pointerTwo]) * keys[pointerTwo]) & MASK
+                        memory[pointerTwo] = value
+                        dirty[pointerTwo >> 8] = 1
+                    elif opcode == 9:
+                        first, second = memory[pointerTwo], memory[pointerOne]
+                        if pointerOne != pointerTwo:
+                            memory_hash = (memory_hash + (first - second) * (keys[pointerOne] - keys[pointerTwo])) & MASK
+                        memory[pointerOne], memory[pointerTwo] = first, second
+                        dirty[pointerOne >> 8] = dirty[pointerTwo >> 8] = 1
+                    elif opcode == 10:
+                        memory_hash = (memory_hash - memory[pointerOne] * keys[pointerOne]) & MASK
+                        memory[pointerOne] = 0
+                        dirty[pointerOne >> 8] = 1
+                    elif opcode == 11:
+                        memory_hash = (memory_hash - memory[pointerTwo] * keys[pointerTwo]) & MASK
+                        memory[pointerTwo] = 0
+                        dirty[pointerTwo >> 8] = 1
+                    elif opcode == 12:
+                        accumulator = (accumulator + registerA) & 0xFFFF
+                    elif opcode == 13:
+                        accumulator = (accumulator - registerA) & 0xFFFF
+                    elif opcode == 14:
+                        accumulator = (accumulator * registerA) & 0xFFFF
+                    elif opcode == 15:
+                        accumulator //= registerA
+                    elif opcode == 16:
+                        accumulator = registerA
+                    elif opcode == 17:
+                        accumulator = (accumulator * accumulator) & 0xFFFF
+                    elif opcode == 18:
+                        registerA = memory[pointerOne]
+                    elif opcode == 19:
+                        registerA = memory[pointerTwo]
+                    elif opcode == 20:
+                        if checkFlag == 1:
+                            jumpModification = memory[pointerOne]
+                        else:
+                            jumpModification = -memory[pointerOne]
+                    elif opcode == 21 or opcode == 23:
+                        value = (memory[pointerOne] + (1 if opcode == 21 else -1)) & 0xFFFF
+                        memory_hash = (memory_hash + (value - memory[pointerOne]) * keys[pointerOne]) & MASK
+                        memory[pointerOne] = value
+                        dirty[pointerOne >> 8] = 1
+                    elif opcode == 22 or opcode == 24:
+                        value = (memory[pointerTwo] + (1 if opcode == 22 else -1)) & 0xFFFF
+                        memory_hash = (memory_hash + (value - memory[pointerTwo]) * keys[pointerTwo]) & MASK
+                        memory[pointerTwo] = value
+                        dirty[pointerTwo >> 8] = 1
+                    elif opcode == 25 or opcode == 26:
+                        if opcode == 25:
+                            pc += accumulator
+                        else:
+                            pc -= accumulator
+                            if pc < -1:
+                                pc = -1
+                        if self.sample((memory_hash, pointerOne, pointerTwo, accumulator, registerA, checkFlag,
+                                        overheadPC, pc + 1, jumpModification), self.steps + start - budget):
+                            pc += 1
+                            status = LOOPING
+                            break
+                    elif opcode == 27:
+                        memory_hash = (memory_hash + (accumulator - memory[pointerOne]) * keys[pointerOne]) & MASK
+                        memory[pointerOne] = accumulator
+                        dirty[pointerOne >> 8] = 1
+                    elif opcode == 28:
+                        memory_hash = (memory_hash + (accumulator - memory[pointerTwo]) * keys[pointerTwo]) & MASK
+                        memory[pointerTwo] = accumulator
+                        dirty[pointerTwo >> 8] = 1
+                    elif opcode == 29:
+                        self.forget()
+                        char = getc()
+                        if char is WAIT:
+                            # As in VM.run: pc stays on the 29 and it is not counted
+                            budget += 1
+                            status = WAITING
+                            break
+                        if char is not None:
+                            value = char & 0xFFFF
+                            memory_hash = (memory_hash + (value - memory[pointerOne]) * keys[pointerOne]) & MASK
+                            memory[pointerOne] = value
+                            dirty[pointerOne >> 8] = 1
+                    elif opcode == 30:
+                        self.forget()
+                        putc(memory[pointerOne])
+                    elif opcode == 31:
+                        checkFlag = 1 if accumulator == registerA else 0
+                    elif opcode == 32:
+                        checkFlag = 1 if accumulator < registerA else 0
+                    elif opcode == 33:
+                        accumulator = checkFlag
+                    elif opcode == 34:
+                        checkFlag = 1 - checkFlag
+                    pc += 1
+                else:
+                    in_word = False
+                    overheadPC += jumpModification
+                    overheadPC += 1
+                    continue
+                break
+        finally:
+            self.steps += start - budget
+            self.memory_hash = memory_hash
+            self.pointerOne = pointerOne
+            self.pointerTwo = pointerTwo
+            self.accumulator = accumulator
+            self.registerA = registerA
+            self.checkFlag = checkFlag
+            self.overheadPC = overheadPC
+            self.jumpModification = jumpModification
+            self.pc = pc
+            self.in_word = in_word
+        if status == LOOPING and self.loop is None:
+            period = self.steps - self.tortoise_steps
+            self.loop = Loop(period, self.trace(period))
+        return status